@@ -4,6 +4,18 @@ import axios from 'axios';
 import './Selector.css';
 
 const apiUrl = process.env.REACT_APP_API_GATEWAY_URL;
+// Most ids the API accepts in one POST (MAX_SELECTED_FOODS in food_suggestion_function.py)
+const MAX_IDS_PER_POST = 100;
+
+// Anonymous id kept per browser so each visitor gets their own preferences
+const getUserId = () => {
+    let userId = localStorage.getItem('flavorBuddyUserId');
+    if (!userId) {
+        userId = crypto.randomUUID();
+        localStorage.setItem('flavorBuddyUserId', userId);
+    }
+    return userId;
+};
 
 const Selector = () => {
     const [buttonNames, setButtonNames] = useState([]);
@@ -34,32 +46,38 @@ const Selector = () => {
         }
     };
 
-    const handleButtonClick = async (buttonName) => {
-        try {
-            await axios.post(`${apiUrl}`, { id: buttonName });
-            setSelectedItems([...selectedItems, buttonName]);
+    const handleButtonClick = (buttonName) => {
+        // Selections are kept locally and sent in one POST when finishing
+        setSelectedItems([...selectedItems, buttonName]);
 
-            // Decrement remaining sets but ensure it doesn't go below 0
-            setRemainingSets(prev => (prev > 0 ? prev - 1 : 0));
+        // Decrement remaining sets but ensure it doesn't go below 0
+        setRemainingSets(prev => (prev > 0 ? prev - 1 : 0));
 
-            fetchButtonNames();
-        } catch (error) {
-            console.error('Error making POST request:', error);
-        }
+        fetchButtonNames();
     };
 
     const handleFinishClick = async () => {
         try {
-            const response = await axios.get(`${apiUrl}`, {
-                params: {
-                    requested_item: 'food_suggestions'
-                }
+            // A food picked twice counts once, and long sessions are sent in several POSTs
+            const ids = [...new Set(selectedItems)];
+            const userId = getUserId();
+            for (let start = MAX_IDS_PER_POST; start < ids.length; start += MAX_IDS_PER_POST) {
+                await axios.post(`${apiUrl}`, {
+                    ids: ids.slice(start - MAX_IDS_PER_POST, start),
+                    user_id: userId
+                });
+            }
+            // The last POST records the remaining selections and returns the updated suggestions
+            const response = await axios.post(`${apiUrl}`, {
+                ids: ids.slice(Math.floor((ids.length - 1) / MAX_IDS_PER_POST) * MAX_IDS_PER_POST),
+                user_id: userId,
+                requested_item: 'food_suggestions'
             });
 
-            const suggestions = response.data;
+            const suggestions = response.data.food_suggestions;
             navigate('/suggestions', { state: { suggestions } });
         } catch (error) {
-            console.error('Error fetching suggestions:', error);
+            console.error('Error making POST request:', error);
         }
     };
 
@@ -0,0 +1,294 @@
+"""
+Benchmark the Lambda handler against an in-process DynamoDB stand-in.
+
+Each catalog size runs in its own subprocess so peak RSS is measured per
+size. Results are written as JSON and can be compared against a saved
+baseline:
+
+    python benchmarks/bench_handler.py --sizes 1000 10000 --output baseline.json
+    python benchmarks/bench_handler.py --sizes 1000 10000 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARK_DIR, '..', 'lambda_functions')
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+# Keep per-request metric lines out of the results printed on stdout
+os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+
+from benchmarks.fake_dynamodb import FakeDynamoDB
+
+# Cold-start budget for importing the handler module
+COLD_START_TARGET_MS = 150
+
+# Run in a fresh interpreter: time the handler import, then the lazy client creation
+COLD_START_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import food_suggestion_function
+imported = time.perf_counter()
+import dynamo
+dynamo.get_client()
+created = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'client_init_ms': (created - imported) * 1000}))
+"""
+
+
+def synthetic_foods(count: int, food_attributes, density: float, seed: int = 0) -> list:
+    """Generate `count` foods, each having every attribute with probability `density`."""
+    rng = random.Random(seed)
+    return [
+        dict({'id': f'food-{i:07d}'}, **{attribute: rng.random() < density for attribute in food_attributes})
+        for i in range(count)
+    ]
+
+
+def synthetic_user(user_id: str, user_attributes, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {'id': user_id, 'preferences': {attribute: rng.randint(0, 5) for attribute in user_attributes}}
+
+
+def install(module, dynamodb: FakeDynamoDB) -> None:
+    """Point the Lambda module at the stand-in tables and drop its caches."""
+    module.dynamodb = dynamodb
+    module.table = dynamodb.Table('Metadata')
+    module.food_table = dynamodb.Table('Foods')
+    module.user_table = dynamodb.Table('Users')
+    module.catalog_cache.invalidate()
+    module.user_cache.clear()
+    module.ranker_cache.clear()
+    module.suggestion_cache.clear()
+
+
+def seed(module, dynamodb: FakeDynamoDB, foods: list, users: list) -> None:
+    """Load the catalog and users the way add_food_data would leave them."""
+    import food_catalog
+    import user_preferences
+
+    dynamodb.Table('Foods').load(foods)
+    dynamodb.Table('Users').load(map(user_preferences.seed_item, users))
+    food_catalog.write_food_index(dynamodb, dynamodb.Table('Metadata'), [food['id'] for food in foods])
+    food_catalog.bump_catalog_version(dynamodb.Table('Metadata'))
+    dynamodb.calls.clear()
+
+
+def get_event(params: dict) -> dict:
+    return {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': {}}
+
+
+def post_event(body: dict) -> dict:
+    return {'httpMethod': 'POST', 'body': json.dumps(body), 'headers': {}}
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(module, make_event, iterations: int, dynamodb: FakeDynamoDB) -> dict:
+    """Invoke the handler `iterations` times and summarise latency in ms."""
+    dynamodb.calls.clear()
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        event = make_event()
+        call_start = time.perf_counter()
+        response = module.handler(event, None)
+        latencies.append((time.perf_counter() - call_start) * 1000)
+        errors += response['statusCode'] >= 400
+    elapsed = time.perf_counter() - start
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'throughput_rps': round(iterations / elapsed, 1),
+        'dynamodb_calls_per_request': {
+            operation: round(count / iterations, 2) for operation, count in sorted(dynamodb.calls.items())
+        },
+    }
+
+
+def run_size(size: int, density: float, iterations: int, latency_ms: float) -> dict:
+    """Benchmark every scenario against a catalog of `size` foods."""
+    import attributes
+    import food_suggestion_function
+
+    dynamodb = FakeDynamoDB(latency_ms=latency_ms)
+    foods = synthetic_foods(size, attributes.FOOD_ATTRIBUTES, density)
+    food_ids = [food['id'] for food in foods]
+    seed(food_suggestion_function, dynamodb, foods, [synthetic_user('User123', attributes.USER_ATTRIBUTES)])
+    install(food_suggestion_function, dynamodb)
+    rng = random.Random(1)
+
+    results = {}
+    suggestions_event = lambda: get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'})
+
+    def uncached(make_event):
+        # Dropping cached responses outside the timed call measures the ranking itself
+        def make_uncached_event():
+            food_suggestion_function.suggestion_cache.clear()
+            return make_event()
+        return make_uncached_event
+
+    # The first suggestion request pays for loading the catalog into the cache
+    results['catalog_load'] = measure(food_suggestion_function, suggestions_event, 1, dynamodb)
+    results['random_food'] = measure(
+        food_suggestion_function, lambda: get_event({'requested_item': 'random_food'}), iterations, dynamodb
+    )
+    results['food_suggestions'] = measure(food_suggestion_function, uncached(suggestions_event), iterations, dynamodb)
+    # Repeated refreshes, answered from the response cache, with and without the client's ETag
+    results['food_suggestions_cached'] = measure(food_suggestion_function, suggestions_event, iterations, dynamodb)
+    etag = food_suggestion_function.handler(suggestions_event(), None)['headers']['ETag']
+    results['food_suggestions_304'] = measure(
+        food_suggestion_function, lambda: dict(suggestions_event(), headers={'If-None-Match': etag}), iterations, dynamodb
+    )
+    # First requests of new users: the user get_item overlaps the catalog version check
+    visitors = iter(range(1 << 30))
+    results['food_suggestions_new_user'] = measure(
+        food_suggestion_function,
+        lambda: get_event({'requested_item': 'food_suggestions', 'user_id': f'visitor-{next(visitors)}'}),
+        iterations, dynamodb
+    )
+    # Cost of each ranking strategy on the same warm catalog and user
+    for strategy in food_suggestion_function.ranking_strategies:
+        strategy_event = lambda: get_event(
+            {'requested_item': 'food_suggestions', 'user_id': 'User123', 'strategy': strategy}
+        )
+        results[f'strategy_{strategy}'] = measure(food_suggestion_function, uncached(strategy_event), iterations, dynamodb)
+    results['post_preference'] = measure(
+        food_suggestion_function, lambda: post_event({'id': rng.choice(food_ids), 'user_id': 'User123'}),
+        iterations, dynamodb
+    )
+    # What the frontend sends when a visitor finishes: the click, answered with fresh suggestions
+    results['click_then_fetch'] = measure(
+        food_suggestion_function,
+        lambda: post_event({'id': rng.choice(food_ids), 'user_id': 'User123', 'requested_item': 'food_suggestions'}),
+        iterations, dynamodb
+    )
+    results['random_and_suggestions'] = measure(
+        food_suggestion_function,
+        uncached(lambda: get_event({'requested_item': 'random_food,food_suggestions', 'user_id': 'User123'})),
+        iterations, dynamodb
+    )
+    results['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def measure_cold_start(runs: int) -> dict:
+    """Median import and client creation time of the handler over `runs` fresh interpreters."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_START_SCRIPT], cwd=LAMBDA_DIR,
+            check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    import_ms = statistics.median(sample['import_ms'] for sample in samples)
+    return {
+        'runs': runs,
+        'import_ms': round(import_ms, 1),
+        'client_init_ms': round(statistics.median(sample['client_init_ms'] for sample in samples), 1),
+        'target_ms': COLD_START_TARGET_MS,
+        'within_target': import_ms <= COLD_START_TARGET_MS,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """
+    Return a description of every p95 that regressed by more than `tolerance`
+    and by at least `min_delta_ms`, which filters out timer noise on fast paths.
+    """
+    regressions = []
+    for size, scenarios in results['sizes'].items():
+        for scenario, summary in scenarios.items():
+            if not isinstance(summary, dict):
+                continue
+            baseline_summary = baseline.get('sizes', {}).get(size, {}).get(scenario)
+            if not baseline_summary:
+                continue
+            limit = max(baseline_summary['p95_ms'] * (1 + tolerance), baseline_summary['p95_ms'] + min_delta_ms)
+            if summary['p95_ms'] > limit:
+                regressions.append(
+                    f"{size} foods / {scenario}: p95 {summary['p95_ms']} ms > {limit:.3f} ms "
+                    f"(baseline {baseline_summary['p95_ms']} ms)"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='catalog sizes to benchmark')
+    parser.add_argument('--density', type=float, default=0.3,
+                        help='probability that a food has any given attribute')
+    parser.add_argument('--iterations', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='simulated DynamoDB round trip per call')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to check for p95 regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 slowdown relative to the baseline (0.2 = 20%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='ignore p95 slowdowns smaller than this many ms')
+    parser.add_argument('--cold-start-runs', type=int, default=5,
+                        help='fresh interpreters used to time the handler import (0 to skip)')
+    parser.add_argument('--single-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_size:
+        print(json.dumps(run_size(args.single_size, args.density, args.iterations, args.latency_ms)))
+        return 0
+
+    results = {
+        'config': {'density': args.density, 'iterations': args.iterations, 'latency_ms': args.latency_ms},
+        'sizes': {},
+    }
+    if args.cold_start_runs:
+        results['cold_start'] = measure_cold_start(args.cold_start_runs)
+        cold_start = results['cold_start']
+        print(f"cold start: import {cold_start['import_ms']} ms, client {cold_start['client_init_ms']} ms "
+              f"(target {cold_start['target_ms']} ms: {'ok' if cold_start['within_target'] else 'over'})")
+    for size in args.sizes:
+        output = subprocess.run(
+            [sys.executable, __file__, '--single-size', str(size), '--density', str(args.density),
+             '--iterations', str(args.iterations), '--latency-ms', str(args.latency_ms)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results['sizes'][str(size)] = json.loads(output.splitlines()[-1])
+        print(f'{size} foods:')
+        for scenario, summary in results['sizes'][str(size)].items():
+            if isinstance(summary, dict):
+                print(f"  {scenario:25} p50 {summary['p50_ms']:9.3f} ms  p95 {summary['p95_ms']:9.3f} ms  "
+                      f"p99 {summary['p99_ms']:9.3f} ms  {summary['throughput_rps']:9.1f} req/s")
+            else:
+                print(f'  {scenario:25} {summary}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare(results, json.load(file), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
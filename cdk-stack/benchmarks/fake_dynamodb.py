@@ -0,0 +1,394 @@
+"""In-process stand-in for the DynamoDB tables used by the Lambda function"""
+import copy
+import re
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+
+class _Deserializer(TypeDeserializer):
+    """Returns binary attributes as bytes, like dynamo.deserialize."""
+
+    def _deserialize_b(self, value):
+        return bytes(value)
+
+    def _deserialize_bs(self, value):
+        return {bytes(item) for item in value}
+
+
+_deserializer = _Deserializer()
+_serializer = TypeSerializer()
+
+# Key attribute of each table created by the CDK stack
+TABLE_KEYS = {'Foods': 'id', 'Users': 'id', 'Metadata': 'identifier'}
+
+
+class FakeDynamoDB:
+    """
+    Minimal replacement for boto3.resource('dynamodb').
+
+    Supports the Table, batch_get_item and meta.client.batch_write_item calls
+    made by the Lambda function. Every call sleeps `latency_ms` to model the
+    network round trip and is counted in `calls`.
+
+    Tables named in `streams` record a KEYS_ONLY stream record for every
+    write, which stream_event() hands out as a Lambda event.
+    """
+
+    def __init__(self, latency_ms: float = 0, scan_page_size: int = 1000, streams: tuple = ()):
+        self.latency_ms = latency_ms
+        self.scan_page_size = scan_page_size
+        self.calls = Counter()
+        self.tables = {name: FakeTable(self, name, key) for name, key in TABLE_KEYS.items()}
+        for name in streams:
+            self.tables[name].stream = []
+        self.meta = _Meta(FakeClient(self))
+        self._lock = threading.Lock()
+
+    def stream_event(self, table_name: str, batch_size: int = 100) -> dict:
+        """Remove up to `batch_size` stream records of a table and return them as a Lambda event."""
+        table = self.tables[table_name]
+        with table._lock:
+            records, table.stream[:batch_size] = table.stream[:batch_size], []
+        return {'Records': records}
+
+    def Table(self, name: str) -> 'FakeTable':
+        return self.tables[name]
+
+    def record(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        self.record('BatchGetItem')
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.tables[table_name]
+            responses[table_name] = [
+                _project(table.items[key[table.key]], request.get('ProjectionExpression'),
+                         request.get('ExpressionAttributeNames'))
+                for key in request['Keys'] if key[table.key] in table.items
+            ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+
+class FakeClient:
+    """Low-level client subset, working on typed attribute values."""
+
+    def __init__(self, dynamodb: FakeDynamoDB):
+        self.dynamodb = dynamodb
+
+    def batch_write_item(self, RequestItems: dict, **kwargs) -> dict:
+        self.dynamodb.record('BatchWriteItem')
+        for table_name, requests in RequestItems.items():
+            table = self.dynamodb.tables[table_name]
+            keys = [
+                next(iter(request.values()))['Item' if 'PutRequest' in request else 'Key'][table.key]['S']
+                for request in requests
+            ]
+            if len(set(keys)) != len(keys):
+                raise ClientError(
+                    {'Error': {'Code': 'ValidationException',
+                               'Message': 'Provided list of item keys contains duplicates'}},
+                    'BatchWriteItem'
+                )
+            for request in requests:
+                if 'PutRequest' in request:
+                    item = {key: _deserializer.deserialize(value) for key, value in request['PutRequest']['Item'].items()}
+                    table._record_change(item[table.key], item)
+                    table.items[item[table.key]] = item
+                else:
+                    key = _deserializer.deserialize(request['DeleteRequest']['Key'][table.key])
+                    table._record_change(key, None)
+                    table.items.pop(key, None)
+            table._key_order = None
+        return {'UnprocessedItems': {}}
+
+
+class FakeTable:
+    """Subset of the boto3 Table resource backed by a dict."""
+
+    def __init__(self, dynamodb: FakeDynamoDB, name: str, key: str):
+        self.dynamodb = dynamodb
+        self.name = name
+        self.key = key
+        self.items = {}
+        # Stream records, when the table has a stream
+        self.stream = None
+        self._lock = threading.Lock()
+        self._key_order = None
+
+    def _record_change(self, key: str, item) -> None:
+        """Append the stream record of writing `item` (None for a delete) under `key`."""
+        if self.stream is None:
+            return
+        existing = key in self.items
+        if item is None and not existing:
+            return
+        self.stream.append({
+            'eventID': str(len(self.stream)),
+            'eventName': 'REMOVE' if item is None else 'MODIFY' if existing else 'INSERT',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'us-west-2',
+            'dynamodb': {
+                'Keys': {self.key: _serializer.serialize(key)},
+                'SequenceNumber': str(time.time_ns()),
+                'StreamViewType': 'KEYS_ONLY',
+            },
+            'eventSourceARN': f'arn:aws:dynamodb:us-west-2:000000000000:table/{self.name}/stream/fake',
+        })
+
+    def load(self, items) -> None:
+        """Insert items directly, without counting calls or copying them."""
+        for item in items:
+            self.items[item[self.key]] = item
+        self._key_order = None
+
+    def _segment_keys(self, segment: int, total_segments: int) -> tuple:
+        """Return the keys of a scan segment and each key's position in it."""
+        if self._key_order is None:
+            self._key_order = {}
+        cached = self._key_order.get((segment, total_segments))
+        if cached is None:
+            keys = list(self.items)[segment::total_segments]
+            cached = keys, {key: position for position, key in enumerate(keys)}
+            self._key_order[(segment, total_segments)] = cached
+        return cached
+
+    def get_item(self, Key: dict, ProjectionExpression: str = None,
+                 ExpressionAttributeNames: dict = None, **kwargs) -> dict:
+        self.dynamodb.record('GetItem')
+        item = self.items.get(Key[self.key])
+        if item is None:
+            return {}
+        return {'Item': _project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item: dict, ConditionExpression: str = None, ExpressionAttributeNames: dict = None,
+                 ExpressionAttributeValues: dict = None, **kwargs) -> dict:
+        self.dynamodb.record('PutItem')
+        with self._lock:
+            if ConditionExpression and not _condition(ConditionExpression, self.items.get(Item[self.key], {}),
+                                                      ExpressionAttributeNames or {}, ExpressionAttributeValues or {}):
+                raise _conditional_check_failed('PutItem')
+            self._record_change(Item[self.key], Item)
+            self.items[Item[self.key]] = _normalize(Item)
+            self._key_order = None
+        return {}
+
+    def delete_item(self, Key: dict, ConditionExpression: str = None, ExpressionAttributeNames: dict = None,
+                    ExpressionAttributeValues: dict = None, **kwargs) -> dict:
+        self.dynamodb.record('DeleteItem')
+        with self._lock:
+            key = Key[self.key]
+            if ConditionExpression and not _condition(ConditionExpression, self.items.get(key, {}),
+                                                      ExpressionAttributeNames or {}, ExpressionAttributeValues or {}):
+                raise _conditional_check_failed('DeleteItem')
+            self._record_change(key, None)
+            self.items.pop(key, None)
+            self._key_order = None
+        return {}
+
+    def scan(self, Segment: int = 0, TotalSegments: int = 1, ExclusiveStartKey: dict = None,
+             ProjectionExpression: str = None, ExpressionAttributeNames: dict = None, **kwargs) -> dict:
+        self.dynamodb.record('Scan')
+        keys, positions = self._segment_keys(Segment, TotalSegments)
+        start = positions[ExclusiveStartKey[self.key]] + 1 if ExclusiveStartKey else 0
+        page = keys[start:start + self.dynamodb.scan_page_size]
+        projection = ProjectionExpression and _projected_attributes(ProjectionExpression, ExpressionAttributeNames)
+        response = {
+            'Items': [_project(self.items[key], projection, ExpressionAttributeNames) for key in page],
+            'Count': len(page),
+            'ScannedCount': len(page),
+        }
+        if start + len(page) < len(keys):
+            response['LastEvaluatedKey'] = {self.key: page[-1]}
+        return response
+
+    def update_item(self, Key: dict, UpdateExpression: str, ExpressionAttributeNames: dict = None,
+                    ExpressionAttributeValues: dict = None, ReturnValues: str = 'NONE',
+                    ConditionExpression: str = None, **kwargs) -> dict:
+        self.dynamodb.record('UpdateItem')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            key = Key[self.key]
+            if ConditionExpression and not _condition(ConditionExpression, self.items.get(key, {}), names, values):
+                raise _conditional_check_failed('UpdateItem')
+            if key not in self.items:
+                self._key_order = None
+            self._record_change(key, Key)
+            item = copy.deepcopy(self.items.get(key, dict(Key)))
+            updated = []
+            for action, arguments in _split_clauses(UpdateExpression):
+                for argument in _split_top_level(arguments):
+                    if action == 'SET':
+                        path, operand = (part.strip() for part in argument.split('=', 1))
+                        path = _resolve_path(path, names)
+                        _set_path(item, path, _normalize(_evaluate(operand, item, names, values)))
+                    elif action == 'ADD':
+                        path, operand = argument.split(None, 1)
+                        path = _resolve_path(path, names)
+                        _set_path(item, path, _add(_get_path(item, path), values[operand.strip()]))
+                    elif action == 'REMOVE':
+                        path = _resolve_path(argument, names)
+                        _get_path(item, path[:-1]).pop(path[-1], None)
+                    else:
+                        raise NotImplementedError(f'Unsupported update action {action}')
+                    updated.append(path[0])
+            self.items[key] = item
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': {name: copy.deepcopy(item[name]) for name in updated if name in item}}
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': copy.deepcopy(item)}
+        return {}
+
+
+def _conditional_check_failed(operation: str) -> ClientError:
+    return ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+        operation
+    )
+
+
+def _normalize(value):
+    """Round-trip a value through the DynamoDB types, e.g. int -> Decimal."""
+    return _deserializer.deserialize(_serializer.serialize(value))
+
+
+def _project(item: dict, projection, names: dict) -> dict:
+    """Copy `item`, keeping only the attributes of `projection` (a string or _projected_attributes list)."""
+    if not projection:
+        return copy.deepcopy(item)
+    if isinstance(projection, str):
+        projection = _projected_attributes(projection, names)
+    return {attribute: _copy(item[attribute]) for attribute in projection if attribute in item}
+
+
+def _projected_attributes(projection: str, names: dict) -> list:
+    return [_resolve_path(path, names or {})[0] for path in projection.split(',')]
+
+
+def _copy(value):
+    return copy.deepcopy(value) if isinstance(value, (dict, list, set)) else value
+
+
+def _split_clauses(expression: str) -> list:
+    parts = re.split(r'\b(SET|ADD|REMOVE|DELETE)\b', expression)
+    return [(parts[i], parts[i + 1].strip()) for i in range(1, len(parts), 2)]
+
+
+def _split_top_level(arguments: str) -> list:
+    """Split on commas that are not inside parentheses."""
+    result, depth, current = [], 0, ''
+    for character in arguments:
+        if character == ',' and depth == 0:
+            result.append(current.strip())
+            current = ''
+            continue
+        depth += character == '('
+        depth -= character == ')'
+        current += character
+    if current.strip():
+        result.append(current.strip())
+    return result
+
+
+def _resolve_path(path: str, names: dict) -> list:
+    """Split a document path into attribute names and list indexes, e.g. 'a.#b[2]' -> ['a', 'b', 2]."""
+    parts = []
+    for part in path.strip().split('.'):
+        name, *indexes = part.split('[')
+        parts.append(names.get(name, name))
+        parts.extend(int(index.rstrip(']')) for index in indexes)
+    return parts
+
+
+def _get_path(item: dict, path: list, default=None):
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(item, list) or part >= len(item):
+                return default
+        elif not isinstance(item, dict) or part not in item:
+            return default
+        item = item[part]
+    return item
+
+
+def _set_path(item: dict, path: list, value) -> None:
+    parent = _get_path(item, path[:-1])
+    if isinstance(parent, list) and isinstance(path[-1], int):
+        # Like DynamoDB, an index past the end appends
+        if path[-1] < len(parent):
+            parent[path[-1]] = value
+        else:
+            parent.append(value)
+        return
+    if not isinstance(parent, dict) or isinstance(path[-1], int):
+        raise _validation_error('The document path provided in the update expression is invalid for update')
+    parent[path[-1]] = value
+
+
+def _evaluate(operand: str, item: dict, names: dict, values: dict):
+    operand = operand.strip()
+    match = re.fullmatch(r'size\((.*)\)', operand)
+    if match:
+        value = _get_path(item, _resolve_path(match.group(1), names))
+        return len(value) if value is not None else None
+    match = re.fullmatch(r'(if_not_exists|list_append)\((.*)\)', operand)
+    if match:
+        first, second = _split_top_level(match.group(2))
+        if match.group(1) == 'if_not_exists':
+            existing = _get_path(item, _resolve_path(first, names))
+            return existing if existing is not None else _evaluate(second, item, names, values)
+        return _evaluate(first, item, names, values) + _evaluate(second, item, names, values)
+    for operator in ('+', '-'):
+        left, found, right = operand.partition(f' {operator} ')
+        if found:
+            left_value = _evaluate(left, item, names, values)
+            right_value = _evaluate(right, item, names, values)
+            if left_value is None or right_value is None:
+                raise _validation_error('The provided expression refers to an attribute that does not exist in the item')
+            return left_value + right_value if operator == '+' else left_value - right_value
+    if operand.startswith(':'):
+        return _normalize(values[operand])
+    return copy.deepcopy(_get_path(item, _resolve_path(operand, names)))
+
+
+def _condition(expression: str, item: dict, names: dict, values: dict) -> bool:
+    """Evaluate OR/AND combinations of attribute_(not_)exists and = comparisons, which may use size()."""
+    if ' OR ' in expression:
+        return any(_condition(part, item, names, values) for part in expression.split(' OR '))
+    if ' AND ' in expression:
+        return all(_condition(part, item, names, values) for part in expression.split(' AND '))
+    expression = expression.strip()
+    match = re.fullmatch(r'attribute_(not_exists|exists)\((.*)\)', expression)
+    if match:
+        exists = _get_path(item, _resolve_path(match.group(2), names)) is not None
+        return exists == (match.group(1) == 'exists')
+    left, found, right = expression.partition(' = ')
+    if not found:
+        raise NotImplementedError(f'Unsupported condition {expression}')
+    return _evaluate(left, item, names, values) == _evaluate(right, item, names, values)
+
+
+def _add(existing, value):
+    if isinstance(value, (set, frozenset)):
+        if existing is not None and not isinstance(existing, set):
+            raise _validation_error('An operand in the update expression has an incorrect data type')
+        return (existing or set()) | set(value)
+    return (existing or Decimal(0)) + _normalize(value)
+
+
+def _validation_error(message: str) -> ClientError:
+    return ClientError({'Error': {'Code': 'ValidationException', 'Message': message}}, 'UpdateItem')
@@ -0,0 +1,205 @@
+"""
+Replay the frontend's user journeys against the API at a target request rate.
+
+A journey is what a visitor's browser sends: WelcomeFlavor.js reseeds the
+users (POST add_user_data), then Selector.js fetches random foods, fetches
+new ones after each of the visitor's picks, and posts the picks as one click
+that returns the visitor's suggestions (--separate-requests fetches them
+with their own GET instead, as the frontend used to). Journeys start on a
+fixed schedule whether or not earlier ones have finished (an open loop), so
+a slow server shows up as latency and errors instead of a lower request
+rate.
+
+Each route reports its latency histogram, percentiles and error rate:
+
+    python benchmarks/local_api.py --workers 4 &
+    python benchmarks/load_generator.py --url http://127.0.0.1:3001/food_suggestion --rps 50 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+# Upper bounds of the latency histogram buckets, in ms; the last bucket is open
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# Foods picked by a visitor before finishing, as in Selector.js
+PICKS_PER_JOURNEY = 3
+
+
+class RouteStats:
+    """Latencies and failures of one route."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.status_codes = {}
+
+    def add(self, latency_ms: float, status_code: int) -> None:
+        self.latencies.append(latency_ms)
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+        # 0 stands for a connection error or timeout
+        self.errors += status_code == 0 or status_code >= 400
+
+    def summary(self) -> dict:
+        ordered = sorted(self.latencies)
+        histogram = dict.fromkeys([f'<={bound}' for bound in HISTOGRAM_BUCKETS_MS] + ['>'], 0)
+        for latency in ordered:
+            bound = next((bound for bound in HISTOGRAM_BUCKETS_MS if latency <= bound), None)
+            histogram[f'<={bound}' if bound is not None else '>'] += 1
+        percentile = lambda fraction: round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+        return {
+            'requests': len(ordered),
+            'errors': self.errors,
+            'error_rate': round(self.errors / len(ordered), 4),
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'mean_ms': round(statistics.fmean(ordered), 3),
+            'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+            'histogram_ms': histogram,
+        }
+
+
+async def http_request(url, method: str, params: dict = None, body: dict = None, timeout: float = 10) -> tuple:
+    """
+    Send one HTTP/1.1 request on a new connection.
+
+    Returns:
+        tuple: Status code and decoded JSON body (None if empty or invalid).
+    """
+    target = url.path + (f'?{urlencode(params)}' if params else '')
+    data = json.dumps(body).encode() if body is not None else b''
+    head = (f'{method} {target} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: close\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n')
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        try:
+            writer.write(head.encode() + data)
+            await writer.drain()
+            status_line = await reader.readline()
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode().partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            payload = await reader.readexactly(length) if length else b''
+        finally:
+            writer.close()
+        return int(status_line.split()[1]), payload
+
+    status_code, payload = await asyncio.wait_for(exchange(), timeout)
+    try:
+        return status_code, json.loads(payload) if payload else None
+    except ValueError:
+        return status_code, None
+
+
+class LoadGenerator:
+    """
+    Starts journeys against `url` so that `rps` requests are sent per second
+    on average, and collects the stats of every route.
+    """
+
+    def __init__(self, url: str, rps: float, seed_users: bool = True, think_ms: float = 0, timeout: float = 10,
+                 separate_requests: bool = False):
+        self.url = urlsplit(url)
+        self.rps = rps
+        self.seed_users = seed_users
+        self.separate_requests = separate_requests
+        self.think_ms = think_ms
+        self.timeout = timeout
+        self.routes = {}
+        self.rng = random.Random(0)
+
+    async def call(self, route: str, method: str, params: dict = None, body: dict = None):
+        start = time.perf_counter()
+        try:
+            status_code, data = await http_request(self.url, method, params, body, self.timeout)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            status_code, data = 0, None
+        self.routes.setdefault(route, RouteStats()).add((time.perf_counter() - start) * 1000, status_code)
+        return data if 200 <= status_code < 300 else None
+
+    async def think(self):
+        if self.think_ms:
+            await asyncio.sleep(self.rng.expovariate(1000 / self.think_ms))
+
+    async def journey(self):
+        """One visitor, from the welcome page to their suggestions."""
+        user_id = str(uuid.uuid4())
+        if self.seed_users:
+            await self.call('POST add_user_data', 'POST', body={'id': 'add_user_data'})
+        foods = await self.call('GET random_food', 'GET', {'requested_item': 'random_food'})
+        picks = []
+        for _ in range(PICKS_PER_JOURNEY):
+            await self.think()
+            if foods:
+                picks.append(self.rng.choice(list(foods.values())))
+            foods = await self.call('GET random_food', 'GET', {'requested_item': 'random_food'})
+        if not self.separate_requests:
+            await self.call('POST click+food_suggestions', 'POST',
+                            body={'ids': picks, 'user_id': user_id, 'requested_item': 'food_suggestions'})
+            return
+        await self.call('POST click', 'POST', body={'ids': picks, 'user_id': user_id})
+        await self.call('GET food_suggestions', 'GET', {'requested_item': 'food_suggestions', 'user_id': user_id})
+
+    def requests_per_journey(self) -> int:
+        return self.seed_users + 1 + PICKS_PER_JOURNEY + 1 + self.separate_requests
+
+    async def run(self, duration: float) -> dict:
+        """Start journeys for `duration` seconds, wait for them to finish and return the report."""
+        interval = self.requests_per_journey() / self.rps
+        journeys = []
+        start = time.perf_counter()
+        next_start = start
+        while next_start - start < duration:
+            journeys.append(asyncio.ensure_future(self.journey()))
+            next_start += interval
+            await asyncio.sleep(max(0.0, next_start - time.perf_counter()))
+        await asyncio.gather(*journeys)
+        elapsed = time.perf_counter() - start
+        return {
+            'config': {'rps': self.rps, 'duration': duration, 'think_ms': self.think_ms,
+                       'seed_users': self.seed_users, 'separate_requests': self.separate_requests},
+            'journeys': len(journeys),
+            'achieved_rps': round(sum(len(stats.latencies) for stats in self.routes.values()) / elapsed, 1),
+            'routes': {route: stats.summary() for route, stats in self.routes.items()},
+        }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:3001/food_suggestion', help='API resource URL')
+    parser.add_argument('--rps', type=float, default=20, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to start journeys for')
+    parser.add_argument('--think-ms', type=float, default=0, help='mean pause before each pick')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request counts as failed')
+    parser.add_argument('--no-seed', action='store_true', help='skip the add_user_data request of each journey')
+    parser.add_argument('--separate-requests', action='store_true',
+                        help='post the click and GET the suggestions separately')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    generator = LoadGenerator(args.url, args.rps, not args.no_seed, args.think_ms, args.timeout,
+                              args.separate_requests)
+    report = asyncio.run(generator.run(args.duration))
+    print(f"{report['journeys']} journeys, {report['achieved_rps']} req/s (target {args.rps})")
+    for route, summary in report['routes'].items():
+        print(f"  {route:28} {summary['requests']:6} req  errors {summary['error_rate']:7.2%}  "
+              f"p50 {summary['p50_ms']:9.3f} ms  p95 {summary['p95_ms']:9.3f} ms  p99 {summary['p99_ms']:9.3f} ms")
+        print('  ' + ' ' * 28 + ' '.join(f'{bucket}:{count}' for bucket, count in summary['histogram_ms'].items()
+                                         if count))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    return 1 if any(summary['errors'] for summary in report['routes'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
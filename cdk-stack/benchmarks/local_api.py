@@ -0,0 +1,218 @@
+"""
+Serve the Lambda handler over HTTP the way API Gateway does, against the
+in-process DynamoDB stand-in, so the frontend flows can be load tested
+without deploying.
+
+Requests to /food_suggestion are turned into proxy integration events and
+handled by a pool of emulated containers: each is its own import of the
+Lambda modules, with its own warm caches, metrics, DynamoDB client and I/O
+thread pool, handling one request at a time like a Lambda execution
+environment. Requests wait for a free container, so
+`--workers` plays the part of the function's concurrency limit. All
+containers share the same tables.
+
+    python benchmarks/local_api.py --workers 4 --port 3001
+    python benchmarks/local_api.py --foods 100000 --latency-ms 5
+
+Without --foods the tables start empty and are seeded from food_data.txt
+and user_data.txt with add_food_data, as after a deployment.
+"""
+import argparse
+import importlib
+import json
+import os
+import queue
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARK_DIR, '..', 'lambda_functions')
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+# Keep per-request metric lines out of the server output
+os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+
+from benchmarks.bench_handler import install, post_event, seed, synthetic_foods, synthetic_user
+from benchmarks.fake_dynamodb import FakeDynamoDB
+
+# Path of the API Gateway resource created by the CDK stack
+RESOURCE_PATH = '/food_suggestion'
+# Preflight responses of the CORS options configured on the API
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'OPTIONS,GET,PUT,POST,DELETE,PATCH,HEAD',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,'
+                                    'X-Amz-User-Agent,X-User-Id',
+}
+
+
+def load_container(dynamodb: FakeDynamoDB):
+    """
+    Import the handler module and every Lambda module it imports afresh,
+    pointed at `dynamodb`. The container keeps its copies through the
+    handler's references; sys.modules is restored afterwards.
+    """
+    lambda_modules = [name[:-len('.py')] for name in os.listdir(LAMBDA_DIR) if name.endswith('.py')]
+    saved = {name: sys.modules.pop(name) for name in lambda_modules if name in sys.modules}
+    try:
+        module = importlib.import_module('food_suggestion_function')
+    finally:
+        for name in lambda_modules:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+    install(module, dynamodb)
+    return module
+
+
+def proxy_event(method: str, target: str, headers: dict, body: str) -> dict:
+    """Build the API Gateway proxy integration event of an HTTP request."""
+    url = urlsplit(target)
+    params = dict(parse_qsl(url.query, keep_blank_values=True))
+    return {
+        'resource': RESOURCE_PATH,
+        'path': url.path,
+        'httpMethod': method,
+        'headers': headers,
+        'queryStringParameters': params or None,
+        'pathParameters': None,
+        'body': body,
+        'isBase64Encoded': False,
+        'requestContext': {
+            'resourcePath': RESOURCE_PATH,
+            'httpMethod': method,
+            'requestTimeEpoch': int(time.time() * 1000),
+        },
+    }
+
+
+class LocalApi(ThreadingHTTPServer):
+    """
+    HTTP server invoking the handler on a pool of `workers` containers.
+
+    Attributes:
+        dynamodb (FakeDynamoDB): Tables shared by every container.
+        containers (queue.Queue): Idle containers.
+    """
+
+    daemon_threads = True
+    # Load generators open many connections at once
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, dynamodb: FakeDynamoDB, workers: int):
+        super().__init__(address, ApiRequestHandler)
+        self.dynamodb = dynamodb
+        self.containers = queue.Queue()
+        for _ in range(workers):
+            self.containers.put(load_container(dynamodb))
+
+    def invoke(self, event: dict) -> dict:
+        """Run the handler on the next free container."""
+        container = self.containers.get()
+        try:
+            return container.handler(event, None)
+        finally:
+            self.containers.put(container)
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_OPTIONS(self):
+        self.send_body(204, CORS_HEADERS, '')
+
+    def do_GET(self):
+        self.proxy()
+
+    def do_POST(self):
+        self.proxy()
+
+    def do_PUT(self):
+        self.proxy()
+
+    def do_DELETE(self):
+        self.proxy()
+
+    def proxy(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else None
+        if urlsplit(self.path).path.rstrip('/') != RESOURCE_PATH:
+            self.send_body(404, {'Content-Type': 'application/json'}, json.dumps({'message': 'Not Found'}))
+            return
+        try:
+            response = self.server.invoke(proxy_event(self.command, self.path, dict(self.headers), body))
+        except Exception as e:
+            # API Gateway answers 502 when the integration fails
+            self.log_error('Handler raised %r', e)
+            self.send_body(502, {'Content-Type': 'application/json'}, json.dumps({'message': 'Internal server error'}))
+            return
+        self.send_body(response['statusCode'], response.get('headers') or {}, response.get('body') or '')
+
+    def send_body(self, status_code: int, headers: dict, body: str):
+        data = body.encode()
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # One line per request would dominate a load test
+        pass
+
+
+def create_server(host: str = '127.0.0.1', port: int = 0, workers: int = 4, foods: int = 0,
+                  density: float = 0.3, latency_ms: float = 0) -> LocalApi:
+    """
+    Create the tables, seed them and return a server ready for serve_forever().
+
+    Parameters:
+        foods (int): Synthetic catalog size; 0 seeds food_data.txt and
+            user_data.txt through the handler instead.
+        latency_ms (float): Simulated DynamoDB round trip per call.
+    """
+    import attributes
+
+    # The seeding functions read the data files relative to the working directory
+    os.chdir(LAMBDA_DIR)
+    dynamodb = FakeDynamoDB(latency_ms=latency_ms)
+    server = LocalApi((host, port), dynamodb, workers)
+    if foods:
+        seed(server.containers.queue[0], dynamodb, synthetic_foods(foods, attributes.FOOD_ATTRIBUTES, density),
+             [synthetic_user('User123', attributes.USER_ATTRIBUTES)])
+    else:
+        for seed_id in ('add_food_data', 'add_user_data'):
+            response = server.invoke(post_event({'id': seed_id}))
+            if response['statusCode'] != 200:
+                raise RuntimeError(f"Seeding with {seed_id} failed: {response['body']}")
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3001)
+    parser.add_argument('--workers', type=int, default=4, help='containers handling requests concurrently')
+    parser.add_argument('--foods', type=int, default=0, help='synthetic catalog size instead of food_data.txt')
+    parser.add_argument('--density', type=float, default=0.3,
+                        help='probability that a synthetic food has any given attribute')
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated DynamoDB round trip per call')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.workers, args.foods, args.density, args.latency_ms)
+    host, port = server.server_address[:2]
+    print(f'Serving http://{host}:{port}{RESOURCE_PATH} with {args.workers} workers', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
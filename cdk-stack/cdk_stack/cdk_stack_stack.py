@@ -2,6 +2,7 @@
 from aws_cdk import (
     Stack,
     aws_lambda as _lambda,
+    aws_lambda_event_sources as lambda_event_sources,
     aws_dynamodb as dynamodb,
     aws_apigateway as apigateway,
     aws_iam as iam,
@@ -12,6 +13,7 @@ from aws_cdk import (
     aws_route53 as route53,
     aws_certificatemanager as acm,
     aws_route53_targets as targets,
+    Duration,
     RemovalPolicy,
     CfnOutput
 )
@@ -41,6 +43,8 @@ class CdkStackStack(Stack):
     - A Lambda layer containing dependencies for the Lambda function
     - An IAM role and policy for the Lambda function to access DynamoDB tables
     - A Lambda function named 'FoodSuggestionFunction' to interact with the DynamoDB tables
+    - A Lambda function named 'CatalogStreamFunction' consuming the 'Foods' table stream to
+      maintain the food id index and catalog version in 'Metadata'
     - An API Gateway REST API with resources and methods (GET, PUT, DELETE, POST)
       to invoke the Lambda function for storage interactions
     - An S3 bucket to store and serve a React application, configured with CloudFront
@@ -62,6 +66,8 @@ class CdkStackStack(Stack):
                 name='id',
                 type=dynamodb.AttributeType.STRING
             ),
+            # Changed food ids are streamed to the CatalogStreamFunction
+            stream=dynamodb.StreamViewType.KEYS_ONLY,
             removal_policy=RemovalPolicy.DESTROY,  # for testing purposes, remove for production
         )
 
@@ -76,7 +82,19 @@ class CdkStackStack(Stack):
             removal_policy=RemovalPolicy.DESTROY,  # for testing purposes, remove for production
         )
 
+        # Create a table for application metadata (e.g. the catalog version counter)
+        metadata = dynamodb.Table(
+            self, 'Metadata',
+            table_name='Metadata',
+            partition_key=dynamodb.Attribute(
+                name='identifier',
+                type=dynamodb.AttributeType.STRING
+            ),
+            removal_policy=RemovalPolicy.DESTROY,  # for testing purposes, remove for production
+        )
+
         # Create Lambda Layer to house dependencies
+        # boto3/botocore come with the Lambda runtime, so the layer only ships numpy
         dependency = _lambda.LayerVersion(
             self, 'LambdaLayer',
             code=_lambda.Code.from_asset('lambda_layer.zip'),
@@ -101,7 +119,9 @@ class CdkStackStack(Stack):
                 iam.PolicyStatement(
                     actions=[
                         "dynamodb:GetItem",
+                        "dynamodb:BatchGetItem",
                         "dynamodb:PutItem",
+                        "dynamodb:BatchWriteItem",
                         "dynamodb:UpdateItem",
                         "dynamodb:DeleteItem",
                         "dynamodb:Scan",
@@ -124,10 +144,45 @@ class CdkStackStack(Stack):
             self, 'FoodSuggestionFunction',
             runtime=_lambda.Runtime.PYTHON_3_12,
             handler='food_suggestion_function.handler',
-            code=_lambda.Code.from_asset('lambda_functions'),
+            code=_lambda.Code.from_asset(
+                'lambda_functions',
+                exclude=['__pycache__', '*.pyc', 'food_data_tags.txt']
+            ),
             layers=[dependency],
-            role=food_suggestion_function_role
+            role=food_suggestion_function_role,
+            environment={
+                # Per-request metrics are emitted as EMF; skip dumping bodies and items
+                'LOG_ITEMS': 'false',
+                # The CatalogStreamFunction bumps the catalog version after food writes
+                'CATALOG_CHANGES_FROM_STREAM': 'true'
+            }
+        )
+
+        # Lambda function applying Foods table changes to the derived catalog data
+        catalog_stream_function = _lambda.Function(
+            self, 'CatalogStreamFunction',
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            handler='catalog_stream_function.handler',
+            code=_lambda.Code.from_asset(
+                'lambda_functions',
+                exclude=['__pycache__', '*.pyc', 'food_data_tags.txt']
+            ),
+            layers=[dependency],
+            role=food_suggestion_function_role,
+            timeout=Duration.seconds(60),
+            environment={
+                'LOG_ITEMS': 'false'
+            }
         )
+        catalog_stream_function.add_event_source(lambda_event_sources.DynamoEventSource(
+            food,
+            starting_position=_lambda.StartingPosition.TRIM_HORIZON,
+            # One catalog version per batch rather than per food
+            batch_size=1000,
+            max_batching_window=Duration.seconds(1),
+            retry_attempts=10,
+            bisect_batch_on_error=True
+        ))
 
         # Create the API Gateway with CORS enabled
         api_gateway = apigateway.LambdaRestApi(
@@ -137,7 +192,7 @@ class CdkStackStack(Stack):
             default_cors_preflight_options={
                 "allow_origins": apigateway.Cors.ALL_ORIGINS,
                 "allow_methods": apigateway.Cors.ALL_METHODS,
-                "allow_headers": apigateway.Cors.DEFAULT_HEADERS
+                "allow_headers": apigateway.Cors.DEFAULT_HEADERS + ['X-User-Id']
             }
         )
 
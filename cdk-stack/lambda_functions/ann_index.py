@@ -0,0 +1,187 @@
+"""
+Module for approximate nearest-neighbour search over food attribute vectors.
+
+The index uses random-hyperplane LSH: every food vector gets one
+`bits`-bit signature per hash table, and foods sharing a signature share a
+bucket. A query probes its own bucket in each table plus every bucket within
+`probe_radius` bit flips, then reranks the candidates exactly by cosine
+similarity. Raising the probe radius or the number of tables trades latency
+for recall.
+
+An index built from an older catalog version stays usable: index positions
+are mapped to catalog rows by food id, foods removed since the build are
+dropped, foods added since are always reranked with the candidates, and
+the rerank scores every candidate from its current attributes. Only foods
+whose attributes changed since the build may be missed, until the index is
+rebuilt.
+
+The index is built offline and saved as a .npz artifact:
+
+    python ann_index.py --food-data food_data.txt --catalog-version 3 --output ann_index.npz
+"""
+import argparse
+import itertools
+import json
+import logging
+import sys
+
+import numpy as np
+
+import scoring
+
+
+logger = logging.getLogger()
+
+
+class AnnIndex:
+    """
+    Multi-table LSH index over the rows of a catalog attribute matrix.
+
+    Attributes:
+        planes (np.ndarray): float32 hyperplanes, shape (tables * bits, attributes).
+        offsets (np.ndarray): int32 bucket offsets, shape (tables, 2 ** bits + 1).
+        order (np.ndarray): int32 food positions sorted by bucket, shape (tables, foods).
+        food_ids (list): Food ids, indexed by position.
+        catalog_version (int): Catalog version the index was built from.
+    """
+
+    def __init__(self, planes, offsets, order, food_ids: list, catalog_version: int):
+        self.planes = planes
+        self.offsets = offsets
+        self.order = order
+        self.food_ids = food_ids
+        self.catalog_version = catalog_version
+        self.tables, buckets = offsets.shape
+        self.bits = (buckets - 1).bit_length() - 1
+        self._row_map = None
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, food_ids: list, catalog_version: int,
+              tables: int = 4, bits: int = 12, seed: int = 0) -> 'AnnIndex':
+        """Hash every row of `matrix` into `tables` tables of 2 ** bits buckets."""
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((tables * bits, matrix.shape[1])).astype(np.float32)
+        signatures = _signatures(matrix.astype(np.float32), planes, tables, bits)
+        order = np.argsort(signatures, axis=1, kind='stable').astype(np.int32)
+        offsets = np.empty((tables, 2 ** bits + 1), dtype=np.int32)
+        for table in range(tables):
+            offsets[table] = np.searchsorted(signatures[table][order[table]], np.arange(2 ** bits + 1))
+        return cls(planes, offsets, order, list(food_ids), catalog_version)
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            planes=self.planes,
+            offsets=self.offsets,
+            order=self.order,
+            food_ids=np.frombuffer('\n'.join(self.food_ids).encode(), dtype=np.uint8),
+            catalog_version=np.int64(self.catalog_version)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'AnnIndex':
+        with np.load(path) as artifact:
+            food_ids = artifact['food_ids'].tobytes().decode().split('\n')
+            return cls(artifact['planes'], artifact['offsets'], artifact['order'],
+                       food_ids, int(artifact['catalog_version']))
+
+    def catalog_rows(self, catalog) -> tuple:
+        """
+        Map index positions to rows of `catalog`, -1 for foods no longer in
+        it, and return them with the rows of the foods missing from the index.
+        """
+        if self._row_map is None or self._row_map[0] is not catalog:
+            rows = catalog.find(self.food_ids)
+            unindexed = np.ones(len(catalog), dtype=bool)
+            unindexed[rows[rows >= 0]] = False
+            self._row_map = (catalog, rows, np.flatnonzero(unindexed))
+            if self._row_map[2].size:
+                logger.info(f'{self._row_map[2].size} foods of catalog version {catalog.version} are not in the '
+                            f'ANN index of version {self.catalog_version}; they are scored exactly')
+        return self._row_map[1], self._row_map[2]
+
+    def candidates(self, weights: np.ndarray, probe_radius: int = 1) -> np.ndarray:
+        """Return the index positions sharing a probed bucket with `weights`."""
+        query = _signatures(weights[np.newaxis, :].astype(np.float32), self.planes, self.tables, self.bits)[:, 0]
+        flips = [0]
+        for radius in range(1, probe_radius + 1):
+            for positions in itertools.combinations(range(self.bits), radius):
+                flips.append(sum(1 << position for position in positions))
+        flips = np.array(flips, dtype=np.int64)
+
+        found = []
+        for table in range(self.tables):
+            buckets = query[table] ^ flips
+            starts = self.offsets[table][buckets]
+            ends = self.offsets[table][buckets + 1]
+            found.extend(self.order[table][start:end] for start, end in zip(starts, ends) if end > start)
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(found))
+
+    def top_k(self, catalog, weights: np.ndarray, k: int, excluded: np.ndarray = None,
+              probe_radius: int = 1) -> np.ndarray:
+        """
+        Return the catalog rows of the (approximately) k most cosine-similar
+        foods. Foods added to the catalog since the index was built are
+        always candidates. Falls back to an exact search when there are fewer
+        than k eligible candidates.
+        """
+        if not weights.any():
+            # Every food scores 0 against an empty preference vector
+            return scoring.top_k(np.zeros(len(catalog)), k, excluded)
+        index_rows, unindexed_rows = self.catalog_rows(catalog)
+        rows = index_rows[self.candidates(weights, probe_radius)]
+        rows = np.concatenate([rows[rows >= 0], unindexed_rows])
+        if excluded is not None:
+            rows = rows[~excluded[rows]]
+        if len(rows) < k:
+            return scoring.top_k(scoring.packed_cosine_scores(catalog.masks, weights), k, excluded)
+        rows.sort()
+        scores = scoring.packed_cosine_scores(catalog.masks[rows], weights)
+        return rows[scoring.top_k(scores, k)]
+
+
+def _signatures(vectors: np.ndarray, planes: np.ndarray, tables: int, bits: int) -> np.ndarray:
+    """Return the bucket of every vector in every table, shape (tables, vectors)."""
+    projections = (vectors @ planes.T) > 0
+    weights = 1 << np.arange(bits, dtype=np.int64)
+    return projections.reshape(len(vectors), tables, bits).astype(np.int64).dot(weights).T
+
+
+def load_index(path: str) -> AnnIndex:
+    """Load the index at `path`, or return None if there is none or it is unreadable."""
+    try:
+        index = AnnIndex.load(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f'Ignoring unreadable ANN index {path}: {e}')
+        return None
+    logger.info(f'Loaded ANN index for catalog version {index.catalog_version} ({len(index.food_ids)} foods)')
+    return index
+
+
+def main() -> int:
+    import attributes
+    import bulk_ingest
+
+    parser = argparse.ArgumentParser(description='Build the ANN index artifact for cosine suggestions')
+    parser.add_argument('--food-data', required=True, help='JSON array of food items, as in food_data.txt')
+    parser.add_argument('--catalog-version', type=int, required=True,
+                        help='catalog version in the Metadata table the food data corresponds to')
+    parser.add_argument('--output', default='ann_index.npz')
+    parser.add_argument('--tables', type=int, default=4)
+    parser.add_argument('--bits', type=int, default=12)
+    args = parser.parse_args()
+
+    foods = {food['id']: food for food in bulk_ingest.iter_json_array(args.food_data)}
+    food_ids, matrix = scoring.build_attribute_matrix(list(foods.values()), attributes.FOOD_ATTRIBUTES)
+    index = AnnIndex.build(matrix, food_ids, args.catalog_version, tables=args.tables, bits=args.bits)
+    index.save(args.output)
+    print(json.dumps({'foods': len(food_ids), 'tables': args.tables, 'bits': args.bits, 'output': args.output}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
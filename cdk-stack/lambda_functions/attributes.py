@@ -0,0 +1,84 @@
+"""Module defining the food attributes and the user preferences they map to"""
+import logging
+
+
+logger = logging.getLogger()
+
+# Food attribute -> user preference, in the canonical attribute order
+map_food_to_user = {
+    "isSweet": "sweet",
+    "isSalty": "salty",
+    "isSour": "sour",
+    "isBitter": "bitter",
+    "isSpicy": "spicy",
+    "isUmami": "umami",
+    "isSavory": "savory",
+    "isSmoky": "smoky",
+    "isTangy": "tangy",
+    "isRich": "rich",
+    "isCrispy": "crispy",
+    "isCrunchy": "crunchy",
+    "isChewy": "chewy",
+    "isCreamy": "creamy",
+    "isTender": "tender",
+    "isHighProtein": "highProtein",
+    "isLowCarb": "lowCarb",
+    "isGlutenFree": "glutenFree",
+    "isDairyFree": "dairyFree",
+    "isVegan": "vegan",
+    "isGrilled": "grilled",
+    "isFried": "fried",
+    "isBaked": "baked",
+    "isRoasted": "roasted",
+    "isSteamed": "steamed",
+    "isHot": "hot",
+    "isCold": "cold",
+    "isRoomTemperature": "roomTemperature",
+    "isFrozen": "frozen",
+    "isMexican": "mexican",
+    "isItalian": "italian",
+    "isAsian": "asian",
+    "isMediterranean": "mediterranean",
+    "isFusion": "fusion",
+    "isComfortFood": "comfortFood",
+    "isHealthy": "healthy",
+    "isIndulgent": "indulgent",
+    "isExotic": "exotic",
+    "isOrganic": "organic"
+}
+
+# Attribute registry built once at import and shared by the scoring, update
+# and seeding paths. Index i is column i of the catalog attribute matrix.
+FOOD_ATTRIBUTES = tuple(map_food_to_user.keys())
+USER_ATTRIBUTES = tuple(map_food_to_user.values())
+map_user_to_food = {user_attribute: food_attribute for food_attribute, user_attribute in map_food_to_user.items()}
+FOOD_ATTRIBUTE_INDEX = {food_attribute: index for index, food_attribute in enumerate(FOOD_ATTRIBUTES)}
+USER_ATTRIBUTE_INDEX = {user_attribute: index for index, user_attribute in enumerate(USER_ATTRIBUTES)}
+
+
+class UnknownAttributeError(ValueError):
+    """Raised when an attribute is not part of the registry."""
+
+
+def get_food_from_user(user_attribute: str) -> str:
+    """
+    Return the food attribute matching a user preference.
+
+    Raises:
+        UnknownAttributeError: If the preference is not in the registry.
+    """
+    try:
+        return map_user_to_food[user_attribute]
+    except KeyError:
+        raise UnknownAttributeError(f'Unknown user attribute: {user_attribute}') from None
+
+
+def report_unknown_food_attributes(food: dict) -> list:
+    """Log and return the attributes of a food item missing from the registry."""
+    unknown_attributes = [
+        attribute for attribute in food
+        if attribute != 'id' and attribute not in FOOD_ATTRIBUTE_INDEX
+    ]
+    if unknown_attributes:
+        logger.warning(f"Food {food.get('id')} has unknown attributes: {unknown_attributes}")
+    return unknown_attributes
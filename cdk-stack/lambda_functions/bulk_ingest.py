@@ -0,0 +1,164 @@
+"""Module for bulk loading seed data into DynamoDB tables"""
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+import dynamo
+import metrics
+
+
+logger = logging.getLogger()
+
+# Maximum number of put requests accepted by a single BatchWriteItem call
+BATCH_WRITE_SIZE = 25
+# Error codes DynamoDB returns when a request is throttled
+THROTTLING_ERROR_CODES = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16):
+    """
+    Yield the elements of a file holding one top-level JSON array, reading
+    the file in chunks instead of loading the whole document.
+
+    Floats are parsed as Decimal so items can be written to DynamoDB as-is.
+    """
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    with open(path, 'r') as file:
+        buffer = file.read(chunk_size)
+        position = _skip_separators(buffer, 0, ' \t\r\n')
+        if buffer[position:position + 1] != '[':
+            raise ValueError(f'{path} does not contain a JSON array')
+        position += 1
+
+        while True:
+            position = _skip_separators(buffer, position, ' \t\r\n,')
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                end = None
+            # Read more when the element is cut off (or may be, at the buffer end)
+            if end is None or end == len(buffer):
+                chunk = file.read(chunk_size)
+                if chunk:
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+                if end is None:
+                    raise ValueError(f'{path} ends inside its JSON array')
+            yield item
+            position = end
+
+
+def _skip_separators(buffer: str, position: int, separators: str) -> int:
+    while position < len(buffer) and buffer[position] in separators:
+        position += 1
+    return position
+
+
+def batch_write_items(dynamodb, table_name: str, items, key_attribute: str = 'id',
+                      workers: int = 1, max_retries: int = 8) -> dict:
+    """
+    Put items into a table with BatchWriteItem, 25 items per call.
+
+    Unprocessed items and throttled calls are retried with exponential
+    backoff. With `workers` > 1 the batches are spread across a thread pool,
+    keeping at most two batches per worker in flight so `items` can be a
+    lazy iterator.
+
+    Parameters:
+        dynamodb: DynamoDB service (dynamo.DynamoDB or a boto3 resource).
+        table_name (str): Name of the table to write to.
+        items: Iterable of items in the resource (Python) format.
+        key_attribute (str): Partition key attribute of the table.
+        workers (int): Number of threads writing batches concurrently.
+        max_retries (int): Retries per batch before giving up.
+
+    Returns:
+        dict: Write statistics: 'items', 'batches', 'throttled', 'seconds'
+            and 'itemsPerSecond'.
+    """
+    client = dynamodb.meta.client
+    start = time.perf_counter()
+    stats = {'items': 0, 'batches': 0, 'throttled': 0}
+
+    def write(batch):
+        throttled = _write_batch(client, table_name, batch, max_retries)
+        return len(batch), throttled
+
+    def record(result):
+        written, throttled = result
+        stats['items'] += written
+        stats['batches'] += 1
+        stats['throttled'] += throttled
+
+    if workers <= 1:
+        for batch in _batches(items, key_attribute):
+            record(write(batch))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for batch in _batches(items, key_attribute):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(future.result())
+                pending.add(executor.submit(write, batch))
+            for future in pending:
+                record(future.result())
+
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    stats['itemsPerSecond'] = round(stats['items'] / stats['seconds'], 1) if stats['seconds'] else stats['items']
+    logger.info(f'Wrote {stats["items"]} items to {table_name}: {stats}')
+    return stats
+
+
+def _batches(items, key_attribute: str):
+    """
+    Group items into serialized put requests of BATCH_WRITE_SIZE.
+
+    BatchWriteItem rejects a batch that repeats a key, so a repeated key
+    replaces the earlier request in its batch (the last write wins, as it
+    would with sequential put_item calls).
+    """
+    batch = {}
+    for item in items:
+        key = item[key_attribute]
+        item = dynamo.serialize_item(item)
+        batch[key] = {'PutRequest': {'Item': item}}
+        if len(batch) == BATCH_WRITE_SIZE:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+def _write_batch(client, table_name: str, batch: list, max_retries: int) -> int:
+    """Write one batch until nothing is left unprocessed. Returns the number of throttled attempts."""
+    throttled = 0
+    request_items = {table_name: batch}
+    for attempt in range(max_retries + 1):
+        try:
+            response = client.batch_write_item(RequestItems=request_items, ReturnConsumedCapacity='TOTAL')
+            metrics.record_dynamodb('batch_write_item', response)
+            request_items = response.get('UnprocessedItems') or {}
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                raise
+        if not request_items:
+            return throttled
+        throttled += 1
+        backoff(attempt)
+    raise RuntimeError(f'Gave up writing {len(request_items[table_name])} items to {table_name}')
+
+
+def backoff(attempt: int) -> None:
+    """Sleep before retrying a throttled or partly processed call, `attempt` counting from 0."""
+    # Exponential backoff with full jitter, capped at a few seconds
+    time.sleep(random.uniform(0, min(5.0, 0.05 * 2 ** attempt)))
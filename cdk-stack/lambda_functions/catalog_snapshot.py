@@ -0,0 +1,143 @@
+"""
+Module for exporting the Foods catalog to a memory-mappable snapshot file.
+
+A cold container would otherwise scan the whole Foods table before it can
+serve its first suggestion. With a snapshot shipped in the Lambda layer (or
+placed in /tmp), the handler maps the file at startup instead, and only the
+foods changed since the snapshot version are read from DynamoDB.
+
+File layout, all little-endian:
+
+    header            magic, format version, catalog version, food count,
+                      id width and attribute names length (see HEADER)
+    attribute names   UTF-8, newline separated, padded to 8 bytes
+    masks             one uint64 attribute mask per food
+    food ids          one id per food, UTF-8, null padded to the id width,
+                      sorted so they can be binary searched in place
+
+Export a snapshot from DynamoDB or from a data file:
+
+    python catalog_snapshot.py --output ../lambda_layer/catalog_snapshot.bin
+    python catalog_snapshot.py --food-data food_data.txt --catalog-version 1 --output catalog_snapshot.bin
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+import food_catalog
+
+
+logger = logging.getLogger()
+
+MAGIC = b'FBCS'
+FORMAT_VERSION = 1
+# magic, format version, catalog version, food count, id width, attribute names length
+HEADER = struct.Struct('<4sIQQII')
+
+
+def write_snapshot(path: str, catalog: food_catalog.Catalog) -> None:
+    """Write `catalog` to `path`, replacing any previous snapshot atomically."""
+    names = '\n'.join(catalog.food_attributes).encode()
+    ids = catalog.food_ids.ids
+    id_width = ids.dtype.itemsize
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, catalog.version, len(catalog), id_width, len(names)))
+        file.write(names + b'\0' * (-len(names) % 8))
+        file.write(np.ascontiguousarray(catalog.masks, dtype='<u8').tobytes())
+        file.write(ids.tobytes())
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path: str, food_attributes: list) -> food_catalog.Catalog:
+    """
+    Map the snapshot at `path` into a Catalog without copying it: the masks
+    and ids are read-only NumPy views of the mapped file.
+
+    Raises:
+        ValueError: If the file is not a snapshot, or was written for
+            different food attributes.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mapped) < HEADER.size:
+        raise ValueError('File is too short to be a catalog snapshot')
+    magic, format_version, version, food_count, id_width, names_length = HEADER.unpack_from(mapped)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise ValueError(f'Unsupported catalog snapshot format {magic!r} v{format_version}')
+
+    names = mapped[HEADER.size:HEADER.size + names_length].decode()
+    snapshot_attributes = names.split('\n') if names else []
+    if snapshot_attributes != list(food_attributes):
+        raise ValueError('Catalog snapshot was written for different food attributes')
+
+    masks_offset = HEADER.size + names_length + (-names_length % 8)
+    ids_offset = masks_offset + 8 * food_count
+    if len(mapped) < ids_offset + id_width * food_count:
+        raise ValueError('Catalog snapshot is truncated')
+    masks = np.frombuffer(mapped, dtype='<u8', count=food_count, offset=masks_offset)
+    ids = np.frombuffer(mapped, dtype=f'S{id_width}', count=food_count, offset=ids_offset) \
+        if food_count else np.zeros(0, dtype='S1')
+    return food_catalog.Catalog(food_catalog.FoodIds(ids), masks, food_attributes, version)
+
+
+def load_snapshot(paths, food_attributes: list) -> food_catalog.Catalog:
+    """
+    Return the newest readable snapshot among `paths`, or None if there is
+    none. Unreadable snapshots are logged and skipped.
+    """
+    newest = None
+    for path in paths:
+        try:
+            snapshot = read_snapshot(path, food_attributes)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.warning(f'Ignoring catalog snapshot {path}: {e}')
+            continue
+        if newest is None or snapshot.version > newest.version:
+            newest = snapshot
+    if newest is not None:
+        logger.info(f'Mapped catalog snapshot version {newest.version} ({len(newest)} foods)')
+    return newest
+
+
+def main() -> int:
+    import attributes
+    import bulk_ingest
+
+    parser = argparse.ArgumentParser(description='Export the Foods catalog to a snapshot file')
+    parser.add_argument('--output', default='catalog_snapshot.bin')
+    parser.add_argument('--food-data', help='export this JSON array of foods instead of scanning DynamoDB')
+    parser.add_argument('--catalog-version', type=int,
+                        help='catalog version the food data corresponds to (required with --food-data)')
+    parser.add_argument('--scan-segments', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.food_data:
+        if args.catalog_version is None:
+            parser.error('--catalog-version is required with --food-data')
+        foods = {food['id']: food for food in bulk_ingest.iter_json_array(args.food_data)}
+        catalog = food_catalog.Catalog.from_items(list(foods.values()), attributes.FOOD_ATTRIBUTES, args.catalog_version)
+    else:
+        import dynamo
+
+        dynamodb = dynamo.DynamoDB()
+        # Read the version first: changes made during the scan are re-applied from the change log
+        version = food_catalog.get_catalog_version(dynamodb.Table('Metadata'))
+        catalog = food_catalog.load_catalog(dynamodb.Table('Foods'), attributes.FOOD_ATTRIBUTES, version,
+                                            total_segments=args.scan_segments)
+
+    write_snapshot(args.output, catalog)
+    print(json.dumps({'version': catalog.version, 'foods': len(catalog), 'bytes': os.path.getsize(args.output)}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Module for maintaining the catalog's derived data from the Foods table stream.
+
+The Foods table streams its keys (KEYS_ONLY) to this function, so every
+write is picked up, whether it came from add_food_data, a script or the
+console. Each batch of records is applied incrementally:
+
+- inserted foods are appended to the food id index used by random_food,
+  and so are modified foods the index is missing (e.g. written before the
+  stream was enabled); removed foods are swapped out of it;
+- the catalog version is bumped once for the batch and the changed food ids
+  are recorded in the catalog change log, from which warm containers update
+  their catalog, its attribute bitmaps and their snapshots without a scan
+  (see food_catalog.apply_catalog_changes).
+
+The Users table needs no consumer: cached rankings, responses and
+precomputed suggestions are keyed on each user's preferenceVersion.
+
+Recorded events can be replayed locally:
+
+    python catalog_stream_function.py foods_stream_event.json
+"""
+import argparse
+import json
+import logging
+import sys
+
+import dynamo
+import food_catalog
+import metrics
+
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+dynamodb = dynamo.DynamoDB()
+table = dynamodb.Table('Metadata')
+
+
+def handler(event, context):
+    """
+    Apply a batch of Foods stream records. Errors are raised so that Lambda
+    retries the batch; applying a batch twice is harmless.
+    """
+    metrics.start_request()
+    metrics.set_route('STREAM Foods')
+    status_code = 500
+    try:
+        changes = parse_records(event.get('Records', []))
+        stats = apply_changes(dynamodb, table, changes)
+        status_code = 200
+        logger.info(f'Applied stream records: {stats}')
+        return stats
+    finally:
+        metrics.finish_request(status_code)
+
+
+def parse_records(records: list) -> list:
+    """
+    Return the (event name, food id) pair of every stream record, in stream
+    order. Records of other tables are ignored.
+    """
+    changes = []
+    for record in records:
+        # arn:aws:dynamodb:<region>:<account>:table/Foods/stream/<label>
+        if record.get('eventSourceARN', 'table/Foods').split('/')[1] != 'Foods':
+            continue
+        keys = dynamo.deserialize_item(record['dynamodb']['Keys'])
+        changes.append((record['eventName'], keys['id']))
+    return changes
+
+
+def apply_changes(dynamodb, metadata_table, changes: list) -> dict:
+    """
+    Apply (event name, food id) changes to the food id index, then publish
+    them as one new catalog version.
+
+    Returns:
+        dict: Counts of indexed and unindexed foods and the new catalog version.
+    """
+    stats = {'indexed': 0, 'unindexed': 0, 'catalogVersion': None}
+    if not changes:
+        return stats
+
+    inserted = []
+    for event_name, food_id in changes:
+        if event_name in ('INSERT', 'MODIFY'):
+            # Appending skips foods already indexed, so modified foods only
+            # get a slot if they are missing one
+            inserted.append(food_id)
+        elif event_name == 'REMOVE':
+            # Appends are flushed first so that removals see the foods they follow
+            stats['indexed'] += food_catalog.append_to_food_index(dynamodb, metadata_table, inserted)
+            inserted = []
+            stats['unindexed'] += food_catalog.remove_from_food_index(metadata_table, food_id)
+    stats['indexed'] += food_catalog.append_to_food_index(dynamodb, metadata_table, inserted)
+
+    changed_ids = list(dict.fromkeys(food_id for _, food_id in changes))
+    version = food_catalog.bump_catalog_version(metadata_table)
+    food_catalog.record_catalog_change(metadata_table, version, changed_ids)
+    stats['catalogVersion'] = version
+    return stats
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Apply recorded Foods stream events')
+    parser.add_argument('events', nargs='+', help='JSON files holding a Lambda event with Records')
+    args = parser.parse_args()
+
+    for path in args.events:
+        with open(path) as file:
+            print(json.dumps(handler(json.load(file), None)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
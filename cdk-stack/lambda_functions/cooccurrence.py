@@ -0,0 +1,347 @@
+"""
+Module for the item-to-item co-occurrence model built from users' selected foods.
+
+Two foods co-occur when the same user selected both. The model keeps, for
+every food, its `neighbours` strongest co-occurring foods, scored by the
+co-occurrence count normalised by the popularity of both foods (cosine
+similarity of their user sets), as a CSR matrix:
+
+    indptr   int64, shape (foods + 1,): neighbours of food i are
+             indices[indptr[i]:indptr[i + 1]], strongest first
+    indices  int32 positions of the neighbours
+    weights  float32 scores of the neighbours
+
+It is built offline by a map/reduce over a process pool: mappers count the
+food pairs of a chunk of users (or of a Users scan segment) and split them
+into partitions by food, reducers sum the counts of one partition and keep
+the top neighbours. Neither stage shares state, so the build scales with
+the number of processes:
+
+    python cooccurrence.py --user-data users.json --food-data food_data.txt --catalog-version 3
+    python cooccurrence.py --scan-segments 64 --processes 8 --output cooccurrence.npz
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+import food_catalog
+
+
+logger = logging.getLogger()
+
+# Neighbours kept per food
+DEFAULT_NEIGHBOURS = 20
+# Foods of a single user taken into account; pairs grow with its square
+MAX_FOODS_PER_USER = 200
+# Users sent to a mapper at once when reading a user data file
+USERS_PER_CHUNK = 20000
+# Pairs a mapper expands and counts at once; a chunk or scan segment holding
+# more is counted in batches of users, keeping its memory bounded
+MAX_PAIRS_PER_BATCH = 1 << 22
+
+# Set in every worker process by _init_worker
+_worker_food_ids = None
+_worker_partitions = 1
+
+
+class CooccurrenceModel:
+    """
+    Top co-occurring neighbours of every food, in CSR form.
+
+    Attributes:
+        food_ids (np.ndarray): Sorted 'S' array of food ids, indexed by position.
+        indptr (np.ndarray): int64 row offsets, shape (foods + 1,).
+        indices (np.ndarray): int32 neighbour positions.
+        weights (np.ndarray): float32 neighbour scores.
+        catalog_version (int): Catalog version the food ids were read from.
+    """
+
+    def __init__(self, food_ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray,
+                 catalog_version: int):
+        self.food_ids = food_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.catalog_version = catalog_version
+        self._row_map = None
+
+    def save(self, path: str) -> None:
+        np.savez(path, food_ids=self.food_ids, indptr=self.indptr, indices=self.indices, weights=self.weights,
+                 catalog_version=np.int64(self.catalog_version))
+
+    @classmethod
+    def load(cls, path: str) -> 'CooccurrenceModel':
+        with np.load(path) as artifact:
+            return cls(artifact['food_ids'], artifact['indptr'], artifact['indices'], artifact['weights'],
+                       int(artifact['catalog_version']))
+
+    def positions(self, food_ids) -> np.ndarray:
+        """Return the positions of `food_ids`, leaving out foods the model does not know."""
+        return _find(self.food_ids, food_ids)
+
+    def catalog_rows(self, catalog) -> np.ndarray:
+        """Map model positions to rows of `catalog`, -1 for foods no longer in it."""
+        if self._row_map is None or self._row_map[0] is not catalog:
+            self._row_map = (catalog, catalog.find(self.food_ids))
+        return self._row_map[1]
+
+    def neighbour_scores(self, catalog, food_ids) -> tuple:
+        """
+        Sum the neighbour scores of `food_ids`.
+
+        Returns:
+            tuple: (rows, scores), the catalog rows of every neighbour still
+                in the catalog and their summed scores.
+        """
+        positions = self.positions(food_ids)
+        if not len(positions):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        starts, ends = self.indptr[positions], self.indptr[positions + 1]
+        slices = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        rows = self.catalog_rows(catalog)[self.indices[slices]]
+        known = rows >= 0
+        rows, inverse = np.unique(rows[known], return_inverse=True)
+        return rows, np.bincount(inverse, weights=self.weights[slices][known]).astype(np.float32)
+
+
+def _find(food_ids: np.ndarray, ids) -> np.ndarray:
+    """Return the positions of `ids` in the sorted 'S' array `food_ids`, unknown ids left out."""
+    positions = food_catalog.FoodIds(food_ids).find(list(ids))
+    return positions[positions >= 0]
+
+
+def _init_worker(food_ids: np.ndarray, partitions: int) -> None:
+    global _worker_food_ids, _worker_partitions
+    _worker_food_ids = food_ids
+    _worker_partitions = partitions
+
+
+def count_pairs(selections, food_ids: np.ndarray, partitions: int) -> tuple:
+    """
+    Count the co-occurring food pairs of a group of users.
+
+    Parameters:
+        selections: One iterable of selected food ids per user.
+        food_ids (np.ndarray): Sorted 'S' array of the known food ids.
+        partitions (int): Number of reducer partitions; pair (a, b) goes to
+            partition a % partitions.
+
+    Returns:
+        tuple: (pairs, frequencies). pairs holds one (keys, counts) per
+            partition, keys being a * len(food_ids) + b. frequencies counts
+            the users having selected each food.
+    """
+    food_count = len(food_ids)
+    # Flatten the group into (user, position) entries, unknown foods left out
+    users, selected = [], []
+    for user, selected_foods in enumerate(selections):
+        users.extend([user] * len(selected_foods))
+        selected.extend(selected_foods)
+    positions = food_catalog.FoodIds(food_ids).find(selected)
+    known = positions >= 0
+    entries = np.unique(np.asarray(users, dtype=np.int64)[known] * food_count + positions[known])
+    users, positions = entries // food_count, entries % food_count
+
+    # Entries are sorted by user: cap every user at MAX_FOODS_PER_USER foods
+    starts = np.searchsorted(users, users)
+    capped = np.arange(len(users)) - starts < MAX_FOODS_PER_USER
+    users, positions = users[capped], positions[capped]
+    frequencies = np.bincount(positions, minlength=food_count)
+
+    # Split the users into batches of about MAX_PAIRS_PER_BATCH pairs
+    user_starts = np.flatnonzero(np.diff(users, prepend=-1))
+    user_sizes = np.diff(np.append(user_starts, len(users)))
+    user_pairs = user_sizes * (user_sizes - 1)
+    batch_numbers = (np.cumsum(user_pairs) - user_pairs) // MAX_PAIRS_PER_BATCH
+    batch_starts = user_starts[np.flatnonzero(np.diff(batch_numbers, prepend=-1))]
+    bounds = np.concatenate(([0], batch_starts[1:], [len(users)]))
+    batches = [_count_user_pairs(users[start:end], positions[start:end], food_count)
+               for start, end in zip(bounds[:-1], bounds[1:])]
+    if len(batches) == 1:
+        keys, counts = batches[0]
+    else:
+        keys, inverse = np.unique(np.concatenate([keys for keys, _ in batches]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([counts for _, counts in batches])).astype(np.int64)
+    partition = (keys // food_count) % partitions
+    return [(keys[partition == p], counts[partition == p]) for p in range(partitions)], frequencies
+
+
+def _count_user_pairs(users: np.ndarray, positions: np.ndarray, food_count: int) -> tuple:
+    """Return the sorted pair keys of entries sorted by user, and their counts."""
+    # Pair every entry with every entry of the same user, itself excluded
+    starts = np.searchsorted(users, users)
+    sizes = np.searchsorted(users, users, side='right') - starts
+    first = np.repeat(np.arange(len(users)), sizes)
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    second = np.repeat(starts, sizes) + np.arange(len(first)) - offsets
+    distinct = first != second
+    pair_keys = positions[first[distinct]] * food_count + positions[second[distinct]]
+    return np.unique(pair_keys, return_counts=True)
+
+
+def top_neighbours(partition_pairs: list, frequencies: np.ndarray, neighbours: int) -> tuple:
+    """
+    Sum the pair counts of one partition and keep the `neighbours` best
+    scored neighbours of each of its foods.
+
+    Returns:
+        tuple: (rows, columns, scores) of the kept pairs.
+    """
+    food_count = len(frequencies)
+    keys = np.concatenate([keys for keys, _ in partition_pairs])
+    counts = np.concatenate([counts for _, counts in partition_pairs])
+    keys, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts)
+    rows, columns = keys // food_count, keys % food_count
+    scores = counts / np.sqrt(frequencies[rows] * frequencies[columns])
+
+    # Best first within each row, ties by position. Scores are at most 1, so
+    # one stable sort on the row and the quantised score replaces a lexsort
+    sort_keys = (rows << 32) | np.round(np.clip(1 - scores, 0, 1) * 0xFFFFFFFF).astype(np.int64)
+    order = np.argsort(sort_keys, kind='stable')
+    rows, columns, scores = rows[order], columns[order], scores[order]
+    row_sizes = np.bincount(rows, minlength=food_count)
+    rank = np.arange(len(rows)) - (np.cumsum(row_sizes) - row_sizes)[rows]
+    kept = rank < neighbours
+    return rows[kept], columns[kept].astype(np.int32), scores[kept].astype(np.float32)
+
+
+def _map_chunk(selections: list) -> tuple:
+    return count_pairs(selections, _worker_food_ids, _worker_partitions)
+
+
+def _map_segment(task: tuple) -> tuple:
+    """Scan one segment of the Users table and count its pairs."""
+    import dynamo
+
+    table_name, segment, total_segments = task
+    selections = []
+    food_catalog._scan_segment(
+        dynamo.DynamoDB().Table(table_name),
+        {'ProjectionExpression': 'selectedFoods', 'Segment': segment, 'TotalSegments': total_segments},
+        lambda items: selections.extend(item['selectedFoods'] for item in items if item.get('selectedFoods'))
+    )
+    return count_pairs(selections, _worker_food_ids, _worker_partitions)
+
+
+def _reduce_partition(task: tuple) -> tuple:
+    return top_neighbours(*task)
+
+
+def build_model(food_ids: np.ndarray, catalog_version: int, map_function, map_tasks, processes: int = 1,
+                neighbours: int = DEFAULT_NEIGHBOURS) -> CooccurrenceModel:
+    """
+    Build the model with a map/reduce over `processes` processes.
+
+    Parameters:
+        food_ids (np.ndarray): Sorted 'S' array of the catalog's food ids.
+        catalog_version (int): Catalog version the food ids were read from.
+        map_function: Module-level function counting the pairs of one map
+            task (_map_chunk or _map_segment).
+        map_tasks: Iterable of map tasks.
+        processes (int): Worker processes; 1 runs everything in this process.
+        neighbours (int): Neighbours kept per food.
+    """
+    partitions = max(1, processes)
+    frequencies = np.zeros(len(food_ids), dtype=np.int64)
+    partition_pairs = [[] for _ in range(partitions)]
+
+    def collect(mapped):
+        for pairs, task_frequencies in mapped:
+            frequencies[:] += task_frequencies
+            for partition, pairs_of_partition in enumerate(pairs):
+                partition_pairs[partition].append(pairs_of_partition)
+
+    if processes <= 1:
+        _init_worker(food_ids, partitions)
+        collect(map(map_function, map_tasks))
+        reduced = [top_neighbours(pairs, frequencies, neighbours) for pairs in partition_pairs]
+    else:
+        # Imported here as the handler imports this module, and multiprocessing
+        # would add about 10 ms to its cold start
+        import multiprocessing
+
+        # Spawned rather than forked: the parent may hold botocore clients and threads
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes, initializer=_init_worker, initargs=(food_ids, partitions)) as pool:
+            collect(pool.imap_unordered(map_function, map_tasks))
+            reduced = pool.map(_reduce_partition, [(pairs, frequencies, neighbours) for pairs in partition_pairs])
+
+    rows = np.concatenate([rows for rows, _, _ in reduced])
+    columns = np.concatenate([columns for _, columns, _ in reduced])
+    scores = np.concatenate([scores for _, _, scores in reduced])
+    # Reducers each return whole rows already best first, so a stable sort by row suffices
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(len(food_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(food_ids)), out=indptr[1:])
+    return CooccurrenceModel(food_ids, indptr, columns[order], scores[order], catalog_version)
+
+
+def load_model(path: str) -> CooccurrenceModel:
+    """Load the model at `path`, or return None if there is none or it is unreadable."""
+    try:
+        model = CooccurrenceModel.load(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f'Ignoring unreadable co-occurrence model {path}: {e}')
+        return None
+    logger.info(f'Loaded co-occurrence model for catalog version {model.catalog_version} '
+                f'({len(model.food_ids)} foods, {len(model.indices)} neighbours)')
+    return model
+
+
+def main() -> int:
+    import attributes
+    import bulk_ingest
+
+    parser = argparse.ArgumentParser(description='Build the co-occurrence model from users\' selected foods')
+    parser.add_argument('--user-data', help='read this JSON array of users instead of scanning Users')
+    parser.add_argument('--food-data', help='read the food ids from this JSON array instead of scanning Foods')
+    parser.add_argument('--catalog-version', type=int,
+                        help='catalog version the food data corresponds to (required with --food-data)')
+    parser.add_argument('--output', default='cooccurrence.npz')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--neighbours', type=int, default=DEFAULT_NEIGHBOURS)
+    parser.add_argument('--scan-segments', type=int, default=64,
+                        help='Users scan segments, one map task each')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.food_data:
+        if args.catalog_version is None:
+            parser.error('--catalog-version is required with --food-data')
+        catalog = food_catalog.Catalog.from_items(list(bulk_ingest.iter_json_array(args.food_data)),
+                                                  attributes.FOOD_ATTRIBUTES, args.catalog_version)
+    else:
+        import dynamo
+
+        dynamodb = dynamo.DynamoDB()
+        version = food_catalog.get_catalog_version(dynamodb.Table('Metadata'))
+        catalog = food_catalog.load_catalog(dynamodb.Table('Foods'), attributes.FOOD_ATTRIBUTES, version,
+                                            total_segments=4)
+
+    if args.user_data:
+        selections = (user.get('selectedFoods', ()) for user in bulk_ingest.iter_json_array(args.user_data))
+        map_function, map_tasks = _map_chunk, food_catalog.iter_chunks(selections, USERS_PER_CHUNK)
+    else:
+        map_function = _map_segment
+        map_tasks = [('Users', segment, args.scan_segments) for segment in range(args.scan_segments)]
+
+    model = build_model(catalog.food_ids.ids, catalog.version, map_function, map_tasks,
+                        processes=args.processes, neighbours=args.neighbours)
+    model.save(args.output)
+    print(json.dumps({
+        'foods': len(model.food_ids), 'neighbours': len(model.indices), 'processes': args.processes,
+        'seconds': round(time.perf_counter() - start, 1), 'output': args.output
+    }))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Module providing lightweight DynamoDB access on top of a lazily created
+low-level botocore client.
+
+Importing boto3 and building its resource layer is one of the slowest parts
+of a Python Lambda cold start. This module exposes the subset of the
+resource API the function uses (Table.get_item/put_item/update_item/
+delete_item/scan and batch_get_item) with the same Python value types, but
+only imports botocore and creates the client on the first call.
+
+Independent requests (e.g. a user fetch and a catalog scan) can be issued
+concurrently on the shared thread pool returned by get_executor(), whose
+size matches the client's connection pool.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import metrics
+
+
+# Connections kept open per container; scans and batch writes use a thread pool
+MAX_POOL_CONNECTIONS = int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', 16))
+# Threads of the shared I/O pool; the calling thread keeps the remaining connection
+IO_WORKERS = int(os.environ.get('DYNAMODB_IO_WORKERS', max(1, MAX_POOL_CONNECTIONS - 1)))
+
+_client = None
+_client_lock = threading.Lock()
+_executor = None
+
+
+def get_client():
+    """Return the shared DynamoDB client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import botocore.session
+                from botocore.config import Config
+
+                config = Config(
+                    tcp_keepalive=True,
+                    max_pool_connections=MAX_POOL_CONNECTIONS,
+                    connect_timeout=2,
+                    read_timeout=5,
+                    retries={'mode': 'standard', 'max_attempts': 3}
+                )
+                _client = botocore.session.get_session().create_client('dynamodb', config=config)
+    return _client
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Return the shared I/O thread pool, creating it on first use.
+
+    Only submit tasks that do not themselves wait on tasks of this pool,
+    which could otherwise leave every worker waiting.
+    """
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='dynamodb-io')
+    return _executor
+
+
+def serialize(value) -> dict:
+    """Convert a Python value into a DynamoDB attribute value."""
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, float):
+        return {'N': str(Decimal(str(value)))}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, dict):
+        return {'M': {key: serialize(item) for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(item) for item in value]}
+    if isinstance(value, (set, frozenset)):
+        if not value:
+            # DynamoDB rejects empty sets; leave the attribute out instead
+            raise ValueError('DynamoDB sets cannot be empty')
+        if all(isinstance(item, str) for item in value):
+            return {'SS': list(value)}
+        if all(isinstance(item, (bytes, bytearray)) for item in value):
+            return {'BS': [bytes(item) for item in value]}
+        return {'NS': [str(item) for item in value]}
+    raise TypeError(f'Unsupported type for DynamoDB: {type(value).__name__}')
+
+
+def deserialize(attribute_value: dict):
+    """Convert a DynamoDB attribute value into a Python value."""
+    (attribute_type, value), = attribute_value.items()
+    if attribute_type == 'S' or attribute_type == 'BOOL' or attribute_type == 'B':
+        return value
+    if attribute_type == 'N':
+        return Decimal(value)
+    if attribute_type == 'M':
+        return {key: deserialize(item) for key, item in value.items()}
+    if attribute_type == 'L':
+        return [deserialize(item) for item in value]
+    if attribute_type == 'SS' or attribute_type == 'BS':
+        return set(value)
+    if attribute_type == 'NS':
+        return {Decimal(item) for item in value}
+    if attribute_type == 'NULL':
+        return None
+    raise TypeError(f'Unsupported DynamoDB type: {attribute_type}')
+
+
+def serialize_item(item: dict) -> dict:
+    return {key: serialize(value) for key, value in item.items()}
+
+
+def deserialize_item(item: dict) -> dict:
+    return {key: deserialize(value) for key, value in item.items()}
+
+
+class _Meta:
+    @property
+    def client(self):
+        return get_client()
+
+
+class DynamoDB:
+    """Drop-in replacement for the parts of boto3.resource('dynamodb') in use."""
+
+    def __init__(self):
+        self.meta = _Meta()
+        self._tables = {}
+
+    def Table(self, name: str) -> 'Table':
+        if name not in self._tables:
+            self._tables[name] = Table(name)
+        return self._tables[name]
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        request_items = {
+            table_name: dict(request, Keys=[serialize_item(key) for key in request['Keys']])
+            for table_name, request in RequestItems.items()
+        }
+        kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        response = get_client().batch_get_item(RequestItems=request_items, **kwargs)
+        metrics.record_dynamodb('batch_get_item', response)
+        response['Responses'] = {
+            table_name: [deserialize_item(item) for item in items]
+            for table_name, items in response.get('Responses', {}).items()
+        }
+        response['UnprocessedKeys'] = {
+            table_name: dict(request, Keys=[deserialize_item(key) for key in request['Keys']])
+            for table_name, request in response.get('UnprocessedKeys', {}).items()
+        }
+        return response
+
+
+class Table:
+    """Table-level calls taking and returning plain Python values."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _call(self, operation: str, **kwargs) -> dict:
+        for argument in ('Key', 'Item', 'ExclusiveStartKey'):
+            if argument in kwargs:
+                kwargs[argument] = serialize_item(kwargs[argument])
+        if 'ExpressionAttributeValues' in kwargs:
+            kwargs['ExpressionAttributeValues'] = serialize_item(kwargs['ExpressionAttributeValues'])
+        # Reported in the request's metrics line; costs no extra capacity
+        kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        response = getattr(get_client(), operation)(TableName=self.name, **kwargs)
+        metrics.record_dynamodb(operation, response)
+        if 'Item' in response:
+            response['Item'] = deserialize_item(response['Item'])
+        if 'Items' in response:
+            response['Items'] = [deserialize_item(item) for item in response['Items']]
+        for argument in ('Attributes', 'LastEvaluatedKey'):
+            if argument in response:
+                response[argument] = deserialize_item(response[argument])
+        return response
+
+    def get_item(self, **kwargs) -> dict:
+        return self._call('get_item', **kwargs)
+
+    def put_item(self, **kwargs) -> dict:
+        return self._call('put_item', **kwargs)
+
+    def update_item(self, **kwargs) -> dict:
+        return self._call('update_item', **kwargs)
+
+    def delete_item(self, **kwargs) -> dict:
+        return self._call('delete_item', **kwargs)
+
+    def scan(self, **kwargs) -> dict:
+        return self._call('scan', **kwargs)
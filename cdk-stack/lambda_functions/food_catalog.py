@@ -0,0 +1,629 @@
+"""Module for loading the Foods catalog and caching it in a warm Lambda container"""
+import logging
+import random
+import time
+from array import array
+from collections.abc import Sequence
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+import bulk_ingest
+import dynamo
+import scoring
+
+
+logger = logging.getLogger()
+
+# Key of the Metadata item holding the catalog version counter and food count
+CATALOG_METADATA_KEY = {'identifier': 'catalog'}
+# Prefix of the Metadata items forming the dense food id index
+FOOD_INDEX_PREFIX = 'food_index#'
+# Prefix of the Metadata items mapping a food id back to its index slot
+FOOD_SLOT_PREFIX = 'food_slot#'
+# Prefix of the Metadata items listing the foods changed by each catalog version
+CATALOG_CHANGE_PREFIX = 'catalog_change#'
+# Metadata items maintained by this module, which clients must never delete
+INTERNAL_METADATA_PREFIXES = (FOOD_INDEX_PREFIX, FOOD_SLOT_PREFIX, CATALOG_CHANGE_PREFIX)
+# Maximum number of keys accepted by a single BatchGetItem call
+MAX_BATCH_GET_KEYS = 100
+# BatchGetItem calls made to sample random foods when index slots are missing
+MAX_SAMPLE_ATTEMPTS = 3
+# Largest change set recorded per version and applied on top of a snapshot;
+# bigger changes are recorded without ids and force a full scan
+MAX_CHANGED_FOODS = 1000
+
+
+def is_internal_metadata_key(identifier: str) -> bool:
+    """Return True for the catalog item and the food index and change log items."""
+    return identifier == CATALOG_METADATA_KEY['identifier'] or identifier.startswith(INTERNAL_METADATA_PREFIXES)
+
+
+class FoodIds(Sequence):
+    """
+    Food ids stored as one sorted fixed-width bytes array instead of a list of
+    str objects and a lookup dict, which costs roughly 100 bytes per food less.
+    Indexing returns str; find() looks ids up by binary search.
+    """
+
+    def __init__(self, sorted_ids: np.ndarray):
+        self.ids = sorted_ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, row: int) -> str:
+        return self.ids[row].decode()
+
+    def __contains__(self, food_id) -> bool:
+        return self.find([food_id])[0] >= 0
+
+    def find(self, food_ids) -> np.ndarray:
+        """Return the row of every id in `food_ids`, -1 for ids not present."""
+        wanted = _encode_ids(food_ids)
+        if len(self.ids) == 0 or len(wanted) == 0:
+            return np.full(len(wanted), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, wanted), len(self.ids) - 1)
+        return np.where(self.ids[rows] == wanted, rows, -1)
+
+
+class Catalog:
+    """
+    In-memory copy of the Foods table, bit-packed for scoring.
+
+    Every food is a single uint64 mask with bit n set when it has attribute n
+    of `food_attributes`, so a million foods take 8 MB of masks plus their
+    ids. Rows are ordered by food id. Each attribute also gets a row bitmap
+    (the inverted index used for filters), built on first use so mapping a
+    snapshot stays free.
+
+    Attributes:
+        food_ids (FoodIds): Food ids in row order.
+        masks (np.ndarray): uint64 attribute mask per row.
+        food_attributes (list): Attribute names, in bit order.
+        version (int): Catalog version the items were loaded at.
+        loaded_at (float): time.monotonic() of the load.
+    """
+
+    def __init__(self, food_ids: FoodIds, masks: np.ndarray, food_attributes: list, version: int):
+        self.food_ids = food_ids
+        self.masks = masks
+        self.food_attributes = list(food_attributes)
+        self.attribute_bits = {attribute: 1 << bit for bit, attribute in enumerate(self.food_attributes)}
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self._attribute_bitmaps = {}
+        self._attribute_frequencies = None
+
+    @classmethod
+    def from_ids(cls, food_ids, masks: np.ndarray, food_attributes: list, version: int) -> 'Catalog':
+        """Build a catalog from food ids (str or bytes) in any order and their masks."""
+        ids = _encode_ids(food_ids)
+        order = np.argsort(ids, kind='stable')
+        return cls(FoodIds(ids[order]), np.asarray(masks, dtype=np.uint64)[order], food_attributes, version)
+
+    @classmethod
+    def from_items(cls, food_items: list, food_attributes: list, version: int) -> 'Catalog':
+        builder = CatalogBuilder(food_attributes)
+        builder.add_page(food_items)
+        return CatalogBuilder.build([builder], version)
+
+    def __len__(self) -> int:
+        return len(self.food_ids)
+
+    def find(self, food_ids) -> np.ndarray:
+        """Return the row of every id in `food_ids`, -1 for ids not in the catalog."""
+        return self.food_ids.find(food_ids)
+
+    def attribute_counts(self, food_ids) -> np.ndarray:
+        """Return, per attribute, how many of the given foods have it."""
+        matrix = scoring.unpack_masks(self.masks[self.find(food_ids)], len(self.food_attributes))
+        return matrix.sum(axis=0, dtype=np.int64)
+
+    def excluded_mask(self, food_ids) -> np.ndarray:
+        """Return a boolean row mask flagging the given food ids."""
+        mask = np.zeros(len(self.food_ids), dtype=bool)
+        rows = self.find(list(food_ids))
+        mask[rows[rows >= 0]] = True
+        return mask
+
+    def attribute_bitmap(self, attribute: int) -> np.ndarray:
+        """
+        Return the row bitmap of attribute number `attribute`: bit r (little
+        endian, np.packbits layout) is set when row r has the attribute.
+        """
+        bitmap = self._attribute_bitmaps.get(attribute)
+        if bitmap is None:
+            has_attribute = (self.masks >> np.uint64(attribute)) & np.uint64(1)
+            bitmap = np.packbits(has_attribute.astype(bool), bitorder='little')
+            self._attribute_bitmaps[attribute] = bitmap
+        return bitmap
+
+    def attribute_frequencies(self) -> np.ndarray:
+        """Return how many foods have each attribute."""
+        if self._attribute_frequencies is None:
+            self._attribute_frequencies = np.array([
+                int(scoring.POPCOUNT_TABLE[self.attribute_bitmap(attribute)].sum(dtype=np.int64))
+                for attribute in range(len(self.food_attributes))
+            ])
+        return self._attribute_frequencies
+
+    def rows_with_any(self, attributes) -> np.ndarray:
+        """Return the sorted rows of the foods having at least one of `attributes` (numbers)."""
+        bitmap = np.zeros((len(self) + 7) // 8, dtype=np.uint8)
+        for attribute in attributes:
+            bitmap |= self.attribute_bitmap(int(attribute))
+        return self._bitmap_rows(bitmap)
+
+    def matching_rows(self, required: list = (), forbidden: list = ()) -> np.ndarray:
+        """
+        Return the sorted rows of the foods having every `required` attribute
+        and none of the `forbidden` ones (food attribute names), by
+        intersecting attribute bitmaps.
+        """
+        bitmap = np.full((len(self) + 7) // 8, 0xFF, dtype=np.uint8)
+        for attribute in required:
+            bitmap &= self.attribute_bitmap(self.food_attributes.index(attribute))
+        for attribute in forbidden:
+            bitmap &= ~self.attribute_bitmap(self.food_attributes.index(attribute))
+        return self._bitmap_rows(bitmap)
+
+    def _bitmap_rows(self, bitmap: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(bitmap, count=len(self), bitorder='little'))
+
+
+class CatalogBuilder:
+    """
+    Packs scan pages into masks as they arrive, so only one page of item
+    dicts per scan segment is alive at a time.
+    """
+
+    def __init__(self, food_attributes: list):
+        if len(food_attributes) > scoring.MAX_PACKED_ATTRIBUTES:
+            raise ValueError(f'At most {scoring.MAX_PACKED_ATTRIBUTES} food attributes fit in a packed catalog')
+        self.food_attributes = list(food_attributes)
+        self.attribute_bits = {attribute: 1 << bit for bit, attribute in enumerate(self.food_attributes)}
+        self.food_ids = []
+        self.masks = array('Q')
+
+    def add_page(self, food_items: list) -> None:
+        attribute_bits = self.attribute_bits
+        for food_item in food_items:
+            self.food_ids.append(food_item['id'])
+            self.masks.append(sum(attribute_bits.get(name, 0) for name, value in food_item.items() if value))
+
+    @staticmethod
+    def build(builders: list, version: int) -> Catalog:
+        """Combine the pages of `builders` (one per scan segment) into a Catalog."""
+        food_ids = [food_id for builder in builders for food_id in builder.food_ids]
+        masks = np.concatenate([np.frombuffer(builder.masks, dtype=np.uint64) for builder in builders]) \
+            if food_ids else np.zeros(0, dtype=np.uint64)
+        return Catalog.from_ids(food_ids, masks, builders[0].food_attributes, version)
+
+
+def _encode_ids(food_ids) -> np.ndarray:
+    if isinstance(food_ids, np.ndarray) and food_ids.dtype.kind == 'S':
+        return food_ids
+    encoded = [food_id.encode() for food_id in food_ids]
+    return np.array(encoded, dtype=bytes) if encoded else np.zeros(0, dtype='S1')
+
+
+class CatalogCache:
+    """
+    Module-level cache of the catalog that survives across invocations in a
+    warm container.
+
+    Every lookup reads the catalog version counter from the Metadata table
+    (one small get_item) and only reloads the catalog when the version moved
+    or the cached copy is older than `ttl_seconds`. Callers that tolerate a
+    catalog up to `ttl_seconds` old can skip the version read.
+
+    A reload starts from `snapshot` (see catalog_snapshot.py) when there is
+    one: the foods changed since the snapshot version are read from the
+    catalog change log and applied on top of it. Foods is only scanned when
+    the change log cannot bring the snapshot up to date.
+    """
+
+    def __init__(self, ttl_seconds: float, scan_segments: int = 1, snapshot: Catalog = None):
+        self.ttl_seconds = ttl_seconds
+        self.scan_segments = scan_segments
+        self.snapshot = snapshot
+        self.catalog = None
+
+    def get(self, dynamodb, food_table, metadata_table, food_attributes: list,
+            verify_version: bool = True) -> Catalog:
+        catalog = self.catalog
+        if not verify_version and catalog is not None \
+                and time.monotonic() - catalog.loaded_at < self.ttl_seconds:
+            return catalog
+
+        version = get_catalog_version(metadata_table)
+        catalog = self.peek(version)
+        if catalog is not None:
+            return catalog
+
+        if self.snapshot is not None and self.snapshot.version <= version:
+            catalog = apply_catalog_changes(dynamodb, food_table, metadata_table, self.snapshot, version)
+        if catalog is None:
+            logger.info(f'Loading catalog version {version}')
+            catalog = load_catalog(food_table, food_attributes, version, total_segments=self.scan_segments)
+        self.catalog = catalog
+        return self.catalog
+
+    def peek(self, version: int) -> Catalog:
+        """Return the cached catalog if it is still fresh at `version`, else None."""
+        catalog = self.catalog
+        if catalog is not None and catalog.version == version \
+                and time.monotonic() - catalog.loaded_at < self.ttl_seconds:
+            return catalog
+        return None
+
+    def invalidate(self) -> None:
+        self.catalog = None
+
+
+def load_catalog(food_table, food_attributes: list, version: int, total_segments: int = 1) -> Catalog:
+    """Scan the Foods table into a Catalog, packing each page as it arrives."""
+    builders = [CatalogBuilder(food_attributes) for _ in range(max(total_segments, 1))]
+    scan_pages(
+        food_table,
+        lambda segment, items: builders[segment].add_page(items),
+        attributes=['id'] + list(food_attributes),
+        total_segments=total_segments
+    )
+    return CatalogBuilder.build(builders, version)
+
+
+def apply_catalog_changes(dynamodb, food_table, metadata_table, base: Catalog, version: int) -> Catalog:
+    """
+    Bring `base` up to `version` using the catalog change log.
+
+    Reads the change records of every version after `base.version`, then
+    re-reads the changed foods from the Foods table: foods still there are
+    upserted, the others removed.
+
+    Returns:
+        Catalog: The catalog at `version`, or None if a change record is
+            missing or too large to apply, in which case Foods must be scanned.
+    """
+    versions = range(base.version + 1, version + 1)
+    if len(versions) > MAX_BATCH_GET_KEYS:
+        return None
+    changed_ids = set()
+    if versions:
+        keys = [{'identifier': f'{CATALOG_CHANGE_PREFIX}{change}'} for change in versions]
+        changes = batch_get_items(dynamodb, metadata_table.name, keys, ['identifier', 'foodIds'])
+        if len(changes) < len(keys) or any('foodIds' not in change for change in changes):
+            logger.info(f'Catalog change log cannot bring version {base.version} to {version}')
+            return None
+        for change in changes:
+            changed_ids.update(change['foodIds'])
+    if len(changed_ids) > MAX_CHANGED_FOODS:
+        return None
+
+    logger.info(f'Applying {len(changed_ids)} changed foods to catalog version {base.version}')
+    changed_ids = sorted(changed_ids)
+    builder = CatalogBuilder(base.food_attributes)
+    for start in range(0, len(changed_ids), MAX_BATCH_GET_KEYS):
+        keys = [{'id': food_id} for food_id in changed_ids[start:start + MAX_BATCH_GET_KEYS]]
+        builder.add_page(batch_get_items(dynamodb, food_table.name, keys, ['id'] + base.food_attributes))
+    if not changed_ids:
+        return Catalog(base.food_ids, base.masks, base.food_attributes, version)
+
+    rows = base.find(changed_ids)
+    kept = np.ones(len(base), dtype=bool)
+    kept[rows[rows >= 0]] = False
+    food_ids = np.concatenate((base.food_ids.ids[kept], _encode_ids(builder.food_ids)))
+    masks = np.concatenate((base.masks[kept], np.frombuffer(builder.masks, dtype=np.uint64)))
+    return Catalog.from_ids(food_ids, masks, base.food_attributes, version)
+
+
+def record_catalog_change(metadata_table, version: int, food_ids: list) -> None:
+    """
+    Record which foods `version` of the catalog added, changed or removed.
+    Change sets larger than MAX_CHANGED_FOODS are recorded without ids, which
+    tells readers to rescan instead.
+    """
+    item = {'identifier': f'{CATALOG_CHANGE_PREFIX}{version}'}
+    if 0 < len(food_ids) <= MAX_CHANGED_FOODS:
+        item['foodIds'] = set(food_ids)
+    metadata_table.put_item(Item=item)
+
+
+def scan_table(table, attributes: list = None, total_segments: int = 1) -> list:
+    """
+    Read every item of a table, following LastEvaluatedKey pagination.
+
+    Parameters:
+        table: DynamoDB Table resource to scan.
+        attributes (list): Attribute names to fetch. Fetches whole items if None.
+        total_segments (int): Number of parallel scan segments. Each segment is
+            scanned on a thread of the shared I/O pool (dynamo.get_executor),
+            so load time scales with the segment count rather than the table
+            size.
+
+    Returns:
+        list: All items, segment by segment.
+    """
+    segments = [[] for _ in range(max(total_segments, 1))]
+    scan_pages(table, lambda segment, items: segments[segment].extend(items), attributes, total_segments)
+    return [item for segment_items in segments for item in segment_items]
+
+
+def scan_pages(table, handle_page, attributes: list = None, total_segments: int = 1) -> None:
+    """
+    Scan a table like scan_table, but hand every page to
+    `handle_page(segment, items)` instead of collecting the items. Pages of
+    one segment are handled in order, on that segment's thread.
+    """
+    scan_kwargs = {}
+    if attributes:
+        # Placeholders avoid clashes with DynamoDB reserved words
+        attribute_names = {f'#a{i}': attribute for i, attribute in enumerate(attributes)}
+        scan_kwargs['ProjectionExpression'] = ', '.join(attribute_names)
+        scan_kwargs['ExpressionAttributeNames'] = attribute_names
+
+    if total_segments <= 1:
+        _scan_segment(table, scan_kwargs, lambda items: handle_page(0, items))
+        return
+
+    def scan(segment):
+        segment_kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=total_segments)
+        _scan_segment(table, segment_kwargs, lambda items: handle_page(segment, items))
+
+    list(dynamo.get_executor().map(scan, range(total_segments)))
+
+
+def _scan_segment(table, scan_kwargs: dict, handle_items) -> None:
+    """Scan one segment page by page until LastEvaluatedKey runs out."""
+    while True:
+        response = table.scan(**scan_kwargs)
+        handle_items(response.get('Items', []))
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return
+        scan_kwargs = dict(scan_kwargs, ExclusiveStartKey=last_evaluated_key)
+
+
+def get_catalog_metadata(metadata_table) -> dict:
+    """
+    Return the catalog Metadata item as {'version': int, 'foodCount': int}.
+    Both values are 0 if the catalog was never written.
+    """
+    response = metadata_table.get_item(Key=CATALOG_METADATA_KEY, ProjectionExpression='version, foodCount')
+    item = response.get('Item', {})
+    return {'version': int(item.get('version', 0)), 'foodCount': int(item.get('foodCount', 0))}
+
+
+def get_catalog_version(metadata_table) -> int:
+    """Return the current catalog version, 0 if it was never bumped."""
+    return get_catalog_metadata(metadata_table)['version']
+
+
+def bump_catalog_version(metadata_table) -> int:
+    """Increment the catalog version after a catalog write and return it."""
+    response = metadata_table.update_item(
+        Key=CATALOG_METADATA_KEY,
+        UpdateExpression='ADD version :one',
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response['Attributes']['version'])
+
+
+def write_food_index(dynamodb, metadata_table, food_ids: list, workers: int = 1) -> None:
+    """
+    Write the dense food id index: slot n of the index holds the nth food id,
+    and the catalog Metadata item records how many slots exist. This lets
+    random foods be sampled without reading the Foods table.
+    """
+    slots = (item for slot, food_id in enumerate(food_ids) for item in _food_index_items(slot, food_id))
+    bulk_ingest.batch_write_items(dynamodb, metadata_table.name, slots, key_attribute='identifier', workers=workers)
+    metadata_table.update_item(
+        Key=CATALOG_METADATA_KEY,
+        UpdateExpression='SET foodCount = :food_count',
+        ExpressionAttributeValues={':food_count': len(food_ids)}
+    )
+
+
+def _food_index_items(slot: int, food_id: str) -> tuple:
+    """Return the index item of `slot` and the reverse item that finds it from the food id."""
+    return (
+        {'identifier': f'{FOOD_INDEX_PREFIX}{slot}', 'foodId': food_id},
+        {'identifier': f'{FOOD_SLOT_PREFIX}{food_id}', 'slot': slot},
+    )
+
+
+def append_to_food_index(dynamodb, metadata_table, food_ids: list, workers: int = 1) -> int:
+    """
+    Add foods to the end of the food id index. Foods already indexed are
+    skipped. The slots are claimed with a single atomic ADD on foodCount, so
+    concurrent appends never share a slot, and each food's reverse item is
+    written only if it does not exist yet, so a food indexed concurrently
+    (e.g. by a retried or overlapping stream batch) never gets a second
+    slot; the slots claimed for such foods are released.
+
+    Returns:
+        int: Number of foods added.
+    """
+    food_ids = list(dict.fromkeys(food_ids))
+    indexed = set()
+    for start in range(0, len(food_ids), MAX_BATCH_GET_KEYS):
+        keys = [{'identifier': f'{FOOD_SLOT_PREFIX}{food_id}'} for food_id in food_ids[start:start + MAX_BATCH_GET_KEYS]]
+        indexed.update(item['identifier'][len(FOOD_SLOT_PREFIX):]
+                       for item in batch_get_items(dynamodb, metadata_table.name, keys, ['identifier'], consistent=True))
+    food_ids = [food_id for food_id in food_ids if food_id not in indexed]
+    if not food_ids:
+        return 0
+    response = metadata_table.update_item(
+        Key=CATALOG_METADATA_KEY,
+        UpdateExpression='ADD foodCount :count',
+        ExpressionAttributeValues={':count': len(food_ids)},
+        ReturnValues='UPDATED_NEW'
+    )
+    first_slot = int(response['Attributes']['foodCount']) - len(food_ids)
+    claimed, unused_slots = {}, []
+    for slot, food_id in enumerate(food_ids, start=first_slot):
+        index_item, slot_item = _food_index_items(slot, food_id)
+        try:
+            metadata_table.put_item(Item=slot_item, ConditionExpression='attribute_not_exists(identifier)')
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            unused_slots.append(slot)
+            continue
+        claimed[slot] = index_item
+    bulk_ingest.batch_write_items(dynamodb, metadata_table.name, claimed.values(), key_attribute='identifier',
+                                  workers=workers)
+    # Highest first, so each released slot is filled from a written one or is the last
+    for slot in sorted(unused_slots, reverse=True):
+        logger.info(f'Releasing slot {slot} of the food index: its food was indexed concurrently')
+        _release_slot(metadata_table, slot)
+    return len(claimed)
+
+
+def remove_from_food_index(metadata_table, food_id: str, attempts: int = 10) -> bool:
+    """
+    Remove a food from the food id index by releasing its slot.
+
+    Returns:
+        bool: False if the food was not indexed.
+    """
+    slot_key = {'identifier': f'{FOOD_SLOT_PREFIX}{food_id}'}
+    slot_item = metadata_table.get_item(Key=slot_key, ConsistentRead=True).get('Item')
+    if slot_item is None:
+        return False
+    _release_slot(metadata_table, int(slot_item['slot']), food_id, attempts)
+    metadata_table.delete_item(Key=slot_key)
+    return True
+
+
+def _release_slot(metadata_table, slot: int, food_id: str = None, attempts: int = 10) -> None:
+    """
+    Free `slot` of the food id index, which holds `food_id` or was claimed
+    but never written if None, by moving the food of the last slot into it.
+    The last slot is released with a conditional write on foodCount, retried
+    if another writer changed the count meanwhile.
+    """
+    for _ in range(attempts):
+        food_count = int(metadata_table.get_item(Key=CATALOG_METADATA_KEY, ConsistentRead=True)
+                         .get('Item', {}).get('foodCount', 0))
+        last_slot = food_count - 1
+        last_item = None
+        if last_slot != slot:
+            last_item = metadata_table.get_item(Key={'identifier': f'{FOOD_INDEX_PREFIX}{last_slot}'},
+                                                ConsistentRead=True).get('Item')
+        if last_slot < slot or (last_slot != slot and last_item is None):
+            # A concurrent append claimed the last slot but has not written it yet
+            time.sleep(0.05)
+            continue
+        try:
+            metadata_table.update_item(
+                Key=CATALOG_METADATA_KEY,
+                UpdateExpression='SET foodCount = :last_slot',
+                ConditionExpression='foodCount = :food_count',
+                ExpressionAttributeValues={':last_slot': last_slot, ':food_count': food_count}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        moved_food_id = food_id
+        if last_item is not None:
+            moved_food_id = last_item['foodId']
+            for item in _food_index_items(slot, moved_food_id):
+                metadata_table.put_item(Item=item)
+        if moved_food_id is not None:
+            try:
+                # An append may already have reused the released slot
+                metadata_table.delete_item(
+                    Key={'identifier': f'{FOOD_INDEX_PREFIX}{last_slot}'},
+                    ConditionExpression='foodId = :food_id',
+                    ExpressionAttributeValues={':food_id': moved_food_id}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        return
+    raise RuntimeError(f'Could not release slot {slot} of the food index after {attempts} attempts')
+
+
+def sample_food_ids(dynamodb, metadata_table, food_count: int, count: int) -> list:
+    """
+    Pick `count` distinct random food ids from the dense food id index.
+
+    Costs one BatchGetItem call (plus retries of unprocessed keys) whatever
+    the size of the catalog. Slots found empty are made up for from other,
+    untried slots, for up to MAX_SAMPLE_ATTEMPTS calls; if the index still
+    comes back short, fewer ids are returned and a warning is logged.
+    """
+    food_ids = {}
+    tried = set()
+    for attempt in range(MAX_SAMPLE_ATTEMPTS):
+        missing = count - len(food_ids)
+        untried = food_count - len(tried)
+        if missing <= 0 or untried <= 0:
+            break
+        # After a short read, read extra slots in case some of those are missing too
+        wanted = min(missing if attempt == 0 else 2 * missing, untried, MAX_BATCH_GET_KEYS)
+        if untried <= 2 * wanted:
+            slots = random.sample([slot for slot in range(food_count) if slot not in tried], wanted)
+        else:
+            slots = set()
+            while len(slots) < wanted:
+                slot = random.randrange(food_count)
+                if slot not in tried:
+                    slots.add(slot)
+            slots = list(slots)
+        tried.update(slots)
+        keys = [{'identifier': f'{FOOD_INDEX_PREFIX}{slot}'} for slot in slots]
+        for item in batch_get_items(dynamodb, metadata_table.name, keys, ['foodId']):
+            if len(food_ids) < count:
+                food_ids.setdefault(item['foodId'])
+    if len(food_ids) < count:
+        logger.warning(f'Food index returned {len(food_ids)} of {count} foods after reading {len(tried)} '
+                       f'of {food_count} slots')
+    food_ids = list(food_ids)
+    # Slots are read in arbitrary order; shuffle so the order stays random
+    random.shuffle(food_ids)
+    return food_ids
+
+
+def batch_get_items(dynamodb, table_name: str, keys: list, attributes: list, consistent: bool = False,
+                    max_retries: int = 4) -> list:
+    """
+    Read up to MAX_BATCH_GET_KEYS items in one BatchGetItem call. Unprocessed
+    keys and throttled calls are retried with the exponential backoff of
+    bulk_ingest. Missing items are left out of the result.
+
+    Raises:
+        RuntimeError: If keys are still unprocessed after `max_retries` retries.
+    """
+    attribute_names = {f'#a{i}': attribute for i, attribute in enumerate(attributes)}
+    request = {'ProjectionExpression': ', '.join(attribute_names), 'ExpressionAttributeNames': attribute_names,
+               'ConsistentRead': consistent}
+    items = []
+    for attempt in range(max_retries + 1):
+        try:
+            response = dynamodb.batch_get_item(RequestItems={table_name: dict(request, Keys=keys)})
+            items.extend(response['Responses'].get(table_name, []))
+            keys = response.get('UnprocessedKeys', {}).get(table_name, {}).get('Keys', [])
+        except ClientError as e:
+            if e.response['Error']['Code'] not in bulk_ingest.THROTTLING_ERROR_CODES:
+                raise
+        if not keys:
+            return items
+        bulk_ingest.backoff(attempt)
+    raise RuntimeError(f'Gave up reading {len(keys)} items from {table_name}')
+
+
+def iter_chunks(items, size: int):
+    """Yield lists of `size` consecutive items of an iterable; the last one may be shorter."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,47 +1,185 @@
 """Module for retrieving and sending JSON formatted content"""
 import json
-"""AWS Module for interacting with AWS resources"""
-import boto3
 from botocore.exceptions import ClientError
 import logging
+import os
 import random
-import math
+
+import attributes
+import dynamo
+import food_catalog
+import metrics
+import ranking
+import response_cache
+import user_preferences
 
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
+# Request bodies, items and suggestions, silenced with LOG_ITEMS=false
+item_logger = metrics.item_logger
 
-# Initialize a DynamoDB session
-dynamodb = boto3.resource('dynamodb')
+# Initialize DynamoDB access; the client itself is created on first use
+dynamodb = dynamo.DynamoDB()
 # Create table object
 table = dynamodb.Table('Metadata')
 food_table = dynamodb.Table('Foods')
 user_table = dynamodb.Table('Users')
 
+# Number of random foods returned when the request does not specify a count
+DEFAULT_RANDOM_FOOD_COUNT = 3
+NUMBER_OF_SUGGESTIONS = 3
+# Items that may be requested together, e.g. requested_item=random_food,food_suggestions
+REQUESTABLE_ITEMS = ('random_food', 'food_suggestions')
+# Most food ids accepted in the ids list of one click
+MAX_SELECTED_FOODS = 100
+
+# Number of threads writing seed data batches concurrently
+SEED_WRITE_WORKERS = int(os.environ.get('SEED_WRITE_WORKERS', 4))
+# The food id index, catalog version and change log are maintained by
+# catalog_stream_function from the Foods stream instead of by add_food_data
+CATALOG_CHANGES_FROM_STREAM = os.environ.get('CATALOG_CHANGES_FROM_STREAM', 'false').lower() == 'true'
+
+# Catalog snapshots written by catalog_snapshot.py, newest wins; layer contents are extracted to /opt
+CATALOG_SNAPSHOT_PATHS = [
+    path for path in os.environ.get('CATALOG_SNAPSHOT_PATHS', '/opt/catalog_snapshot.bin:/tmp/catalog_snapshot.bin').split(':')
+    if os.path.exists(path)
+]
+# The artifact loaders are only imported when their file exists, keeping them off the cold start
+if CATALOG_SNAPSHOT_PATHS:
+    import catalog_snapshot
+    # Mapped, not read: the snapshot costs no I/O until it is scored
+    snapshot = catalog_snapshot.load_snapshot(CATALOG_SNAPSHOT_PATHS, attributes.FOOD_ATTRIBUTES)
+else:
+    snapshot = None
+
+# Catalog cache kept across invocations of a warm container
+catalog_cache = food_catalog.CatalogCache(
+    ttl_seconds=float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', 300)),
+    scan_segments=int(os.environ.get('CATALOG_SCAN_SEGMENTS', 4)),
+    snapshot=snapshot
+)
+
+# Optional ANN index for cosine suggestions, built offline by ann_index.py
+ANN_INDEX_PATH = os.environ.get('ANN_INDEX_PATH', 'ann_index.npz')
+if os.path.exists(ANN_INDEX_PATH):
+    import ann_index
+    ann = ann_index.load_index(ANN_INDEX_PATH)
+else:
+    ann = None
+# Bucket flips probed per hash table; higher raises recall and latency
+ANN_PROBE_RADIUS = int(os.environ.get('ANN_PROBE_RADIUS', 1))
+# Smaller catalogs are searched exactly
+ANN_MIN_CATALOG_SIZE = int(os.environ.get('ANN_MIN_CATALOG_SIZE', 50000))
+
+# Recently active users kept in the warm container
+user_cache = user_preferences.UserCache(
+    max_size=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.environ.get('USER_CACHE_TTL_SECONDS', 30))
+)
+
+# Per-user ranking heads, updated incrementally as preferences grow
+ranker_cache = ranking.RankerCache(
+    max_size=int(os.environ.get('RANKER_CACHE_SIZE', 256)),
+    head_size=int(os.environ.get('RANKER_HEAD_SIZE', 64))
+)
+
+# Ranking strategies selectable with the strategy= query parameter
+additive_strategy = ranking.AdditiveStrategy(ranker_cache)
+ranking_strategies = {
+    'additive': additive_strategy,
+    'cosine': ranking.CosineStrategy(ann, ANN_PROBE_RADIUS, ANN_MIN_CATALOG_SIZE),
+    'tfidf': ranking.TfidfStrategy(),
+    'mmr': ranking.MmrStrategy(
+        additive_strategy,
+        pool_size=int(os.environ.get('MMR_POOL_SIZE', 30)),
+        relevance_weight=float(os.environ.get('MMR_RELEVANCE_WEIGHT', 0.7))
+    ),
+}
+DEFAULT_RANKING_STRATEGY = os.environ.get('RANKING_STRATEGY', 'additive')
+
+# Optional co-occurrence model built offline by cooccurrence.py, blended into every strategy
+COOCCURRENCE_PATH = os.environ.get('COOCCURRENCE_PATH', 'cooccurrence.npz')
+if os.path.exists(COOCCURRENCE_PATH):
+    import cooccurrence
+    cooccurrence_model = cooccurrence.load_model(COOCCURRENCE_PATH)
+else:
+    cooccurrence_model = None
+# Share of the suggestion score given to foods selected together with the user's own
+COOCCURRENCE_WEIGHT = float(os.environ.get('COOCCURRENCE_WEIGHT', 0.3))
+if cooccurrence_model is not None and COOCCURRENCE_WEIGHT > 0:
+    ranking_strategies = {
+        name: ranking.CooccurrenceBlend(
+            strategy, cooccurrence_model, COOCCURRENCE_WEIGHT,
+            pool_size=int(os.environ.get('COOCCURRENCE_POOL_SIZE', 30))
+        )
+        for name, strategy in ranking_strategies.items()
+    }
+
+# Serve suggestions stored by precompute_suggestions.py when they are still current;
+# reads them with the user in one BatchGetItem
+PRECOMPUTED_SUGGESTIONS = os.environ.get('PRECOMPUTED_SUGGESTIONS', 'false').lower() == 'true'
+
+# Serialized suggestion responses, keyed on everything they depend on
+suggestion_cache = response_cache.ResponseCache(max_size=int(os.environ.get('RESPONSE_CACHE_SIZE', 1024)))
+# Clients may keep responses but must revalidate them with If-None-Match
+SUGGESTION_CACHE_CONTROL = 'private, no-cache'
+
+RESPONSE_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-User-Id',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+}
+
+# 'coalesce' buffers preference increments in the container and writes them
+# at most once per flush interval; 'sync' writes every click immediately
+PREFERENCE_WRITE_MODE = os.environ.get('PREFERENCE_WRITE_MODE', 'sync')
+preference_buffer = user_preferences.PreferenceBuffer(
+    flush_interval_seconds=float(os.environ.get('PREFERENCE_FLUSH_INTERVAL_SECONDS', 5)),
+    max_users=int(os.environ.get('PREFERENCE_BUFFER_MAX_USERS', 500))
+) if PREFERENCE_WRITE_MODE == 'coalesce' else None
+
+class InvalidRequest(ValueError):
+    """A request parameter is missing or invalid; answered with 400."""
+
 def handler(event, context):
     '''
     Delegate function to handle incoming HTTP requests based on the HTTP method.
     This function supports POST, GET, PUT, and DELETE operations.
     '''
+    metrics.start_request()
     http_method = event['httpMethod']
-    logger.info(f"htttpMethod: {http_method}")
+    item_logger.info("htttpMethod: %s", http_method)
 
+    response = None
+    try:
+        response = route(event, http_method)
+        return response
+    finally:
+        # The container may be frozen after returning, so flush while handling a request
+        if preference_buffer is not None and preference_buffer.due():
+            preference_buffer.flush(user_table, user_cache)
+        metrics.finish_request(response['statusCode'] if response else 500)
+
+def route(event: dict, http_method: str) -> dict:
     try:
         if http_method == 'POST':
-            body = json.loads(event['body'])
-            logger.info(f'Event body: {body}')
-            return post(body)
+            metrics.set_route('POST')
+            with metrics.stage('parse'):
+                body = json.loads(event['body'])
+            item_logger.info('Event body: %s', body)
+            return post(body, get_user_id(event, body))
         elif http_method == 'GET':
             query_params = event['queryStringParameters']
-            logger.info(query_params)
-            return get(query_params)
-        # elif http_method == 'PUT':
-        #     return PUT(event.get('key'), event.get('update_expression'), \
-        #             event.get('expression_attribute_values'))
+            metrics.set_route(f"GET {(query_params or {}).get('requested_item')}")
+            item_logger.info('Query parameters: %s', query_params)
+            return get(query_params, get_user_id(event, query_params), get_header(event, 'If-None-Match'))
         elif http_method == 'DELETE':
-            body = json.loads(event['body'])
-            logger.info(f'Event body: {body}')
+            metrics.set_route('DELETE')
+            with metrics.stage('parse'):
+                body = json.loads(event['body'])
+            item_logger.info('Event body: %s', body)
             return delete(body)
         else:
             return format_unsuccessful_response('Unsupported HTTP method')
@@ -49,139 +187,181 @@ def handler(event, context):
         return format_unsuccessful_response(e)
 
 
-def post(body: dict) -> dict:
+def get_header(event: dict, name: str) -> str:
+    """Return the value of the request header `name` (case-insensitive), or None."""
+    name = name.lower()
+    for header, value in (event.get('headers') or {}).items():
+        if header.lower() == name:
+            return value
+    return None
+
+def get_user_id(event: dict, params: dict) -> str:
+    """
+    Return the id of the requesting user, taken from the X-User-Id header or
+    else the `user_id` query parameter or body field. None if there is none.
+    """
+    user_id = get_header(event, 'X-User-Id') or (params.get('user_id') if isinstance(params, dict) else None)
+    if not isinstance(user_id, str) or not user_id.strip():
+        return None
+    return user_id.strip()
+
+def require_user_id(user_id: str) -> dict:
+    """Return an error response if `user_id` is missing or invalid, else None."""
+    if not user_id:
+        return format_unsuccessful_response(
+            "A user id is required (X-User-Id header or user_id parameter)", status_code=400
+        )
+    if len(user_id) > user_preferences.MAX_USER_ID_LENGTH:
+        return format_unsuccessful_response(
+            f"User ids are at most {user_preferences.MAX_USER_ID_LENGTH} characters", status_code=400
+        )
+    if user_id.startswith(user_preferences.SUGGESTIONS_ID_PREFIX):
+        return format_unsuccessful_response("Invalid user id", status_code=400)
+    return None
+
+def post(body: dict, user_id: str = None) -> dict:
 
     try: # TODO reduce size of try catch chunks
 
-        food_id = body['id']
+        if not isinstance(body, dict):
+            raise InvalidRequest("The body must be a JSON object")
+        food_id = body.get('id')
         # Temporary solution to add data to the tables
         if food_id == 'add_user_data':
             logger.info('Calling add_user_data()')
-            add_user_data()
-            return format_successful_response({'message': 'Success'})
+            stats = add_user_data()
+            return format_successful_response({'message': 'Success', 'stats': stats})
         elif food_id == 'add_food_data':
             logger.info('Calling add_food_data()')
-            add_food_data()
-            return format_successful_response({'message': 'Success'})
-
-        logger.info("User prefers %s", food_id)
-        food_item_response = food_table.get_item(Key={'id': food_id})
-        if 'Item' in food_item_response:
-            food = food_item_response['Item']
-            logger.info("Food:")
-            logger.info(food.items())
-
-        return update_user_preferences(food)
-    except ClientError as e:
-        return format_unsuccessful_response(e)
-    except Exception as e:
-        return format_unsuccessful_response(e)
-
-def post_depricated(body: dict) -> dict:
-
-    """
-    Handles an HTTP POST request to add an item to a DynamoDB table.
-
-    This function extracts the 'identifier' value from the provided body,
-    constructs an item with attributes, and attempts to insert
-    the item into the DynamoDB table.
-
-    Parameters:
-        body (dict): A dictionary containing the data sent in the POST request body.
-            It must include an 'identifier' key with its associated value.
-
-    Returns:
-        dict: A dictionary with the HTTP status code and a JSON-encoded message.
-
-    Raises:
-        ClientError: If an error occurs while interacting with the DynamoDB table.
-    """
-    identifier_value = body['identifier']
-    attribute1_value = body['attribute1']
-    logger.info(f'identifier: {identifier_value}, attribute1: {attribute1_value}')
-
-    # Temporary solution to add food data to the Foods table
-    if identifier_value == 'add_food_data':
-        logger.info('Calling add_food_data()')
-        add_food_data()
-    # Temporary solution to add user data to the User table
-    if identifier_value == 'add_user_data':
-        logger.info('Calling add_user_data()')
-        add_user_data()
-
-    try:
-        # Add an item to the table
-        dynamodb_response = table.put_item(
-            Item={
-                'identifier': identifier_value,
-                'attribute1': attribute1_value,
-            }
-        )
-        logger.info("DynamoDB table updated")
-        return format_successful_response({'message': 'Item added to DynamoDB table successfully'})
+            stats = add_food_data()
+            return format_successful_response({'message': 'Success', 'stats': stats})
+
+        error_response = require_user_id(user_id)
+        if error_response:
+            return error_response
+
+        food_ids = parse_selected_food_ids(body)
+        item_logger.info("User %s prefers %s", user_id, food_ids)
+        # Click then fetch: the body may also request items, answered after the click is recorded
+        item_request = parse_item_request(body) if 'requested_item' in body else None
+
+        # Look the foods up in the cached catalog instead of reading Foods; the
+        # version is only checked when the response includes suggestions
+        catalog = get_catalog(verify_version=item_request is not None)
+        unknown_foods = [food_id for food_id, row in zip(food_ids, catalog.find(food_ids)) if row < 0]
+        if unknown_foods:
+            return format_unsuccessful_response(f"Foods not found: {unknown_foods}", status_code=400)
+        attribute_counts = catalog.attribute_counts(food_ids)
+
+        response = update_user_preferences(user_id, food_ids, attribute_counts)
+        if item_request is None or response['statusCode'] != 200:
+            return response
+        return get_items(item_request, user_id, catalog, extra={'message': 'Success'})
+    except InvalidRequest as e:
+        return format_unsuccessful_response(e, status_code=400)
     except ClientError as e:
         return format_unsuccessful_response(e)
     except Exception as e:
         return format_unsuccessful_response(e)
 
-def get(query_params: dict) -> dict:
+def get(query_params: dict, user_id: str = None, if_none_match: str = None) -> dict:
 
     try:
-        requested_item = query_params['requested_item']
-        logger.info(requested_item)
-
-        if requested_item == 'random_food':
-            return get_random_food()
-        elif requested_item == 'food_suggestions':
-            return get_food_suggestions()
-        else:
-            return format_unsuccessful_response("Invalid requested item")
+        request = parse_item_request(query_params or {})
+        if 'food_suggestions' in request['items']:
+            error_response = require_user_id(user_id)
+            if error_response:
+                return error_response
+
+        if request['items'] == ['random_food']:
+            return get_random_food(request['count'])
+        elif request['items'] == ['food_suggestions']:
+            return get_food_suggestions(
+                user_id, request['required'], request['forbidden'], request['strategy'], if_none_match
+            )
+        return get_items(request, user_id)
 
+    except InvalidRequest as e:
+        return format_unsuccessful_response(e, status_code=400)
     except ClientError as e:
         return format_unsuccessful_response(e)
     except Exception as e:
         return format_unsuccessful_response(e)
 
-def get_depricated(query_params: dict) -> dict:
+def parse_item_request(params: dict) -> dict:
     """
-    **Depricated**
-    Retrieves an item from a DynamoDB table based on the provided identifier.
-
-    Args:
-        query_params (dict): A dictionary containing the query parameters,
-            including the 'identifier' key.
+    Parse the requested_item parameter, one item or several separated by
+    commas (e.g. 'random_food,food_suggestions'), and the parameters of the
+    requested items.
 
     Returns:
-        dict: A dictionary containing the following keys:
-            - 'statusCode' (int): The HTTP status code of the response.
-            - 'body' (str): The response body, which is a JSON-encoded string.
+        dict: 'items', the requested item names in order, plus 'count' for
+            random_food and 'required', 'forbidden' and 'strategy' for
+            food_suggestions.
 
     Raises:
-        ClientError: If an error occurs while interacting with the DynamoDB table.
+        InvalidRequest: If a parameter is missing or invalid.
     """
-    try:
-        identifier = query_params['identifier']
-        logger.info(identifier)
+    requested_items = [item.strip() for item in str(params.get('requested_item') or '').split(',')]
+    if any(item not in REQUESTABLE_ITEMS for item in requested_items) \
+            or len(set(requested_items)) < len(requested_items):
+        raise InvalidRequest("Invalid requested item")
+    request = {'items': requested_items}
+
+    if 'random_food' in requested_items:
+        count = params.get('count', DEFAULT_RANDOM_FOOD_COUNT)
+        if not (str(count).isascii() and str(count).isdigit()) or not 1 <= int(count) <= food_catalog.MAX_BATCH_GET_KEYS:
+            raise InvalidRequest(f"count must be between 1 and {food_catalog.MAX_BATCH_GET_KEYS}")
+        request['count'] = int(count)
+    if 'food_suggestions' in requested_items:
+        try:
+            request['required'] = parse_attribute_filter(params.get('require'))
+            request['forbidden'] = parse_attribute_filter(params.get('exclude'))
+        except attributes.UnknownAttributeError as e:
+            raise InvalidRequest(e) from e
+        request['strategy'] = params.get('strategy')
+        if request['strategy'] is not None and request['strategy'] not in ranking_strategies:
+            raise InvalidRequest(f"strategy must be one of {sorted(ranking_strategies)}")
+    return request
+
+def parse_selected_food_ids(body: dict) -> list:
+    """
+    Return the ids of the selected foods: the `ids` list, as a batch of
+    selections may be sent at once, or else the single `id`. Repeated ids
+    count once.
 
-        # Retrieve an item from the table
-        dynamodb_response = table.get_item(
-            Key={
-                'identifier': identifier,
-            }
-        )
-        logger.info(dynamodb_response)
-        if 'Item' in dynamodb_response:
-            return format_successful_response(dynamodb_response['Item'])
-        else:
-            return format_unsuccessful_response('Item not found in table')
-    except ClientError as e:
-        return format_unsuccessful_response(e)
-    except Exception as e:
-        return format_unsuccessful_response(e)
+    Raises:
+        InvalidRequest: If `ids` is not a non-empty list of at most
+            MAX_SELECTED_FOODS strings, or there is no `ids` and `id` is not
+            a string.
+    """
+    if 'ids' in body:
+        food_ids = body['ids']
+        if not isinstance(food_ids, list) or not 1 <= len(food_ids) <= MAX_SELECTED_FOODS:
+            raise InvalidRequest(f"ids must be a list of 1 to {MAX_SELECTED_FOODS} food ids")
+    else:
+        food_ids = [body.get('id')]
+    if not all(isinstance(food_id, str) and food_id for food_id in food_ids):
+        raise InvalidRequest("Food ids must be non-empty strings")
+    return list(dict.fromkeys(food_ids))
+
+def parse_attribute_filter(value: str) -> list:
+    """
+    Convert a comma separated list of user attribute names (e.g.
+    'vegan,glutenFree') into food attribute names.
+
+    Raises:
+        UnknownAttributeError: If a name is not in the attribute registry.
+    """
+    if not value:
+        return []
+    return [attributes.get_food_from_user(name.strip()) for name in value.split(',') if name.strip()]
 
 def delete(body: dict) -> dict:
     """
     Deletes an item from a DynamoDB table based on the provided identifier.
+    Items holding the catalog's internal state (see
+    food_catalog.is_internal_metadata_key) are refused with 400.
 
     Args:
         body (dict): A dictionary containing the request body, which should
@@ -196,8 +376,13 @@ def delete(body: dict) -> dict:
         ClientError: If an error occurs while interacting with the DynamoDB table.
     """
 
-    identifier_value = body['identifier']
-    logger.info(identifier_value)
+    identifier_value = body.get('identifier') if isinstance(body, dict) else None
+    item_logger.info(identifier_value)
+    if not isinstance(identifier_value, str) or not identifier_value:
+        return format_unsuccessful_response("identifier must be a non-empty string", status_code=400)
+    # The catalog version, food index and change log are not client data
+    if food_catalog.is_internal_metadata_key(identifier_value):
+        return format_unsuccessful_response(f"{identifier_value} cannot be deleted", status_code=400)
     try:
         # Add an item to the table
         response = table.delete_item(
@@ -211,306 +396,313 @@ def delete(body: dict) -> dict:
     except Exception as e:
         return format_unsuccessful_response(e)
 
-# def put(key, update_expression, expression_attribute_values):
-    # TODO
-
-
-def add_food_data() -> None:
-
-    # Read the contents of the file into a list
-    with open('food_data.txt', 'r') as file:
-        food_data = json.load(file)
-        logger.info(type(food_data))
-    logger.info(food_data)
-    if food_data:
-        logger.info('Adding food data to the Foods table')
-        # Insert each food item into the 'Foods' table
-        for food in food_data:
-            food_table.put_item(Item=food)
-            logger.info(f"Added {food['id']} to the Foods table")
-
-def add_user_data() -> None:
-
-    # Read the contents of the file into a list
-    with open('user_data.txt', 'r') as file:
-        user_data = json.load(file)
-        logger.info(type(user_data))
-    logger.info(user_data)
-    if user_data:
-        logger.info('Adding user data to the user table')
-        # Insert each food item into the 'Foods' table
-        for user in user_data:
-            user_table.put_item(Item=user)
-            logger.info(f"Added {user['id']} to the Foods table")
+def add_food_data() -> dict:
+    """
+    Seed the Foods table from food_data.txt with batched writes, then
+    rebuild the food id index from a scan of the Foods table and bump the
+    catalog version, unless the Foods stream does (CATALOG_CHANGES_FROM_STREAM).
+
+    Returns:
+        dict: Write statistics reported by bulk_ingest.batch_write_items.
+    """
+    import bulk_ingest
+
+    logger.info('Adding food data to the Foods table')
+    food_ids = []
+
+    def food_data():
+        # Stream the file and remember the ids for the food index
+        for food in bulk_ingest.iter_json_array('food_data.txt'):
+            attributes.report_unknown_food_attributes(food)
+            food_ids.append(food['id'])
+            yield food
+
+    stats = bulk_ingest.batch_write_items(dynamodb, food_table.name, food_data(), workers=SEED_WRITE_WORKERS)
+    if CATALOG_CHANGES_FROM_STREAM:
+        # This container reloads now; the others once the stream bumps the version
+        catalog_cache.invalidate()
+    elif food_ids:
+        # Index every food in the table, not just this file's: foods written by
+        # other means have no stream to index them. The file's ids are kept in
+        # case the scan, being eventually consistent, misses fresh writes.
+        scanned_ids = [item['id'] for item in food_catalog.scan_table(food_table, ['id'], catalog_cache.scan_segments)]
+        # Repeated ids overwrite the same item, so index each food once
+        unique_food_ids = list(dict.fromkeys(food_ids + scanned_ids))
+        food_catalog.write_food_index(dynamodb, table, unique_food_ids, workers=SEED_WRITE_WORKERS)
+        # Invalidate catalog caches in every warm container
+        catalog_version = food_catalog.bump_catalog_version(table)
+        # Lets containers holding a snapshot apply this write instead of rescanning
+        food_catalog.record_catalog_change(table, catalog_version, unique_food_ids)
+        catalog_cache.invalidate()
+        logger.info(f'Catalog version is now {catalog_version}')
+    return stats
+
+def add_user_data() -> dict:
+    """
+    Seed the Users table from user_data.txt with batched writes.
+
+    Returns:
+        dict: Write statistics reported by bulk_ingest.batch_write_items.
+    """
+    import bulk_ingest
+
+    logger.info('Adding user data to the user table')
+    user_data = map(user_preferences.seed_item, bulk_ingest.iter_json_array('user_data.txt'))
+    stats = bulk_ingest.batch_write_items(dynamodb, user_table.name, user_data, workers=SEED_WRITE_WORKERS)
+    # Seeding resets the users, so drop their cached preferences and rankings
+    user_cache.clear()
+    ranker_cache.clear()
+    suggestion_cache.clear()
+    return stats
 
 def format_successful_response(data: dict) -> dict:
-    response = {
-        'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-        },
-        'body': json.dumps(data)
-    }
+    with metrics.stage('serialize'):
+        response = {
+            'statusCode': 200,
+            'headers': dict(RESPONSE_HEADERS),
+            'body': json.dumps(data)
+        }
     return response
 
-def format_unsuccessful_response(exception) -> dict:
+def format_cached_response(cached: response_cache.CachedResponse, if_none_match: str = None) -> dict:
+    """
+    Wrap an already serialized response, answering 304 Not Modified without a
+    body when the client's If-None-Match names it.
+    """
+    headers = dict(RESPONSE_HEADERS)
+    headers['ETag'] = cached.etag
+    headers['Cache-Control'] = SUGGESTION_CACHE_CONTROL
+    # Lets the frontend read the ETag of a cross-origin response
+    headers['Access-Control-Expose-Headers'] = 'ETag'
+    if cached.matches(if_none_match):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+    return {'statusCode': 200, 'headers': headers, 'body': cached.body}
+
+def format_unsuccessful_response(exception, status_code: int = 500) -> dict:
     logger.exception(exception)
     response = {
-        'statusCode': 500,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-        },
+        'statusCode': status_code,
+        'headers': dict(RESPONSE_HEADERS),
         'body': json.dumps(f"Error: {exception}")
     }
     return response
 
-def get_random_food() -> dict:
-    """Returns a random food item from the 'Foods' table."""
-    number_of_food_items_returned = 3
+def get_catalog(verify_version: bool = True) -> food_catalog.Catalog:
+    """
+    Returns the Foods catalog, reloading it only when its version changed.
+    With verify_version=False a cached catalog younger than the cache TTL is
+    returned without reading the version counter.
+    """
+    with metrics.stage('catalog_load'):
+        return catalog_cache.get(dynamodb, food_table, table, attributes.FOOD_ATTRIBUTES, verify_version)
+
+def load_user(user_id: str) -> user_preferences.UserState:
+    """Returns the user's preferences, including increments not flushed yet."""
+    with metrics.stage('user_fetch'):
+        user = user_preferences.load_user(user_table, user_id, user_cache,
+                                          dynamodb=dynamodb if PRECOMPUTED_SUGGESTIONS else None)
+        if preference_buffer is not None:
+            user = preference_buffer.apply(user_id, user)
+    return user
+
+def get_random_food(count: int = 3) -> dict:
+    """
+    Returns `count` random food ids from the 'Foods' table.
+
+    Samples from the cached catalog when it is current, otherwise from the
+    dense food id index in the Metadata table, so the Foods table is usually
+    not scanned for this request. When the index is missing or holds too few
+    foods (e.g. it was never written), the catalog is loaded instead.
+    """
     try:
-        # Use the scan operation to retrieve all items from the table
-        response = food_table.scan()
-        # Get the list of items from the response
-        foods = response['Items']
-        if len(foods) < number_of_food_items_returned:
+        with metrics.stage('catalog_load'):
+            catalog_metadata = food_catalog.get_catalog_metadata(table)
+            catalog = catalog_cache.peek(catalog_metadata['version'])
+        random_item_ids = sample_random_foods(count, catalog, catalog_metadata['foodCount'])
+        if random_item_ids is None and catalog is None:
+            logger.warning(f"Food index of {catalog_metadata['foodCount']} foods cannot supply {count}, "
+                           "sampling the catalog instead")
+            random_item_ids = sample_random_foods(count, get_catalog())
+        if random_item_ids is None:
             return format_unsuccessful_response("Not enough food items in the table")
-        # Randomly select an item from the list
-        random_items = random.sample(foods, number_of_food_items_returned)
-        random_item_ids = {}
-        for i, random_item in enumerate(random_items, start=1):
-            logger.info(random_item['id'])
-            random_item_ids[f'random_item{i}'] = random_item['id']
         return format_successful_response(random_item_ids)
     except ClientError as e:
         return format_unsuccessful_response(e)
     except Exception as e:
         return format_unsuccessful_response(e)
+
+def sample_random_foods(count: int, catalog: food_catalog.Catalog = None, food_count: int = 0) -> dict:
+    """
+    Pick `count` random foods from `catalog`, or from the food id index of
+    `food_count` foods without one.
+
+    Returns:
+        dict: Food ids keyed 'random_item1' to 'random_item<count>', or None
+            if there are fewer foods than `count` (or index slots found).
+    """
+    if catalog is not None:
+        food_count = len(catalog)
+    if food_count < count:
+        return None
+    # Randomly select items from the catalog
+    with metrics.stage('score'):
+        if catalog is not None:
+            random_items = random.sample(catalog.food_ids, count)
+        else:
+            random_items = food_catalog.sample_food_ids(dynamodb, table, food_count, count)
+    if len(random_items) < count:
+        return None
+    random_item_ids = {f'random_item{i}': random_item for i, random_item in enumerate(random_items, start=1)}
+    item_logger.info('Random foods: %s', random_item_ids)
+    return random_item_ids
 ###############################################
 
-def update_user_preferences(food: dict) -> dict:
+def update_user_preferences(user_id: str, food_ids: list, attribute_counts) -> dict:
     """
-    Update the user's preferences in the User table based on the food item.
+    Update the user's preferences in the User table based on the selected foods.
+
+    Every preference counter is incremented by the number of selected foods
+    having the attribute, and the food ids are added to the selectedFoods
+    string set, in a single update_item call (see
+    user_preferences.record_selection).
+
+    Parameters:
+        user_id (str): Id of the user who selected the foods.
+        food_ids (list): Ids of the selected foods.
+        attribute_counts: Number of selected foods having each attribute,
+            in attribute registry order.
     """
     try:
-        # Initialize parts of the update expression and expression attribute values
-        update_expression = "SET "
-        expression_attribute_values = {}
-
-        for attribute, val in food.items():
-            if attribute == "id" or not val:
-                continue
-
-            logger.info('%s: %s', attribute, val)
-            user_attribute = map_food_to_user.get(attribute)
-            if user_attribute:
-                logger.info('user_attribute: %s', user_attribute)
-                # Append to the update expression
-                update_expression += f'preferences.{user_attribute} = preferences.{user_attribute} + :increment, '
-                expression_attribute_values[':increment'] = 1
-
-        # Append the food ID to selectedFoods
-        food_id = food.get('id')
-        if food_id:
-            update_expression += "selectedFoods = list_append(selectedFoods, :food_id), "
-            expression_attribute_values[':food_id'] = [food_id]
-
-        # Remove the trailing comma and space from the update expression
-        update_expression = update_expression.rstrip(', ')
-
-        # Perform the update only if there are attributes to update
-        if expression_attribute_values:
-            user_id = 'User123'
-            response = user_table.update_item(
-                Key={'id': user_id},
-                UpdateExpression=update_expression,
-                ExpressionAttributeValues=expression_attribute_values,
-                ReturnValues='UPDATED_NEW'
-            )
-            logger.info("Update response:")
-            logger.info(response)
+        if preference_buffer is not None:
+            preference_buffer.add(user_id, attribute_counts, food_ids)
         else:
-            logger.info("No attributes to update.")
+            user_preferences.record_selection(user_table, user_id, attribute_counts, food_ids, user_cache)
         return format_successful_response({'message': 'Success'})
     except ClientError as e:
         return format_unsuccessful_response(e)
     except Exception as e:
         return format_unsuccessful_response(e)
 
-def get_food_suggestions():
+def build_ranking_request(user_id: str, user: user_preferences.UserState, catalog: food_catalog.Catalog,
+                          required: list = (), forbidden: list = ()) -> ranking.RankingRequest:
+    """Returns the ranking request for the user's suggestions, shared with precompute_suggestions.py."""
+    # Skip already selected foods and, with filters, score only the matching foods
+    return ranking.RankingRequest(
+        user_id, catalog, user.counts, catalog.excluded_mask(user.selected_foods), len(user.selected_foods),
+        NUMBER_OF_SUGGESTIONS, catalog.matching_rows(required, forbidden) if required or forbidden else None,
+        user.selected_foods
+    )
+
+def get_food_suggestions(user_id: str, required: list = (), forbidden: list = (), strategy: str = None,
+                         if_none_match: str = None):
+    """
+    Returns the user's top suggestions ranked by `strategy` (see ranking.py).
+    `required` and `forbidden` food attributes restrict them to the matching
+    foods, which are selected through the catalog's attribute bitmaps
+    before anything is scored.
+
+    Responses are cached per preference and catalog version, so repeated
+    requests skip ranking and serialization, and carry an ETag for
+    conditional requests. With PRECOMPUTED_SUGGESTIONS, suggestions stored by
+    precompute_suggestions.py for the same versions are served unranked.
+    """
     try:
-        number_of_suggestions = 3
-        # Get the user preferences and selected foods
-        user_id = 'User123'
-        user_item = user_table.get_item(Key={'id': user_id}).get('Item', {})
-
-        if not user_item:
-            return format_unsuccessful_response(f"User with id {user_id} not found.")
-
-        preferences = user_item.get('preferences', {})
-        selected_foods = user_item.get('selectedFoods', [])
-
-        # Get all food items
-        food_items = food_table.scan().get('Items', [])
-
-        if not food_items:
+        catalog, user = load_catalog_and_user(user_id)
+        if not len(catalog):
             return format_unsuccessful_response("No food items found.")
-
-        suggestions = []
-
-        for food_item in food_items:
-            if food_item['id'] in selected_foods:
-                continue  # Skip already selected foods
-
-            score = 0
-
-            for user_attr, user_weight in preferences.items():
-                if user_weight == 0:
-                    continue
-
-                food_attr = get_food_from_user(user_attr)
-                if food_attr and food_item.get(food_attr):
-                    score += user_weight
-
-            suggestions.append((food_item['id'], score))
-
-        # Sort the suggestions by score in descending order
-        sorted_suggestions = sorted(suggestions, key=lambda x: x[1], reverse=True)[:number_of_suggestions] # slice of top suggestions only
-
-        # Convert sorted list into a ranked dictionary
-        ranked_suggestions = {rank + 1: food for rank, (food, _) in enumerate(sorted_suggestions)}
-
-        logger.info(ranked_suggestions)
-
-        # Return the top three food items with the highest scores
-        return format_successful_response(ranked_suggestions)
+        return format_cached_response(
+            rank_food_suggestions(user_id, user, catalog, required, forbidden, strategy), if_none_match
+        )
     except ClientError as e:
         return format_unsuccessful_response(e)
     except Exception as e:
         return format_unsuccessful_response(e)
 
-def normalize_vector(vector):
-    """
-    Normalize a vector to have unit length.
+def load_catalog_and_user(user_id: str) -> tuple:
     """
-    norm = math.sqrt(sum(x ** 2 for x in vector))
-    return [x / norm for x in vector] if norm > 0 else vector
-
-def cosine_similarity(vec1, vec2):
+    Returns the catalog and the user's preferences. The user (cached for
+    active users) is fetched while the catalog version is checked and the
+    catalog (re)loaded.
     """
-    Calculate cosine similarity between two vectors.
+    user_future = dynamo.get_executor().submit(load_user, user_id)
+    catalog = get_catalog()
+    return catalog, user_future.result()
+
+def rank_food_suggestions(user_id: str, user: user_preferences.UserState, catalog: food_catalog.Catalog,
+                          required: list = (), forbidden: list = (),
+                          strategy: str = None) -> response_cache.CachedResponse:
+    """Returns the serialized suggestions of get_food_suggestions, from the response cache when possible."""
+    strategy = strategy or DEFAULT_RANKING_STRATEGY
+    # Unflushed increments do not bump the preference version, so those users are not cached
+    cacheable = preference_buffer is None or not preference_buffer.has_pending(user_id)
+    cache_key = ('food_suggestions', user_id, user.version, catalog.version, strategy,
+                 tuple(required), tuple(forbidden))
+    cached = suggestion_cache.get(cache_key) if cacheable else None
+    if cached is not None:
+        return cached
+
+    with metrics.stage('score'):
+        # Stored suggestions are only current for unfiltered requests of unchanged users
+        suggested_ids = user.precomputed_suggestions(catalog.version, strategy) \
+            if cacheable and not required and not forbidden else None
+        if suggested_ids is None:
+            request = build_ranking_request(user_id, user, catalog, required, forbidden)
+            suggested_ids = [catalog.food_ids[row] for row in ranking_strategies[strategy].rank(request)]
+
+        # Convert the ranked ids into a ranked dictionary
+        ranked_suggestions = {rank + 1: food_id for rank, food_id in enumerate(suggested_ids)}
+
+    item_logger.info('Suggestions: %s', ranked_suggestions)
+
+    # Return the top three food items with the highest scores
+    with metrics.stage('serialize'):
+        if cacheable:
+            return suggestion_cache.put(cache_key, ranked_suggestions)
+        return response_cache.CachedResponse(json.dumps(ranked_suggestions))
+
+def get_items(request: dict, user_id: str, catalog: food_catalog.Catalog = None, extra: dict = None) -> dict:
     """
-    dot_product = sum(a * b for a, b in zip(vec1, vec2))
-    norm1 = math.sqrt(sum(a ** 2 for a in vec1))
-    norm2 = math.sqrt(sum(b ** 2 for b in vec2))
-    return dot_product / (norm1 * norm2) if norm1 > 0 and norm2 > 0 else 0
+    Answer several requested items (see parse_item_request) in one response
+    keyed by item name, e.g. {"random_food": {...}, "food_suggestions": {...}},
+    instead of one API call each. The catalog and the user are loaded once
+    and shared by every item.
 
-def get_food_suggestions_test():
+    Parameters:
+        request (dict): Parsed request, from parse_item_request.
+        user_id (str): Id of the user, required for food_suggestions.
+        catalog (Catalog): Catalog already loaded by the caller, if any.
+        extra (dict): Additional fields of the response, e.g. the click
+            then fetch POST's message.
+    """
     try:
-        number_of_suggestions = 3
-        user_id = 'User123'
-        user_item = user_table.get_item(Key={'id': user_id}).get('Item', {})
-
-        if not user_item:
-            return format_unsuccessful_response(f"User with id {user_id} not found.")
-
-        preferences = user_item.get('preferences', {})
-        selected_foods = set(user_item.get('selectedFoods', []))
-
-        food_items = food_table.scan().get('Items', [])
-        if not food_items:
+        user = None
+        if 'food_suggestions' in request['items']:
+            if catalog is None:
+                catalog, user = load_catalog_and_user(user_id)
+            else:
+                user = load_user(user_id)
+        elif catalog is None:
+            catalog = get_catalog()
+        if not len(catalog):
             return format_unsuccessful_response("No food items found.")
 
-        # Normalize user preferences
-        preference_values = list(preferences.values())
-        if sum(preference_values) > 0:
-            normalized_preferences = normalize_vector(preference_values)
-        else:
-            normalized_preferences = preference_values
-
-        suggestions = []
-
-        for food_item in food_items:
-            if food_item['id'] in selected_foods:
-                continue  # Skip already selected foods
-
-            food_vector = []
-            for user_attr in preferences.keys():
-                food_attr = get_food_from_user(user_attr)
-                food_vector.append(food_item.get(food_attr, 0))
-
-            # Normalize food vector
-            normalized_food_vector = normalize_vector(food_vector)
-
-            # Cosine similarity calculation
-            similarity_score = cosine_similarity(normalized_preferences, normalized_food_vector)
-            suggestions.append((food_item['id'], similarity_score))
-
-        sorted_suggestions = sorted(suggestions, key=lambda x: x[1], reverse=True)[:number_of_suggestions]
-
-        ranked_suggestions = {rank + 1: food for rank, (food, _) in enumerate(sorted_suggestions)}
-
-        logger.info(ranked_suggestions)
-
-        return format_successful_response(ranked_suggestions)
+        # Items are serialized separately, so cached suggestions are embedded as they are
+        bodies = {key: json.dumps(value) for key, value in (extra or {}).items()}
+        for item in request['items']:
+            if item == 'random_food':
+                random_item_ids = sample_random_foods(request['count'], catalog)
+                if random_item_ids is None:
+                    return format_unsuccessful_response("Not enough food items in the table")
+                bodies[item] = json.dumps(random_item_ids)
+            else:
+                bodies[item] = rank_food_suggestions(
+                    user_id, user, catalog, request['required'], request['forbidden'], request['strategy']
+                ).body
+
+        with metrics.stage('serialize'):
+            body = '{' + ', '.join(f'{json.dumps(key)}: {value}' for key, value in bodies.items()) + '}'
+        return {'statusCode': 200, 'headers': dict(RESPONSE_HEADERS), 'body': body}
     except ClientError as e:
         return format_unsuccessful_response(e)
     except Exception as e:
         return format_unsuccessful_response(e)
-
-
-########################################################
-def get_food_from_user(target_user_attribute):
-    """
-    Reverse the map_food_to_user dict
-    """
-    for food_attribute, user_attribute in map_food_to_user.items():
-        if target_user_attribute == user_attribute:
-            return food_attribute
-
-    return "key doesn't exist"
-
-map_food_to_user = {
-    "isSweet": "sweet",
-    "isSalty": "salty",
-    "isSour": "sour",
-    "isBitter": "bitter",
-    "isSpicy": "spicy",
-    "isUmami": "umami",
-    "isSavory": "savory",
-    "isSmoky": "smoky",
-    "isTangy": "tangy",
-    "isRich": "rich",
-    "isCrispy": "crispy",
-    "isCrunchy": "crunchy",
-    "isChewy": "chewy",
-    "isCreamy": "creamy",
-    "isTender": "tender",
-    "isHighProtein": "highProtein",
-    "isLowCarb": "lowCarb",
-    "isGlutenFree": "glutenFree",
-    "isDairyFree": "dairyFree",
-    "isVegan": "vegan",
-    "isGrilled": "grilled",
-    "isFried": "fried",
-    "isBaked": "baked",
-    "isRoasted": "roasted",
-    "isSteamed": "steamed",
-    "isHot": "hot",
-    "isCold": "cold",
-    "isRoomTemperature": "roomTemperature",
-    "isFrozen": "frozen",
-    "isMexican": "mexican",
-    "isItalian": "italian",
-    "isAsian": "asian",
-    "isMediterranean": "mediterranean",
-    "isFusion": "fusion",
-    "isComfortFood": "comfortFood",
-    "isHealthy": "healthy",
-    "isIndulgent": "indulgent",
-    "isExotic": "exotic",
-    "isOrganic": "organic"
-}
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""
+Module for lightweight per-request instrumentation of the Lambda handler.
+
+Each request records how long its stages took (see STAGES), the DynamoDB
+capacity its calls consumed, the items DynamoDB scanned and returned, and
+whether it was the first request of the container. When it finishes, one
+line of CloudWatch Embedded Metric Format (EMF) JSON is printed to stdout,
+which CloudWatch Logs turns into metrics without any API call:
+
+    {"_aws": {...}, "Route": "GET food_suggestions", "ColdStart": 0,
+     "DurationMs": 1.9, "CatalogLoadMs": 0.4, "ScoreMs": 0.3,
+     "ReadCapacityUnits": 0.5, "ItemsScanned": 0, "ItemsReturned": 1, ...}
+
+Only a METRICS_SAMPLE_RATE fraction of requests is emitted, except for cold
+starts and server errors, which always are.
+
+LOG_ITEMS=false silences `item_logger`, used for the INFO lines that dump
+request bodies, items and suggestions on the hot path.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'FlavorBuddy')
+# Fraction of requests emitted; cold starts and 5xx responses always are
+SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+LOG_ITEMS = os.environ.get('LOG_ITEMS', 'true').lower() == 'true'
+
+# Per-item request logging; pass arguments separately so disabled lines are never formatted
+item_logger = logging.getLogger('items')
+if not LOG_ITEMS:
+    item_logger.setLevel(logging.WARNING)
+
+# Stage names and their metric names
+STAGES = {
+    'parse': 'ParseMs',
+    'catalog_load': 'CatalogLoadMs',
+    'user_fetch': 'UserFetchMs',
+    'score': 'ScoreMs',
+    'serialize': 'SerializeMs',
+}
+COUNTERS = ('DynamoDBCalls', 'ReadCapacityUnits', 'WriteCapacityUnits', 'ItemsScanned', 'ItemsReturned')
+READ_OPERATIONS = frozenset(('get_item', 'scan', 'query', 'batch_get_item'))
+
+output = sys.stdout
+_current = None
+_cold_start = True
+
+
+class RequestMetrics:
+    """
+    Measurements of one request. Counters may be incremented from the
+    threads of a parallel scan, so updates are locked.
+
+    Attributes:
+        cold_start (bool): True for the first request of the container.
+        route (str): Metric dimension, e.g. 'GET food_suggestions'.
+        stages (dict): Stage name -> accumulated milliseconds.
+        counters (dict): Counter name (see COUNTERS) -> total.
+    """
+
+    def __init__(self, cold_start: bool):
+        self.started = time.perf_counter()
+        self.cold_start = cold_start
+        self.route = 'unknown'
+        self.stages = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, milliseconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0) + milliseconds
+
+    def increment(self, name: str, value=1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def to_emf(self, status_code: int) -> dict:
+        """Return the request as an EMF record."""
+        values = {'DurationMs': round((time.perf_counter() - self.started) * 1000, 3)}
+        for stage, milliseconds in self.stages.items():
+            values[STAGES.get(stage, f'{stage}Ms')] = round(milliseconds, 3)
+        values.update(self.counters)
+        values['ColdStart'] = int(self.cold_start)
+        units = {name: 'Milliseconds' if name.endswith('Ms') else 'Count' for name in values}
+        return dict({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['Route']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()],
+                }],
+            },
+            'Route': self.route,
+            'StatusCode': status_code,
+        }, **values)
+
+
+def start_request() -> RequestMetrics:
+    """Begin measuring a request; the first one of the container is a cold start."""
+    global _current, _cold_start
+    _current = RequestMetrics(_cold_start)
+    _cold_start = False
+    return _current
+
+
+def finish_request(status_code: int) -> dict:
+    """
+    Stop measuring the current request and emit it if sampled.
+
+    Returns:
+        dict: The emitted EMF record, or None if the request was not sampled.
+    """
+    global _current
+    request, _current = _current, None
+    if request is None:
+        return None
+    if not (request.cold_start or status_code >= 500 or random.random() < SAMPLE_RATE):
+        return None
+    record = request.to_emf(status_code)
+    output.write(json.dumps(record) + '\n')
+    output.flush()
+    return record
+
+
+def set_route(route: str) -> None:
+    if _current is not None:
+        _current.route = route
+
+
+@contextmanager
+def stage(name: str):
+    """Add the time spent in the block to stage `name` of the current request."""
+    request = _current
+    if request is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request.add_stage(name, (time.perf_counter() - start) * 1000)
+
+
+def record_dynamodb(operation: str, response: dict) -> None:
+    """Count a DynamoDB call, its consumed capacity and the items it read."""
+    request = _current
+    if request is None:
+        return
+    request.increment('DynamoDBCalls')
+    consumed = response.get('ConsumedCapacity')
+    if consumed:
+        # Batch operations report one entry per table
+        entries = consumed if isinstance(consumed, list) else [consumed]
+        units = sum(float(entry.get('CapacityUnits', 0)) for entry in entries)
+        request.increment('ReadCapacityUnits' if operation in READ_OPERATIONS else 'WriteCapacityUnits', units)
+    if 'ScannedCount' in response:
+        request.increment('ItemsScanned', response['ScannedCount'])
+    if 'Count' in response:
+        request.increment('ItemsReturned', response['Count'])
+    elif 'Item' in response:
+        request.increment('ItemsReturned')
+    elif 'Responses' in response:
+        request.increment('ItemsReturned', sum(len(items) for items in response['Responses'].values()))
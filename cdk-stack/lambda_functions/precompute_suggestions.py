@@ -0,0 +1,158 @@
+"""
+Module for precomputing every user's suggestions offline.
+
+Most users' suggestions only change after they click, so a batch job can
+rank them ahead of time. Users are ranked across a process pool, exactly as
+food_suggestion_function would rank them live. The results are written with
+BatchWriteItem as `suggestions#<user id>` items of the Users table (see
+user_preferences.py), together with the preferenceVersion and catalog
+version they were computed from. With PRECOMPUTED_SUGGESTIONS=true, the
+handler serves them while both versions still match and ranks live
+otherwise.
+
+Workers map the catalog from a snapshot file rather than receiving a copy:
+
+    python precompute_suggestions.py --processes 8
+    python precompute_suggestions.py --user-data users.json --snapshot catalog_snapshot.bin
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import attributes
+import bulk_ingest
+import catalog_snapshot
+import food_catalog
+import user_preferences
+
+
+logger = logging.getLogger()
+
+# Users ranked by a worker per task
+USERS_PER_CHUNK = 2000
+
+# Set in every worker process by _init_worker
+_worker_catalog = None
+
+
+def _init_worker(snapshot_path: str) -> None:
+    global _worker_catalog
+    _worker_catalog = catalog_snapshot.read_snapshot(snapshot_path, attributes.FOOD_ATTRIBUTES)
+
+
+def rank_users(users: list, catalog: food_catalog.Catalog, strategy: str = None) -> list:
+    """
+    Rank the suggestions of `users`, items as stored in the Users table.
+
+    Returns:
+        list: One precomputed suggestions item per user.
+    """
+    # Imported here so the handler's module-level configuration is only loaded by workers
+    import food_suggestion_function
+
+    strategy = strategy or food_suggestion_function.DEFAULT_RANKING_STRATEGY
+    ranker = food_suggestion_function.ranking_strategies[strategy]
+    items = []
+    for user in users:
+        state = user_preferences.UserState.from_item(user)
+        request = food_suggestion_function.build_ranking_request(user['id'], state, catalog)
+        items.append({
+            'id': user_preferences.suggestions_id(user['id']),
+            'suggestions': [catalog.food_ids[row] for row in ranker.rank(request)],
+            'preferenceVersion': state.version,
+            'catalogVersion': catalog.version,
+            'strategy': strategy,
+            'computedAt': int(time.time()),
+        })
+    # Rankers of users never seen again would only fill the worker's memory
+    food_suggestion_function.ranker_cache.clear()
+    return items
+
+
+def _rank_chunk(users: list) -> list:
+    return rank_users(users, _worker_catalog)
+
+
+def iter_users(user_table):
+    """Yield the user items of the Users table, page by page, skipping precomputed suggestions."""
+    attribute_names = {f'#a{i}': attribute for i, attribute in enumerate(user_preferences.USER_ITEM_ATTRIBUTES)}
+    scan_kwargs = {'ProjectionExpression': ', '.join(attribute_names), 'ExpressionAttributeNames': attribute_names}
+    while True:
+        response = user_table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            if not item['id'].startswith(user_preferences.SUGGESTIONS_ID_PREFIX):
+                yield item
+        if not response.get('LastEvaluatedKey'):
+            return
+        scan_kwargs = dict(scan_kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
+
+
+def precompute(dynamodb, users, catalog: food_catalog.Catalog, snapshot_path: str = None, processes: int = 1,
+               write_workers: int = 4) -> dict:
+    """
+    Rank every user of `users` and store their suggestions in Users.
+
+    Parameters:
+        dynamodb: DynamoDB resource to write with.
+        users: Iterable of user items.
+        catalog (Catalog): Catalog to rank, in this process.
+        snapshot_path (str): Snapshot of `catalog` for the worker processes;
+            required with more than one process.
+        processes (int): Worker processes; 1 ranks in this process.
+        write_workers (int): Threads writing the results concurrently.
+
+    Returns:
+        dict: Write statistics reported by bulk_ingest.batch_write_items.
+    """
+    chunks = food_catalog.iter_chunks(users, USERS_PER_CHUNK)
+    if processes <= 1:
+        ranked = (item for chunk in chunks for item in rank_users(chunk, catalog))
+        return bulk_ingest.batch_write_items(dynamodb, 'Users', ranked, workers=write_workers)
+
+    # Spawned rather than forked: this process holds botocore clients and threads
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initializer=_init_worker, initargs=(snapshot_path,)) as pool:
+        # Ranked chunks are written as they arrive, while the pool ranks the next ones
+        ranked = (item for items in pool.imap_unordered(_rank_chunk, chunks) for item in items)
+        return bulk_ingest.batch_write_items(dynamodb, 'Users', ranked, workers=write_workers)
+
+
+def main() -> int:
+    import dynamo
+
+    parser = argparse.ArgumentParser(description='Precompute the suggestions of every user')
+    parser.add_argument('--user-data', help='read this JSON array of user items instead of scanning Users')
+    parser.add_argument('--snapshot', help='catalog snapshot to rank against instead of scanning Foods')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--write-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dynamodb = dynamo.DynamoDB()
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = args.snapshot
+        if snapshot_path:
+            catalog = catalog_snapshot.read_snapshot(snapshot_path, attributes.FOOD_ATTRIBUTES)
+        else:
+            # Read the version first, as catalog_snapshot.py does
+            version = food_catalog.get_catalog_version(dynamodb.Table('Metadata'))
+            catalog = food_catalog.load_catalog(dynamodb.Table('Foods'), attributes.FOOD_ATTRIBUTES, version,
+                                                total_segments=4)
+            snapshot_path = os.path.join(directory, 'catalog_snapshot.bin')
+            catalog_snapshot.write_snapshot(snapshot_path, catalog)
+
+        users = bulk_ingest.iter_json_array(args.user_data) if args.user_data \
+            else iter_users(dynamodb.Table('Users'))
+        stats = precompute(dynamodb, users, catalog, snapshot_path, args.processes, args.write_workers)
+    print(json.dumps(dict(stats, catalogVersion=catalog.version, processes=args.processes,
+                          seconds=round(time.perf_counter() - start, 1))))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
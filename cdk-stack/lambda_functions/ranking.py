@@ -0,0 +1,310 @@
+"""
+Module for ranking the catalog for a user with pluggable strategies.
+
+Every strategy receives the same RankingRequest, built by a shared
+pipeline in the handler (user lookup, catalog load, selected food
+exclusion and attribute filters), and returns the best rows:
+
+    additive  sum of the user's counters over the food's attributes,
+              maintained incrementally per user (IncrementalRanker)
+    cosine    cosine similarity, optionally through the ANN index
+    tfidf     cosine similarity with attributes weighted by inverse
+              catalog frequency, so rare attributes count for more
+    mmr       additive candidates reranked by maximal marginal relevance
+              to avoid near-identical suggestions
+
+Any of them can be wrapped in a CooccurrenceBlend, which mixes in foods
+that other users selected together with the user's own selections.
+"""
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+import scoring
+
+
+class IncrementalRanker:
+    """
+    Exact additive ranking head of one user: the `head_size` best rows of the
+    catalog, best first, and their scores.
+
+    Clicks only ever increase preference counters, so after an update the
+    only foods that can enter the head are those having a clicked attribute.
+    update() rescores just those, found through the catalog's attribute
+    bitmaps, instead of the whole catalog. Serving the top k is then a
+    walk over the head.
+
+    Attributes:
+        catalog (Catalog): Catalog the rows refer to.
+        counts (np.ndarray): Preference counters the head was ranked with.
+        head_size (int): Number of rows kept.
+        rows (np.ndarray): Head rows, best first (ties by row order).
+        scores (np.ndarray): Additive scores of the head rows.
+    """
+
+    def __init__(self, catalog, counts: np.ndarray, head_size: int):
+        self.catalog = catalog
+        self.counts = np.array(counts, dtype=np.int64)
+        self.head_size = head_size
+        scores = scoring.packed_additive_scores(catalog.masks, self.counts.astype(np.float64))
+        self.rows = scoring.top_k(scores, head_size)
+        self.scores = scores[self.rows]
+
+    def update(self, counts: np.ndarray) -> bool:
+        """
+        Re-rank after the preference counters changed to `counts`.
+
+        Returns:
+            bool: False if a counter decreased, in which case the head can no
+                longer be maintained and the ranker must be rebuilt.
+        """
+        counts = np.array(counts, dtype=np.int64)
+        delta = counts - self.counts
+        if (delta < 0).any():
+            return False
+        changed_attributes = np.flatnonzero(delta)
+        if not len(changed_attributes):
+            return True
+
+        weights = counts.astype(np.float64)
+        affected = self.catalog.rows_with_any(changed_attributes)
+        affected_scores = scoring.packed_additive_scores(self.catalog.masks[affected], weights)
+        # Rows outside the head and without a clicked attribute still score
+        # at most the old threshold, below every (only increased) head row
+        if len(self.rows) >= self.head_size:
+            entering = affected_scores >= self.scores[-1]
+            affected, affected_scores = affected[entering], affected_scores[entering]
+        head_scores = scoring.packed_additive_scores(self.catalog.masks[self.rows], weights)
+
+        rows, first = np.unique(np.concatenate((self.rows, affected)), return_index=True)
+        scores = np.concatenate((head_scores, affected_scores))[first]
+        # np.unique sorts by row, so top_k's positional tie-break is by row
+        top = scoring.top_k(scores, self.head_size)
+        self.rows, self.scores, self.counts = rows[top], scores[top], counts
+        return True
+
+    def top_k(self, k: int, excluded: np.ndarray = None) -> np.ndarray:
+        """
+        Return the k best rows not flagged in `excluded`, or None if the head
+        holds fewer than k of them while the catalog has more.
+        """
+        rows = self.rows if excluded is None else self.rows[~excluded[self.rows]]
+        if len(rows) < k and len(self.rows) < len(self.catalog):
+            return None
+        return rows[:k]
+
+
+class RankerCache:
+    """
+    Bounded LRU of IncrementalRanker per user. A ranker is rebuilt when the
+    catalog was reloaded, a counter decreased (e.g. users were reseeded) or
+    its head ran out of foods the user has not selected yet.
+    """
+
+    def __init__(self, max_size: int, head_size: int):
+        self.max_size = max_size
+        self.head_size = head_size
+        self.rankers = OrderedDict()
+
+    def top_k(self, user_id: str, catalog, counts: np.ndarray, k: int, excluded: np.ndarray,
+              excluded_count: int = 0) -> np.ndarray:
+        """Return the user's k best rows not flagged in `excluded`."""
+        ranker = self.rankers.get(user_id)
+        if ranker is not None and (ranker.catalog is not catalog or not ranker.update(counts)):
+            ranker = None
+        rows = ranker.top_k(k, excluded) if ranker is not None else None
+        if rows is None:
+            ranker = IncrementalRanker(catalog, counts, max(self.head_size, k + excluded_count))
+            rows = ranker.top_k(k, excluded)
+        if self.max_size > 0:
+            self.rankers[user_id] = ranker
+            self.rankers.move_to_end(user_id)
+            while len(self.rankers) > self.max_size:
+                self.rankers.popitem(last=False)
+        return rows
+
+    def clear(self) -> None:
+        self.rankers.clear()
+
+
+class RankingRequest:
+    """
+    Inputs shared by every strategy.
+
+    Attributes:
+        user_id (str): Id of the user to rank for.
+        catalog (Catalog): Catalog to rank.
+        counts (np.ndarray): User's preference counters, in registry order.
+        excluded (np.ndarray): Boolean row mask of foods never to return.
+        excluded_count (int): Number of foods the user selected.
+        k (int): Number of rows wanted.
+        rows (np.ndarray): Sorted candidate rows passing the attribute
+            filters, or None for the whole catalog.
+        selected_foods (set): Ids of the foods the user selected.
+    """
+
+    def __init__(self, user_id: str, catalog, counts: np.ndarray, excluded: np.ndarray, excluded_count: int,
+                 k: int, rows: np.ndarray = None, selected_foods: set = frozenset()):
+        self.user_id = user_id
+        self.catalog = catalog
+        self.counts = counts
+        self.excluded = excluded
+        self.excluded_count = excluded_count
+        self.k = k
+        self.rows = rows
+        self.selected_foods = selected_foods
+
+    def with_k(self, k: int) -> 'RankingRequest':
+        """Return a copy of the request asking for `k` rows."""
+        return RankingRequest(self.user_id, self.catalog, self.counts, self.excluded, self.excluded_count, k,
+                              self.rows, self.selected_foods)
+
+    @property
+    def weights(self) -> np.ndarray:
+        return np.asarray(self.counts, dtype=np.float64)
+
+
+def top_k_by(request: RankingRequest, score_masks, k: int = None) -> np.ndarray:
+    """
+    Score the candidate rows of `request` with `score_masks(masks)` and return
+    the best k (request.k by default), excluded rows left out.
+    """
+    k = request.k if k is None else k
+    if request.rows is None:
+        return scoring.top_k(score_masks(request.catalog.masks), k, request.excluded)
+    rows = request.rows
+    return rows[scoring.top_k(score_masks(request.catalog.masks[rows]), k, request.excluded[rows])]
+
+
+class AdditiveStrategy:
+    """Additive scores, served from the user's incremental ranking head when unfiltered."""
+
+    def __init__(self, ranker_cache: RankerCache):
+        self.ranker_cache = ranker_cache
+
+    def rank(self, request: RankingRequest, k: int = None) -> np.ndarray:
+        k = request.k if k is None else k
+        if request.rows is None:
+            return self.ranker_cache.top_k(
+                request.user_id, request.catalog, request.counts, k, request.excluded, request.excluded_count
+            )
+        return top_k_by(request, lambda masks: scoring.packed_additive_scores(masks, request.weights), k)
+
+
+class CosineStrategy:
+    """
+    Cosine similarity. With an ANN index and a catalog of at least
+    `ann_min_catalog_size` foods, only the probed LSH buckets and the foods
+    added since the index was built are reranked (see ann_index.py).
+    """
+
+    def __init__(self, ann=None, ann_probe_radius: int = 1, ann_min_catalog_size: int = 0):
+        self.ann = ann
+        self.ann_probe_radius = ann_probe_radius
+        self.ann_min_catalog_size = ann_min_catalog_size
+
+    def rank(self, request: RankingRequest) -> np.ndarray:
+        catalog = request.catalog
+        if self.ann is not None and request.rows is None and len(catalog) >= self.ann_min_catalog_size:
+            return self.ann.top_k(catalog, request.weights, request.k, request.excluded, self.ann_probe_radius)
+        return top_k_by(request, lambda masks: scoring.packed_cosine_scores(masks, request.weights))
+
+
+class TfidfStrategy:
+    """
+    Cosine similarity between TF-IDF vectors: the user's counters are the
+    term frequencies, a food's attributes are binary terms, and every
+    attribute is weighted by its smoothed inverse document frequency in the
+    catalog.
+    """
+
+    def rank(self, request: RankingRequest) -> np.ndarray:
+        frequencies = request.catalog.attribute_frequencies()
+        idf = np.log((1 + len(request.catalog)) / (1 + frequencies)) + 1
+        user_weights = request.weights * idf * idf
+        food_norm_weights = idf * idf
+
+        def score(masks):
+            # The user's norm is the same for every food, so it does not change the order
+            dot_products = scoring.packed_additive_scores(masks, user_weights)
+            food_norms = np.sqrt(scoring.packed_additive_scores(masks, food_norm_weights))
+            return np.divide(dot_products, food_norms, out=np.zeros_like(dot_products), where=food_norms > 0)
+
+        return top_k_by(request, score)
+
+
+class MmrStrategy:
+    """
+    Maximal marginal relevance over the best `pool_size` additive candidates:
+    each pick maximises relevance * `relevance_weight` minus the Jaccard
+    similarity to the closest food already picked * (1 - relevance_weight).
+    """
+
+    def __init__(self, additive: AdditiveStrategy, pool_size: int = 30, relevance_weight: float = 0.7):
+        self.additive = additive
+        self.pool_size = pool_size
+        self.relevance_weight = relevance_weight
+
+    def rank(self, request: RankingRequest) -> np.ndarray:
+        pool = self.additive.rank(request, k=max(self.pool_size, request.k))
+        if len(pool) <= 1:
+            return pool[:request.k]
+        masks = request.catalog.masks[pool]
+        relevance = scoring.packed_additive_scores(masks, request.weights)
+        if relevance.max() > 0:
+            relevance = relevance / relevance.max()
+        sizes = scoring.popcount(masks).astype(np.float64)
+
+        picked = [0]
+        max_similarity = np.zeros(len(pool))
+        while len(picked) < min(request.k, len(pool)):
+            last = masks[picked[-1]]
+            shared = scoring.popcount(masks & last).astype(np.float64)
+            union = sizes + sizes[picked[-1]] - shared
+            similarity = np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+            max_similarity = np.maximum(max_similarity, similarity)
+            marginal = self.relevance_weight * relevance - (1 - self.relevance_weight) * max_similarity
+            marginal[picked] = -math.inf
+            # argmax keeps the better ranked candidate on ties
+            picked.append(int(np.argmax(marginal)))
+        return pool[picked]
+
+
+class CooccurrenceBlend:
+    """
+    Blend a strategy with the co-occurrence model (see cooccurrence.py).
+
+    The strategy's best `pool_size` rows get a relevance decreasing linearly
+    with their rank. Neighbours of the user's selected foods are added to
+    the pool, and every candidate is scored by relevance * (1 - `weight`)
+    plus its normalised neighbour score * `weight`. Users without
+    selections, or whose selections have no neighbours, get the strategy's
+    ranking unchanged.
+    """
+
+    def __init__(self, strategy, model, weight: float, pool_size: int = 30):
+        self.strategy = strategy
+        self.model = model
+        self.weight = weight
+        self.pool_size = pool_size
+
+    def rank(self, request: RankingRequest) -> np.ndarray:
+        if not request.selected_foods:
+            return self.strategy.rank(request)
+        neighbours, neighbour_scores = self.model.neighbour_scores(request.catalog, request.selected_foods)
+        eligible = ~request.excluded[neighbours]
+        if request.rows is not None:
+            eligible &= np.isin(neighbours, request.rows, assume_unique=True)
+        neighbours, neighbour_scores = neighbours[eligible], neighbour_scores[eligible]
+        if not len(neighbours):
+            return self.strategy.rank(request)
+
+        pool = self.strategy.rank(request.with_k(max(self.pool_size, request.k)))
+        candidates = np.union1d(pool, neighbours)
+        relevance = np.zeros(len(candidates))
+        relevance[np.searchsorted(candidates, pool)] = 1 - np.arange(len(pool)) / len(pool)
+        cooccurrence = np.zeros(len(candidates))
+        cooccurrence[np.searchsorted(candidates, neighbours)] = neighbour_scores / neighbour_scores.max()
+        scores = (1 - self.weight) * relevance + self.weight * cooccurrence
+        return candidates[scoring.top_k(scores, request.k)]
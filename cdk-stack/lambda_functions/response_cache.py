@@ -0,0 +1,58 @@
+"""Module for caching serialized GET responses in a warm Lambda container"""
+import hashlib
+import json
+from collections import OrderedDict
+
+
+class CachedResponse:
+    """
+    A serialized response body and its entity tag.
+
+    Attributes:
+        body (str): JSON body, serialized once.
+        etag (str): Quoted strong ETag derived from the body.
+    """
+
+    def __init__(self, body: str):
+        self.body = body
+        self.etag = f'"{hashlib.blake2b(body.encode(), digest_size=12).hexdigest()}"'
+
+    def matches(self, if_none_match: str) -> bool:
+        """Return True if an If-None-Match header value names this response."""
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        # Weak comparison, as browsers may send back W/ tags
+        return '*' in tags or self.etag in tags or f'W/{self.etag}' in tags
+
+
+class ResponseCache:
+    """
+    Bounded LRU of serialized responses. Keys must contain every input of
+    the response (e.g. user preference and catalog versions), so entries
+    never need invalidating; stale ones simply stop being requested and age
+    out.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.responses = OrderedDict()
+
+    def get(self, key) -> CachedResponse:
+        response = self.responses.get(key)
+        if response is not None:
+            self.responses.move_to_end(key)
+        return response
+
+    def put(self, key, data) -> CachedResponse:
+        """Serialize `data`, cache it under `key` and return it."""
+        response = CachedResponse(json.dumps(data))
+        if self.max_size > 0:
+            self.responses[key] = response
+            self.responses.move_to_end(key)
+            while len(self.responses) > self.max_size:
+                self.responses.popitem(last=False)
+        return response
+
+    def clear(self) -> None:
+        self.responses.clear()
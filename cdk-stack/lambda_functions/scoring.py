@@ -0,0 +1,144 @@
+"""Module for scoring the food catalog against user preferences with NumPy"""
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger()
+
+# Attributes that fit in one packed uint64 mask per food
+MAX_PACKED_ATTRIBUTES = 64
+# BYTE_BITS[v, i] is bit i of the byte value v
+BYTE_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1, bitorder='little')
+# Number of set bits of every byte value
+POPCOUNT_TABLE = BYTE_BITS.sum(axis=1, dtype=np.uint8)
+
+
+def build_attribute_matrix(food_items: list, food_attributes: list) -> tuple:
+    """
+    Pack the catalog into a dense attribute matrix.
+
+    Parameters:
+        food_items (list): Food items as returned by DynamoDB.
+        food_attributes (list): Food attribute names, in column order.
+
+    Returns:
+        tuple: The list of food ids (row order) and a uint8 matrix of shape
+            (number of foods, number of attributes) holding 1 where the food
+            has the attribute.
+    """
+    food_ids = [food_item['id'] for food_item in food_items]
+    matrix = np.zeros((len(food_items), len(food_attributes)), dtype=np.uint8)
+    for row, food_item in enumerate(food_items):
+        matrix[row] = [bool(food_item.get(attribute)) for attribute in food_attributes]
+    return food_ids, matrix
+
+
+def build_preference_vector(preferences: dict, attribute_index: dict) -> np.ndarray:
+    """
+    Convert a user's preferences map into a weight vector aligned with the
+    columns of the attribute matrix. Missing preferences weigh 0, and
+    preferences absent from `attribute_index` are logged and ignored.
+    """
+    weights = np.zeros(len(attribute_index))
+    unknown_attributes = []
+    for attribute, weight in preferences.items():
+        index = attribute_index.get(attribute)
+        if index is None:
+            unknown_attributes.append(attribute)
+        else:
+            weights[index] = float(weight)
+    if unknown_attributes:
+        logger.warning(f'Ignoring unknown preference attributes: {unknown_attributes}')
+    return weights
+
+
+def top_k(scores: np.ndarray, k: int, excluded: np.ndarray = None) -> np.ndarray:
+    """
+    Return the row indices of the k highest scores, best first.
+
+    Rows flagged in the boolean `excluded` mask are never returned. Ties are
+    broken by row order so the result matches a stable descending sort.
+    """
+    candidates = np.arange(len(scores)) if excluded is None else np.flatnonzero(~excluded)
+    candidate_scores = scores[candidates]
+    if k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    if k < len(candidates):
+        # Partition around the kth best score, then keep the earliest ties
+        kth_index = np.argpartition(-candidate_scores, k - 1)[k - 1]
+        kth_score = candidate_scores[kth_index]
+        above = np.flatnonzero(candidate_scores > kth_score)
+        ties = np.flatnonzero(candidate_scores == kth_score)[:k - len(above)]
+        selected = np.concatenate((above, ties))
+    else:
+        selected = np.arange(len(candidates))
+    order = np.lexsort((selected, -candidate_scores[selected]))
+    return candidates[selected[order]]
+
+
+def pack_masks(matrix: np.ndarray) -> np.ndarray:
+    """
+    Pack an attribute matrix into one uint64 per row, with bit n set when the
+    row has attribute n.
+    """
+    if matrix.shape[1] > MAX_PACKED_ATTRIBUTES:
+        raise ValueError(f'Cannot pack {matrix.shape[1]} attributes into {MAX_PACKED_ATTRIBUTES}-bit masks')
+    packed = np.zeros((len(matrix), 8), dtype=np.uint8)
+    row_bytes = np.packbits(matrix.astype(bool), axis=1, bitorder='little')
+    packed[:, :row_bytes.shape[1]] = row_bytes
+    return packed.view('<u8').ravel()
+
+
+def unpack_masks(masks: np.ndarray, attribute_count: int) -> np.ndarray:
+    """Inverse of pack_masks: return the uint8 attribute matrix of `masks`."""
+    mask_bytes = _mask_bytes(masks)
+    return np.unpackbits(mask_bytes, axis=1, bitorder='little')[:, :attribute_count]
+
+
+def popcount(masks: np.ndarray) -> np.ndarray:
+    """Return the number of attributes set in every mask."""
+    mask_bytes = _mask_bytes(masks)
+    counts = np.zeros(len(masks), dtype=np.uint8)
+    for byte in range(mask_bytes.shape[1]):
+        counts += POPCOUNT_TABLE[mask_bytes[:, byte]]
+    return counts
+
+
+def packed_additive_scores(masks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Score every food as the sum of the user's weights for the attributes set
+    in its packed mask.
+
+    This is a weighted popcount: every byte of the masks is looked up in a
+    256-entry table holding the weight sum of each combination of the 8
+    attributes in that byte, so scoring takes one gather per byte of
+    attributes instead of one multiply per attribute.
+    """
+    padded = np.zeros(MAX_PACKED_ATTRIBUTES)
+    padded[:len(weights)] = weights
+    byte_count = (len(weights) + 7) // 8
+    # tables[b, v] is the total weight of the attributes set in value v of byte b
+    tables = padded.reshape(8, 8)[:byte_count] @ BYTE_BITS.T
+    mask_bytes = _mask_bytes(masks)
+    scores = np.zeros(len(masks))
+    for byte in range(byte_count):
+        scores += tables[byte][mask_bytes[:, byte]]
+    return scores
+
+
+def packed_cosine_scores(masks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Score every food by the cosine similarity between its packed attribute
+    mask and the user's weight vector. Foods or users with no attributes
+    score 0.
+    """
+    weights_norm = np.linalg.norm(weights)
+    denominator = np.sqrt(popcount(masks).astype(np.float64)) * weights_norm
+    dot_products = packed_additive_scores(masks, weights)
+    return np.divide(dot_products, denominator, out=np.zeros_like(dot_products), where=denominator > 0)
+
+
+def _mask_bytes(masks: np.ndarray) -> np.ndarray:
+    """View uint64 masks as (number of masks, 8) little-endian bytes."""
+    return np.ascontiguousarray(masks, dtype='<u8').view(np.uint8).reshape(len(masks), 8)
@@ -0,0 +1,338 @@
+"""
+Module for reading and updating per-user preference vectors.
+
+Each Users item stores its preference counters as one compact list of
+numbers, `preferenceCounts`: one count per attribute, in attribute registry
+order (so new attributes must be appended to the registry). A click
+increments the elements of the list in place with a single update_item,
+conditional on the list being complete, so concurrent clicks of the same
+user add up without a read. `preferenceVersion` is incremented by every
+update.
+
+Users without a complete list (new users, users seeded before an attribute
+was appended, and items in the older formats: the packed binary
+`preferenceVector` or the `preferences` map) get the whole list written
+once, conditional on their preferenceVersion, and are incremented in place
+from then on.
+
+Suggestions precomputed offline (see precompute_suggestions.py) are stored
+next to each user, in the item `suggestions#<user id>` of the same table,
+so the batch job never overwrites the user item itself.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+import attributes
+import food_catalog
+import scoring
+
+
+logger = logging.getLogger()
+
+PREFERENCE_DTYPE = np.dtype('<u4')
+# Attempts of a whole-list preference write before giving up
+MAX_UPDATE_ATTEMPTS = 5
+MAX_USER_ID_LENGTH = 128
+# Id prefix of the items holding precomputed suggestions
+SUGGESTIONS_ID_PREFIX = 'suggestions#'
+# Attributes read from user items and from precomputed suggestion items
+USER_ITEM_ATTRIBUTES = ['id', 'preferenceCounts', 'preferenceVersion', 'selectedFoods', 'preferenceVector',
+                        'preferences']
+SUGGESTIONS_ITEM_ATTRIBUTES = ['id', 'suggestions', 'preferenceVersion', 'catalogVersion', 'strategy']
+
+
+class UserState:
+    """
+    Preferences of one user as held in the warm container.
+
+    Attributes:
+        counts (np.ndarray): Preference counter per attribute, in registry order.
+        selected_foods (set): Ids of the foods the user already picked.
+        version (int): preferenceVersion of the item, 0 if never written.
+        loaded_at (float): time.monotonic() of the read or write.
+        precomputed (dict): Precomputed suggestions item read with the user,
+            or None.
+    """
+
+    def __init__(self, counts: np.ndarray, selected_foods: set, version: int):
+        self.counts = counts
+        self.selected_foods = selected_foods
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.precomputed = None
+
+    def precomputed_suggestions(self, catalog_version: int, strategy: str) -> list:
+        """
+        Return the precomputed suggestions if they were ranked by `strategy`
+        from this preference version and the given catalog version, else None.
+        """
+        item = self.precomputed
+        if item is None or int(item.get('preferenceVersion', -1)) != self.version \
+                or int(item.get('catalogVersion', -1)) != catalog_version or item.get('strategy') != strategy:
+            return None
+        return list(item.get('suggestions', ()))
+
+    @classmethod
+    def from_item(cls, item: dict) -> 'UserState':
+        if 'preferenceCounts' in item:
+            counts = pad_counts([int(count) for count in item['preferenceCounts']])
+        elif 'preferenceVector' in item:
+            counts = pad_counts(np.frombuffer(bytes(item['preferenceVector']), dtype=PREFERENCE_DTYPE))
+        else:
+            weights = scoring.build_preference_vector(item.get('preferences', {}), attributes.USER_ATTRIBUTE_INDEX)
+            counts = weights.astype(PREFERENCE_DTYPE)
+        return cls(counts, set(item.get('selectedFoods', ())), int(item.get('preferenceVersion', 0)))
+
+
+class UserCache:
+    """
+    Bounded LRU of recently active users, so successive requests from one
+    user skip the get_item. Entries older than `ttl_seconds` are dropped,
+    which bounds how stale a user's suggestions can get when their requests
+    are spread across several containers.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.users = OrderedDict()
+
+    def get(self, user_id: str) -> UserState:
+        state = self.users.get(user_id)
+        if state is None:
+            return None
+        if time.monotonic() - state.loaded_at >= self.ttl_seconds:
+            del self.users[user_id]
+            return None
+        self.users.move_to_end(user_id)
+        return state
+
+    def put(self, user_id: str, state: UserState) -> None:
+        if self.max_size <= 0:
+            return
+        self.users[user_id] = state
+        self.users.move_to_end(user_id)
+        while len(self.users) > self.max_size:
+            self.users.popitem(last=False)
+
+    def discard(self, user_id: str) -> None:
+        self.users.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.users.clear()
+
+
+def pad_counts(stored) -> np.ndarray:
+    """Return stored counts in registry order, zero-filling attributes added since they were written."""
+    stored = stored[:len(attributes.USER_ATTRIBUTES)]
+    counts = np.zeros(len(attributes.USER_ATTRIBUTES), dtype=PREFERENCE_DTYPE)
+    counts[:len(stored)] = stored
+    return counts
+
+
+def seed_item(user: dict) -> dict:
+    """Convert a user from user_data.txt to the stored item format."""
+    item = {key: value for key, value in user.items() if key not in ('preferences', 'selectedFoods')}
+    item['preferenceCounts'] = [int(count) for count in UserState.from_item(user).counts]
+    item['preferenceVersion'] = 0
+    return item
+
+
+def suggestions_id(user_id: str) -> str:
+    return f'{SUGGESTIONS_ID_PREFIX}{user_id}'
+
+
+def load_user(user_table, user_id: str, cache: UserCache, consistent: bool = False, dynamodb=None) -> UserState:
+    """
+    Return the user's preferences, from `cache` when possible. Unknown users
+    get empty preferences.
+
+    With `dynamodb`, the user's precomputed suggestions are read in the same
+    BatchGetItem call and attached to the state.
+    """
+    state = None if consistent else cache.get(user_id)
+    if state is None:
+        if dynamodb is not None and not consistent:
+            keys = [{'id': user_id}, {'id': suggestions_id(user_id)}]
+            # One projection applies to both items
+            item_attributes = list(dict.fromkeys(USER_ITEM_ATTRIBUTES + SUGGESTIONS_ITEM_ATTRIBUTES))
+            items = {item['id']: item
+                     for item in food_catalog.batch_get_items(dynamodb, user_table.name, keys, item_attributes)}
+            state = UserState.from_item(items.get(user_id, {}))
+            state.precomputed = items.get(suggestions_id(user_id))
+        else:
+            item = user_table.get_item(Key={'id': user_id}, ConsistentRead=consistent).get('Item', {})
+            state = UserState.from_item(item)
+        cache.put(user_id, state)
+    return state
+
+
+def record_selection(user_table, user_id: str, attribute_counts, food_ids: list, cache: UserCache) -> None:
+    """
+    Add `attribute_counts` to the user's counters and `food_ids` to their
+    selected foods. Users with a complete preferenceCounts list take one
+    update_item; the others get the list written whole, first assuming a
+    new user and otherwise from a consistent read, retried on concurrent
+    updates.
+
+    Raises:
+        ClientError: If the whole-list write still conflicts after
+            MAX_UPDATE_ATTEMPTS.
+    """
+    attribute_counts = np.asarray(attribute_counts, dtype=np.int64)
+    if increment_counts(user_table, user_id, attribute_counts, food_ids):
+        apply_to_cached(cache, user_id, attribute_counts, food_ids)
+        return
+
+    # No complete list yet: the user is new unless the conditional write says otherwise
+    state, expected_version = UserState(pad_counts([]), set(), 0), None
+    for attempt in range(1, MAX_UPDATE_ATTEMPTS + 1):
+        counts = (state.counts + attribute_counts).astype(PREFERENCE_DTYPE)
+        try:
+            user_table.update_item(
+                Key={'id': user_id},
+                # The older formats are superseded by the list
+                UpdateExpression='SET preferenceCounts = :counts ADD preferenceVersion :one, selectedFoods :food_ids '
+                                 'REMOVE preferenceVector, preferences',
+                ConditionExpression='attribute_not_exists(preferenceVersion)' if expected_version is None
+                    else 'preferenceVersion = :expected',
+                ExpressionAttributeValues=dict(
+                    {':counts': [int(count) for count in counts], ':one': 1, ':food_ids': set(food_ids)},
+                    **({} if expected_version is None else {':expected': expected_version})
+                ),
+                ReturnValues='NONE'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Another writer may have completed the list meanwhile
+            if increment_counts(user_table, user_id, attribute_counts, food_ids):
+                apply_to_cached(cache, user_id, attribute_counts, food_ids)
+                return
+            if attempt == MAX_UPDATE_ATTEMPTS:
+                raise
+            logger.info(f'Rereading the preferences of {user_id} (attempt {attempt})')
+            item = user_table.get_item(Key={'id': user_id}, ConsistentRead=True).get('Item', {})
+            state, expected_version = UserState.from_item(item), item.get('preferenceVersion')
+            continue
+        cache.put(user_id, UserState(counts, state.selected_foods | set(food_ids), state.version + 1))
+        return
+
+
+def increment_counts(user_table, user_id: str, attribute_counts: np.ndarray, food_ids: list) -> bool:
+    """
+    Increment the user's preferenceCounts elements in place with one
+    update_item.
+
+    Returns:
+        bool: False, without writing, if the user has no complete list.
+    """
+    increments = []
+    expression_attribute_values = {
+        ':one': 1, ':food_ids': set(food_ids), ':size': len(attributes.USER_ATTRIBUTES)
+    }
+    for index in np.flatnonzero(attribute_counts):
+        increments.append(f'preferenceCounts[{index}] = preferenceCounts[{index}] + :c{index}')
+        expression_attribute_values[f':c{index}'] = int(attribute_counts[index])
+    try:
+        user_table.update_item(
+            Key={'id': user_id},
+            UpdateExpression=(f"SET {', '.join(increments)} " if increments else '')
+                             + 'ADD preferenceVersion :one, selectedFoods :food_ids',
+            ConditionExpression='size(preferenceCounts) = :size',
+            ExpressionAttributeValues=expression_attribute_values,
+            ReturnValues='NONE'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    return True
+
+
+def apply_to_cached(cache: UserCache, user_id: str, attribute_counts: np.ndarray, food_ids: list) -> None:
+    """Apply a written selection to the user's cached state, if any, instead of reading the user back."""
+    state = cache.get(user_id)
+    if state is None:
+        return
+    updated = UserState((state.counts + attribute_counts).astype(PREFERENCE_DTYPE),
+                        state.selected_foods | set(food_ids), state.version + 1)
+    # The cached state is no fresher than before
+    updated.loaded_at = state.loaded_at
+    cache.put(user_id, updated)
+
+
+class PreferenceBuffer:
+    """
+    Coalesces preference increments per user in the warm container, so a
+    burst of clicks becomes one update_item per user per flush
+    interval instead of one per click.
+
+    Pending increments live only in this container: they are lost if the
+    container is recycled before its next flush, which is why coalescing is
+    opt-in.
+    """
+
+    def __init__(self, flush_interval_seconds: float, max_users: int):
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_users = max_users
+        # user id -> (pending counts, pending food ids)
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, user_id: str, attribute_counts, food_ids: list) -> None:
+        with self._lock:
+            counts, selected_foods = self.pending.setdefault(
+                user_id, (np.zeros(len(attributes.USER_ATTRIBUTES), dtype=np.int64), set())
+            )
+            counts += np.asarray(attribute_counts, dtype=np.int64)
+            selected_foods.update(food_ids)
+
+    def apply(self, user_id: str, state: UserState) -> UserState:
+        """Return `state` with the user's pending increments added."""
+        with self._lock:
+            pending = self.pending.get(user_id)
+            if pending is None:
+                return state
+            counts, selected_foods = pending
+            merged = UserState((state.counts + counts).astype(PREFERENCE_DTYPE),
+                               state.selected_foods | selected_foods, state.version)
+        merged.loaded_at = state.loaded_at
+        return merged
+
+    def has_pending(self, user_id: str) -> bool:
+        return user_id in self.pending
+
+    def due(self) -> bool:
+        return bool(self.pending) and (
+            len(self.pending) >= self.max_users
+            or time.monotonic() - self.last_flush >= self.flush_interval_seconds
+        )
+
+    def flush(self, user_table, cache: UserCache) -> int:
+        """
+        Write every user's merged increments. Users whose write fails stay
+        pending for the next flush.
+
+        Returns:
+            int: Number of users written.
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        written = 0
+        for user_id, (counts, selected_foods) in pending.items():
+            try:
+                record_selection(user_table, user_id, counts, list(selected_foods), cache)
+                written += 1
+            except Exception as e:
+                logger.warning(f'Keeping preference increments of {user_id} for the next flush: {e}')
+                self.add(user_id, counts, selected_foods)
+        logger.info(f'Flushed coalesced preferences of {written} users')
+        return written
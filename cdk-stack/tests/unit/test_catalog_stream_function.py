@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_functions')
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import catalog_stream_function
+import food_suggestion_function
+from benchmarks.bench_handler import install
+from benchmarks.fake_dynamodb import FakeDynamoDB
+
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), 'events')
+
+
+def seed(monkeypatch, fake):
+    monkeypatch.chdir(LAMBDA_DIR)
+    install(food_suggestion_function, fake)
+    monkeypatch.setattr(catalog_stream_function, 'dynamodb', fake)
+    monkeypatch.setattr(catalog_stream_function, 'table', fake.Table('Metadata'))
+    response = food_suggestion_function.handler(
+        {'httpMethod': 'POST', 'body': json.dumps({'id': 'add_food_data'}), 'headers': {}}, None
+    )
+    assert response['statusCode'] == 200
+
+
+def indexed_foods(fake) -> list:
+    """Return the foods of the food id index, checking that it is dense and its reverse items agree."""
+    metadata = fake.Table('Metadata').items
+    food_count = int(metadata['catalog']['foodCount'])
+    food_ids = [metadata[f'food_index#{slot}']['foodId'] for slot in range(food_count)]
+    assert f'food_index#{food_count}' not in metadata
+    slots = {key[len('food_slot#'):]: item['slot'] for key, item in metadata.items() if key.startswith('food_slot#')}
+    assert slots == {food_id: slot for slot, food_id in enumerate(food_ids)}
+    return food_ids
+
+
+def test_recorded_stream_event_is_applied(monkeypatch):
+    fake = FakeDynamoDB()
+    seed(monkeypatch, fake)
+    foods = fake.Table('Foods')
+    foods.put_item(Item={'id': 'Honey Toast', 'isSweet': True})
+    foods.delete_item(Key={'id': 'Grilled Chicken'})
+
+    with open(os.path.join(EVENTS_DIR, 'foods_stream_event.json')) as file:
+        stats = catalog_stream_function.handler(json.load(file), None)
+
+    assert stats == {'indexed': 1, 'unindexed': 1, 'catalogVersion': 2}
+    assert sorted(indexed_foods(fake)) == sorted(foods.items)
+    assert fake.Table('Metadata').items['catalog_change#2']['foodIds'] == {'Honey Toast', 'Sushi Rolls', 'Grilled Chicken'}
+    catalog = food_suggestion_function.get_catalog()
+    assert catalog.version == 2 and 'Honey Toast' in catalog.food_ids and 'Grilled Chicken' not in catalog.food_ids
+
+    # Replayed batches leave the index as it is
+    with open(os.path.join(EVENTS_DIR, 'foods_stream_event.json')) as file:
+        assert catalog_stream_function.handler(json.load(file), None)['indexed'] == 0
+    assert sorted(indexed_foods(fake)) == sorted(foods.items)
+
+
+def test_stream_maintains_index_written_by_seeding(monkeypatch):
+    fake = FakeDynamoDB(streams=('Foods',))
+    monkeypatch.setattr(food_suggestion_function, 'CATALOG_CHANGES_FROM_STREAM', True)
+    seed(monkeypatch, fake)
+    metadata = fake.Table('Metadata').items
+    assert 'catalog' not in metadata
+
+    stats = catalog_stream_function.handler(fake.stream_event('Foods'), None)
+    assert stats == {'indexed': 35, 'unindexed': 0, 'catalogVersion': 1}
+    assert sorted(indexed_foods(fake)) == sorted(fake.Table('Foods').items)
+
+    foods = fake.Table('Foods')
+    first, last = indexed_foods(fake)[0], indexed_foods(fake)[-1]
+    for food_id in (first, last):
+        foods.delete_item(Key={'id': food_id})
+    foods.put_item(Item={'id': 'Honey Toast', 'isSweet': True})
+    foods.put_item(Item={'id': 'Honey Toast', 'isSweet': True, 'isCrunchy': True})
+    stats = catalog_stream_function.handler(fake.stream_event('Foods'), None)
+
+    assert stats == {'indexed': 1, 'unindexed': 2, 'catalogVersion': 2}
+    assert len(indexed_foods(fake)) == 34
+    assert sorted(indexed_foods(fake)) == sorted(foods.items)
+    response = food_suggestion_function.handler(
+        {'httpMethod': 'GET', 'queryStringParameters': {'requested_item': 'random_food', 'count': '34'}, 'headers': {}},
+        None
+    )
+    assert sorted(json.loads(response['body']).values()) == sorted(foods.items)
+
+
+def test_modified_foods_missing_from_the_index_are_indexed(monkeypatch):
+    fake = FakeDynamoDB()
+    seed(monkeypatch, fake)
+    # Written before the stream existed, so never indexed
+    fake.Table('Foods').put_item(Item={'id': 'Honey Toast', 'isSweet': True})
+    records = [{'eventName': 'MODIFY', 'dynamodb': {'Keys': {'id': {'S': food_id}}},
+                'eventSourceARN': 'arn:aws:dynamodb:us-west-2:1:table/Foods/stream/1'}
+               for food_id in ('Honey Toast', 'Sushi Rolls')]
+
+    stats = catalog_stream_function.handler({'Records': records}, None)
+    assert stats == {'indexed': 1, 'unindexed': 0, 'catalogVersion': 2}
+    assert sorted(indexed_foods(fake)) == sorted(fake.Table('Foods').items)
+
+
+def test_food_indexed_concurrently_keeps_one_slot(monkeypatch):
+    import food_catalog
+
+    fake = FakeDynamoDB()
+    seed(monkeypatch, fake)
+    foods, metadata = fake.Table('Foods'), fake.Table('Metadata')
+    for food_id in ('Honey Toast', 'Kimchi'):
+        foods.put_item(Item={'id': food_id})
+    claim_slots = metadata.update_item
+
+    def racing_claim(**kwargs):
+        # An overlapping batch indexes one of the foods after this append checked them
+        monkeypatch.setattr(metadata, 'update_item', claim_slots)
+        assert food_catalog.append_to_food_index(fake, metadata, ['Honey Toast']) == 1
+        return claim_slots(**kwargs)
+
+    monkeypatch.setattr(metadata, 'update_item', racing_claim)
+    assert food_catalog.append_to_food_index(fake, metadata, ['Honey Toast', 'Kimchi']) == 1
+    assert sorted(indexed_foods(fake)) == sorted(foods.items)
+
+    assert food_catalog.remove_from_food_index(metadata, 'Honey Toast')
+    assert 'Honey Toast' not in indexed_foods(fake) and len(indexed_foods(fake)) == 36
+
+
+@pytest.mark.parametrize('records', [[], [{'eventName': 'INSERT', 'dynamodb': {'Keys': {'id': {'S': 'x'}}},
+                                          'eventSourceARN': 'arn:aws:dynamodb:us-west-2:1:table/Users/stream/1'}]])
+def test_batches_without_food_changes_keep_the_version(monkeypatch, records):
+    fake = FakeDynamoDB()
+    monkeypatch.setattr(catalog_stream_function, 'dynamodb', fake)
+    monkeypatch.setattr(catalog_stream_function, 'table', fake.Table('Metadata'))
+    assert catalog_stream_function.handler({'Records': records}, None)['catalogVersion'] is None
+    assert fake.Table('Metadata').items == {}
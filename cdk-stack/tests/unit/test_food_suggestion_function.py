@@ -0,0 +1,507 @@
+import json
+import os
+import sys
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_functions')
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import attributes
+import food_suggestion_function
+import user_preferences
+from benchmarks.bench_handler import install
+from benchmarks.fake_dynamodb import FakeDynamoDB
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    # The seeding functions read the data files relative to the working directory
+    monkeypatch.chdir(LAMBDA_DIR)
+    fake = FakeDynamoDB(scan_page_size=10)
+    install(food_suggestion_function, fake)
+    for seed_id in ('add_food_data', 'add_user_data'):
+        response = food_suggestion_function.handler(post_event({'id': seed_id}), None)
+        assert response['statusCode'] == 200
+    return fake
+
+
+def get_event(params):
+    return {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': {}}
+
+
+def post_event(body):
+    return {'httpMethod': 'POST', 'body': json.dumps(body), 'headers': {}}
+
+
+def test_seeding_writes_catalog_and_food_index(dynamodb):
+    foods = dynamodb.Table('Foods').items
+    metadata = dynamodb.Table('Metadata').items
+    assert len(foods) == 35
+    assert metadata['catalog']['foodCount'] == 35
+    assert metadata['catalog']['version'] == 1
+    assert {metadata[f'food_index#{slot}']['foodId'] for slot in range(35)} == set(foods)
+
+
+def test_seeding_indexes_foods_missing_from_the_data_file(monkeypatch):
+    monkeypatch.chdir(LAMBDA_DIR)
+    fake = FakeDynamoDB()
+    install(food_suggestion_function, fake)
+    fake.Table('Foods').put_item(Item={'id': 'Kimchi', 'vegetarian': True})
+    response = food_suggestion_function.handler(post_event({'id': 'add_food_data'}), None)
+    assert response['statusCode'] == 200
+    metadata = fake.Table('Metadata').items
+    assert metadata['catalog']['foodCount'] == 36
+    assert 'Kimchi' in {metadata[f'food_index#{slot}']['foodId'] for slot in range(36)}
+
+
+def test_delete_refuses_internal_metadata(dynamodb):
+    metadata = dynamodb.Table('Metadata')
+    metadata.put_item(Item={'identifier': 'greeting', 'message': 'hello'})
+    delete = lambda body: food_suggestion_function.handler(
+        {'httpMethod': 'DELETE', 'body': json.dumps(body), 'headers': {}}, None
+    )
+    for identifier in ('catalog', 'food_index#0', 'food_slot#Sushi Rolls', 'catalog_change#1'):
+        assert delete({'identifier': identifier})['statusCode'] == 400, identifier
+        assert identifier in metadata.items
+    assert delete({})['statusCode'] == 400
+    assert delete({'identifier': 'greeting'})['statusCode'] == 200
+    assert 'greeting' not in metadata.items
+
+
+def test_random_food_count(dynamodb):
+    response = food_suggestion_function.handler(get_event({'requested_item': 'random_food', 'count': '5'}), None)
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200
+    assert sorted(body) == [f'random_item{i}' for i in range(1, 6)]
+    assert len(set(body.values())) == 5
+
+    # Unicode digits such as '²' pass str.isdigit but not int()
+    for count in ('0', '²', '١٢', '-1', '1.5'):
+        response = food_suggestion_function.handler(get_event({'requested_item': 'random_food', 'count': count}), None)
+        assert response['statusCode'] == 400, count
+
+
+def test_random_food_without_a_complete_food_index(dynamodb):
+    import food_catalog
+
+    metadata = dynamodb.Table('Metadata')
+    event = get_event({'requested_item': 'random_food', 'count': '30'})
+    # Missing slots are made up for from the remaining ones
+    for slot in range(30, 35):
+        metadata.items.pop(f'food_index#{slot}')
+    dynamodb.calls.clear()
+    body = json.loads(food_suggestion_function.handler(event, None)['body'])
+    assert len(set(body.values())) == 30 and dynamodb.calls['Scan'] == 0
+    assert len(food_catalog.sample_food_ids(dynamodb, metadata, 35, 30)) == 30
+
+    # An index with too few foods, or none at all, falls back to the catalog
+    for slot in range(25, 30):
+        metadata.items.pop(f'food_index#{slot}')
+    body = json.loads(food_suggestion_function.handler(event, None)['body'])
+    assert len(set(body.values())) == 30 and dynamodb.calls['Scan'] > 0
+    for key in [key for key in metadata.items if key.startswith('food_index#')] + ['catalog']:
+        metadata.items.pop(key)
+    food_suggestion_function.catalog_cache.invalidate()
+    body = json.loads(food_suggestion_function.handler(event, None)['body'])
+    assert set(body.values()) <= set(dynamodb.Table('Foods').items) and len(set(body.values())) == 30
+
+
+def test_unprocessed_keys_are_retried_with_backoff(dynamodb, monkeypatch):
+    import bulk_ingest
+    import food_catalog
+
+    delays = []
+    monkeypatch.setattr(bulk_ingest, 'backoff', delays.append)
+    batch_get_item = dynamodb.batch_get_item
+
+    def one_key_per_call(RequestItems, **kwargs):
+        (table_name, request), = RequestItems.items()
+        response = batch_get_item(RequestItems={table_name: dict(request, Keys=request['Keys'][:1])})
+        if len(request['Keys']) > 1:
+            response['UnprocessedKeys'] = {table_name: dict(request, Keys=request['Keys'][1:])}
+        return response
+
+    monkeypatch.setattr(dynamodb, 'batch_get_item', one_key_per_call)
+    keys = [{'identifier': f'food_index#{slot}'} for slot in range(3)]
+    assert len(food_catalog.batch_get_items(dynamodb, 'Metadata', keys, ['foodId'])) == 3
+    assert delays == [0, 1]
+
+    delays.clear()
+    keys = [{'identifier': f'food_index#{slot}'} for slot in range(10)]
+    with pytest.raises(RuntimeError):
+        food_catalog.batch_get_items(dynamodb, 'Metadata', keys, ['foodId'])
+    assert delays == [0, 1, 2, 3, 4]
+
+
+def test_click_updates_preferences_and_suggestions(dynamodb):
+    response = food_suggestion_function.handler(
+        post_event({'ids': ['Vanilla Ice Cream', 'Chocolate Brownie'], 'user_id': 'User123'}), None
+    )
+    assert response['statusCode'] == 200
+
+    user = dynamodb.Table('Users').items['User123']
+    assert user['selectedFoods'] == {'Vanilla Ice Cream', 'Chocolate Brownie'}
+    counts = user_preferences.UserState.from_item(user).counts
+    assert counts[attributes.USER_ATTRIBUTE_INDEX['sweet']] == 2
+    assert user['preferenceVersion'] == 1
+    assert len(user['preferenceCounts']) == len(attributes.USER_ATTRIBUTES)
+
+    dynamodb.calls.clear()
+    for _ in range(2):
+        response = food_suggestion_function.handler(
+            get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'}), None
+        )
+        suggestions = json.loads(response['body'])
+        assert list(suggestions) == ['1', '2', '3']
+        assert not {'Vanilla Ice Cream', 'Chocolate Brownie'} & set(suggestions.values())
+        assert dynamodb.Table('Foods').items[suggestions['1']]['isSweet']
+    # The click does not read the user back: it is read by the first request
+    # only, then comes from the hot-user cache next to the catalog version checks
+    assert dynamodb.calls['GetItem'] == 3
+
+
+def test_users_are_independent(dynamodb):
+    event = post_event({'id': 'Vanilla Ice Cream'})
+    event['headers'] = {'X-User-Id': 'visitor-1'}
+    assert food_suggestion_function.handler(event, None)['statusCode'] == 200
+
+    users = dynamodb.Table('Users').items
+    assert users['visitor-1']['selectedFoods'] == {'Vanilla Ice Cream'}
+    assert user_preferences.UserState.from_item(users['User123']).counts.sum() == 0
+
+    # New users get suggestions before their first click
+    response = food_suggestion_function.handler(
+        get_event({'requested_item': 'food_suggestions', 'user_id': 'visitor-2'}), None
+    )
+    assert response['statusCode'] == 200
+    assert len(json.loads(response['body'])) == 3
+
+    for event in (get_event({'requested_item': 'food_suggestions'}), post_event({'id': 'Vanilla Ice Cream'})):
+        assert food_suggestion_function.handler(event, None)['statusCode'] == 400
+
+
+def test_concurrent_preference_updates_add_up(dynamodb):
+    sweet = attributes.USER_ATTRIBUTE_INDEX['sweet']
+    food_suggestion_function.handler(post_event({'id': 'Vanilla Ice Cream', 'user_id': 'User123'}), None)
+    food_suggestion_function.handler(get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'}), None)
+    assert food_suggestion_function.user_cache.get('User123').version == 1
+    # Another container updates the user behind this container's cache
+    other_cache = user_preferences.UserCache(max_size=10, ttl_seconds=60)
+    counts = [0] * len(attributes.USER_ATTRIBUTES)
+    counts[sweet] = 10
+    user_preferences.record_selection(dynamodb.Table('Users'), 'User123', counts, ['Honey Toast'], other_cache)
+
+    dynamodb.calls.clear()
+    response = food_suggestion_function.handler(post_event({'id': 'Chocolate Brownie', 'user_id': 'User123'}), None)
+    assert response['statusCode'] == 200
+    # One write, and no read of the user before or after it
+    assert dynamodb.calls == {'UpdateItem': 1}
+    user = dynamodb.Table('Users').items['User123']
+    assert user['preferenceVersion'] == 3
+    assert user['selectedFoods'] == {'Vanilla Ice Cream', 'Honey Toast', 'Chocolate Brownie'}
+    assert user_preferences.UserState.from_item(user).counts[sweet] == 12
+    # The click is applied to the cached state, which stays as stale as it was
+    state = food_suggestion_function.user_cache.get('User123')
+    assert state.version == 2 and state.counts[sweet] == 2 and 'Chocolate Brownie' in state.selected_foods
+
+
+def test_older_preference_formats_are_converted(dynamodb):
+    sweet = attributes.USER_ATTRIBUTE_INDEX['sweet']
+    packed = user_preferences.pad_counts([]).copy()
+    packed[sweet] = 5
+    users = dynamodb.Table('Users')
+    users.put_item(Item={'id': 'map', 'preferences': {'sweet': 3}, 'preferenceVersion': 4})
+    users.put_item(Item={'id': 'packed', 'preferenceVector': packed.tobytes(), 'preferenceVersion': 0})
+    # Seeded before the last attribute was appended to the registry
+    users.put_item(Item={'id': 'short', 'preferenceCounts': [0] * sweet + [7], 'preferenceVersion': 2})
+    for user_id, expected in (('map', 4), ('packed', 6), ('short', 8)):
+        response = food_suggestion_function.handler(post_event({'id': 'Vanilla Ice Cream', 'user_id': user_id}), None)
+        assert response['statusCode'] == 200
+        user = users.items[user_id]
+        assert len(user['preferenceCounts']) == len(attributes.USER_ATTRIBUTES), user_id
+        assert user['preferenceCounts'][sweet] == expected, user_id
+        assert 'preferences' not in user and 'preferenceVector' not in user
+
+    # Converted users are incremented in place from then on
+    dynamodb.calls.clear()
+    food_suggestion_function.handler(post_event({'id': 'Chocolate Brownie', 'user_id': 'map'}), None)
+    assert dynamodb.calls == {'UpdateItem': 1} and users.items['map']['preferenceCounts'][sweet] == 5
+
+
+def test_unknown_food_is_rejected(dynamodb):
+    response = food_suggestion_function.handler(post_event({'id': 'Not A Food', 'user_id': 'User123'}), None)
+    assert response['statusCode'] == 400
+
+
+def test_malformed_selections_are_rejected(dynamodb):
+    bodies = [
+        {'user_id': 'User123'},
+        {'id': 42, 'user_id': 'User123'},
+        {'id': '', 'user_id': 'User123'},
+        {'ids': 'Vanilla Ice Cream', 'user_id': 'User123'},
+        {'ids': {'id': 'Vanilla Ice Cream'}, 'user_id': 'User123'},
+        {'ids': [], 'id': 'Vanilla Ice Cream', 'user_id': 'User123'},
+        {'ids': ['Vanilla Ice Cream', None], 'user_id': 'User123'},
+        {'ids': [['Vanilla Ice Cream']], 'user_id': 'User123'},
+        ['Vanilla Ice Cream'],
+    ]
+    dynamodb.calls.clear()
+    for body in bodies:
+        response = food_suggestion_function.handler(post_event(body), None)
+        assert response['statusCode'] == 400, body
+    assert dynamodb.calls['UpdateItem'] == 0
+
+
+def test_snapshot_catches_up_from_change_log(dynamodb, monkeypatch, tmp_path):
+    import catalog_snapshot
+    import food_catalog
+
+    path = str(tmp_path / 'catalog_snapshot.bin')
+    catalog_snapshot.write_snapshot(path, food_suggestion_function.get_catalog())
+    snapshot = catalog_snapshot.load_snapshot([str(tmp_path / 'missing.bin'), path], attributes.FOOD_ATTRIBUTES)
+    assert snapshot.version == 1 and len(snapshot) == 35
+    monkeypatch.setattr(food_suggestion_function.catalog_cache, 'snapshot', snapshot)
+    food_suggestion_function.catalog_cache.invalidate()
+
+    metadata = dynamodb.Table('Metadata')
+    dynamodb.Table('Foods').put_item(Item={'id': 'Honey Toast', 'isSweet': True})
+    dynamodb.Table('Foods').delete_item(Key={'id': 'Grilled Chicken'})
+    version = food_catalog.bump_catalog_version(metadata)
+    food_catalog.record_catalog_change(metadata, version, ['Honey Toast', 'Grilled Chicken'])
+    dynamodb.calls.clear()
+
+    catalog = food_suggestion_function.get_catalog()
+    assert dynamodb.calls['Scan'] == 0
+    assert catalog.version == 2 and len(catalog) == 35
+    assert 'Honey Toast' in catalog.food_ids and 'Grilled Chicken' not in catalog.food_ids
+    assert list(catalog.attribute_counts(['Honey Toast'])) == [1] + [0] * (len(attributes.FOOD_ATTRIBUTES) - 1)
+
+    # A change recorded without ids cannot be applied, so Foods is scanned
+    version = food_catalog.bump_catalog_version(metadata)
+    food_catalog.record_catalog_change(metadata, version, [])
+    assert len(food_suggestion_function.get_catalog()) == 35
+    assert dynamodb.calls['Scan'] > 0
+
+
+def test_coalesced_clicks_are_flushed_once_per_user(dynamodb, monkeypatch):
+    buffer = user_preferences.PreferenceBuffer(flush_interval_seconds=3600, max_users=100)
+    monkeypatch.setattr(food_suggestion_function, 'preference_buffer', buffer)
+    dynamodb.calls.clear()
+    for food_id in ('Vanilla Ice Cream', 'Chocolate Brownie'):
+        response = food_suggestion_function.handler(post_event({'id': food_id, 'user_id': 'User123'}), None)
+        assert response['statusCode'] == 200
+    assert dynamodb.calls['UpdateItem'] == 0
+
+    # Pending clicks are visible to the user's own suggestions
+    response = food_suggestion_function.handler(
+        get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'}), None
+    )
+    assert not {'Vanilla Ice Cream', 'Chocolate Brownie'} & set(json.loads(response['body']).values())
+
+    buffer.flush_interval_seconds = 0
+    food_suggestion_function.handler(get_event({'requested_item': 'random_food'}), None)
+    assert dynamodb.calls['UpdateItem'] == 1 and not buffer.pending
+    user = dynamodb.Table('Users').items['User123']
+    assert user['selectedFoods'] == {'Vanilla Ice Cream', 'Chocolate Brownie'}
+    assert user_preferences.UserState.from_item(user).counts[attributes.USER_ATTRIBUTE_INDEX['sweet']] == 2
+
+
+def test_suggestion_filters(dynamodb):
+    food_suggestion_function.handler(post_event({'id': 'Vanilla Ice Cream', 'user_id': 'User123'}), None)
+    response = food_suggestion_function.handler(get_event({
+        'requested_item': 'food_suggestions', 'user_id': 'User123', 'require': 'vegan,glutenFree', 'exclude': 'sweet'
+    }), None)
+    assert response['statusCode'] == 200
+    foods = dynamodb.Table('Foods').items
+    for food_id in json.loads(response['body']).values():
+        assert foods[food_id]['isVegan'] and foods[food_id]['isGlutenFree'] and not foods[food_id]['isSweet']
+
+    response = food_suggestion_function.handler(get_event({
+        'requested_item': 'food_suggestions', 'user_id': 'User123', 'require': 'vegan,notAnAttribute'
+    }), None)
+    assert response['statusCode'] == 400
+    # The message is not quoted the way str(KeyError) would quote it
+    assert "'" not in json.loads(response['body']) and 'notAnAttribute' in json.loads(response['body'])
+
+
+def test_ranking_strategies(dynamodb):
+    food_suggestion_function.handler(post_event({'ids': ['Vanilla Ice Cream', 'BBQ Ribs'], 'user_id': 'User123'}), None)
+    for strategy in ('additive', 'cosine', 'tfidf', 'mmr'):
+        response = food_suggestion_function.handler(get_event({
+            'requested_item': 'food_suggestions', 'user_id': 'User123', 'strategy': strategy
+        }), None)
+        suggestions = list(json.loads(response['body']).values())
+        assert response['statusCode'] == 200 and len(set(suggestions)) == 3, strategy
+        assert not {'Vanilla Ice Cream', 'BBQ Ribs'} & set(suggestions), strategy
+
+    response = food_suggestion_function.handler(get_event({
+        'requested_item': 'food_suggestions', 'user_id': 'User123', 'strategy': 'random'
+    }), None)
+    assert response['statusCode'] == 400
+
+
+def test_suggestions_are_cached_and_revalidated(dynamodb, monkeypatch):
+    event = get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'})
+    first = food_suggestion_function.handler(event, None)
+    etag = first['headers']['ETag']
+    assert first['statusCode'] == 200 and 'no-cache' in first['headers']['Cache-Control']
+
+    # Identical requests are served from the response cache without ranking
+    ranked = []
+    rank = food_suggestion_function.additive_strategy.rank
+    monkeypatch.setattr(food_suggestion_function.additive_strategy, 'rank',
+                        lambda request, k=None: ranked.append(request) or rank(request, k))
+    second = food_suggestion_function.handler(event, None)
+    assert second['body'] == first['body'] and second['headers']['ETag'] == etag
+
+    event['headers'] = {'if-none-match': etag}
+    response = food_suggestion_function.handler(event, None)
+    assert response['statusCode'] == 304 and response['body'] == ''
+    assert not ranked
+
+    # A click bumps the preference version, so the next response is a new entity
+    food_suggestion_function.handler(post_event({'id': json.loads(first['body'])['1'], 'user_id': 'User123'}), None)
+    response = food_suggestion_function.handler(event, None)
+    assert response['statusCode'] == 200 and response['headers']['ETag'] != etag
+    assert len(ranked) == 1
+
+
+def test_user_fetch_overlaps_catalog_version_check(dynamodb, monkeypatch):
+    import threading
+
+    food_suggestion_function.get_catalog()
+    food_suggestion_function.user_cache.clear()
+    # Each GetItem waits until the other one is in flight: issued one after
+    # the other, the first would time out
+    both_in_flight = threading.Barrier(2, timeout=5)
+    overlapped = []
+    for table in (dynamodb.Table('Users'), dynamodb.Table('Metadata')):
+        def get_item(get_item=table.get_item, **kwargs):
+            both_in_flight.wait()
+            overlapped.append(kwargs['Key'])
+            return get_item(**kwargs)
+        monkeypatch.setattr(table, 'get_item', get_item)
+
+    response = food_suggestion_function.handler(
+        get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'}), None
+    )
+    assert response['statusCode'] == 200
+    # The user get_item and the catalog version get_item were in flight together
+    assert sorted(map(str, overlapped)) == ["{'id': 'User123'}", "{'identifier': 'catalog'}"]
+
+
+def test_precomputed_suggestions_are_served_while_current(dynamodb, monkeypatch):
+    import precompute_suggestions
+
+    monkeypatch.setattr(food_suggestion_function, 'PRECOMPUTED_SUGGESTIONS', True)
+    event = get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'})
+    live = json.loads(food_suggestion_function.handler(event, None)['body'])
+
+    users = dynamodb.Table('Users')
+    stats = precompute_suggestions.precompute(
+        dynamodb, precompute_suggestions.iter_users(users), food_suggestion_function.get_catalog()
+    )
+    assert stats['items'] == len(users.items) // 2
+    stored = users.items['suggestions#User123']
+    assert stored['suggestions'] == list(live.values()) and stored['preferenceVersion'] == 0
+
+    # Served without ranking, read together with the user
+    stored['suggestions'] = ['Pad Thai', 'Caesar Salad', 'Sushi Rolls']
+    food_suggestion_function.user_cache.clear()
+    food_suggestion_function.suggestion_cache.clear()
+    dynamodb.calls.clear()
+    response = food_suggestion_function.handler(event, None)
+    assert list(json.loads(response['body']).values()) == stored['suggestions']
+    assert dynamodb.calls['BatchGetItem'] == 1 and dynamodb.calls['GetItem'] == 1
+
+    # After a click the stored list is stale and the user is ranked live
+    food_suggestion_function.handler(post_event({'id': 'Sushi Rolls', 'user_id': 'User123'}), None)
+    suggestions = json.loads(food_suggestion_function.handler(event, None)['body'])
+    assert 'Sushi Rolls' not in suggestions.values() and list(suggestions.values()) != stored['suggestions']
+
+
+def test_several_items_in_one_request(dynamodb):
+    event = get_event({'requested_item': 'random_food,food_suggestions', 'count': '4', 'user_id': 'User123'})
+    dynamodb.calls.clear()
+    response = food_suggestion_function.handler(event, None)
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200 and list(body) == ['random_food', 'food_suggestions']
+    assert sorted(body['random_food']) == [f'random_item{i}' for i in range(1, 5)]
+    # One catalog load and one user read serve both items
+    assert dynamodb.calls['GetItem'] == 2 and dynamodb.calls['BatchGetItem'] == 0
+    suggestions = json.loads(food_suggestion_function.handler(
+        get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'}), None
+    )['body'])
+    assert body['food_suggestions'] == suggestions
+
+    for params in ({'requested_item': 'random_food,bogus'}, {'requested_item': 'random_food,random_food'},
+                   {'requested_item': 'random_food,food_suggestions', 'count': '0', 'user_id': 'User123'},
+                   {'requested_item': 'random_food,food_suggestions'}, {'requested_item': ''},
+                   {'requested_item': ','}, {'requested_item': 'random_food,'}, {'requested_item': 'bogus'},
+                   {'user_id': 'User123'}, None):
+        assert food_suggestion_function.handler(get_event(params), None)['statusCode'] == 400, params
+
+
+def test_click_then_fetch(dynamodb):
+    response = food_suggestion_function.handler(post_event({
+        'ids': ['Vanilla Ice Cream', 'Chocolate Brownie'], 'user_id': 'User123',
+        'requested_item': 'food_suggestions,random_food'
+    }), None)
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200 and body['message'] == 'Success' and len(body['random_food']) == 3
+    assert dynamodb.Table('Users').items['User123']['preferenceVersion'] == 1
+    # The suggestions already account for the click
+    assert body['food_suggestions'] == json.loads(food_suggestion_function.handler(
+        get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'}), None
+    )['body'])
+    assert not {'Vanilla Ice Cream', 'Chocolate Brownie'} & set(body['food_suggestions'].values())
+
+    # Invalid parameters are rejected before the click is recorded
+    response = food_suggestion_function.handler(post_event({
+        'id': 'Sushi Rolls', 'user_id': 'User123', 'requested_item': 'food_suggestions', 'strategy': 'bogus'
+    }), None)
+    assert response['statusCode'] == 400
+    for requested_item in ('', ',', 'random_food,', 'bogus', 'random_food,random_food', [], ['random_food']):
+        response = food_suggestion_function.handler(post_event({
+            'id': 'Sushi Rolls', 'user_id': 'User123', 'requested_item': requested_item
+        }), None)
+        assert response['statusCode'] == 400, requested_item
+    assert dynamodb.Table('Users').items['User123']['preferenceVersion'] == 1
+
+
+def test_click_ids_are_deduplicated_and_capped(dynamodb):
+    response = food_suggestion_function.handler(post_event({
+        'ids': ['Vanilla Ice Cream', 'Vanilla Ice Cream', 'Chocolate Brownie'], 'user_id': 'User123'
+    }), None)
+    assert response['statusCode'] == 200
+    user = dynamodb.Table('Users').items['User123']
+    assert user_preferences.UserState.from_item(user).counts[attributes.USER_ATTRIBUTE_INDEX['sweet']] == 2
+
+    ids = ['Vanilla Ice Cream'] * (food_suggestion_function.MAX_SELECTED_FOODS + 1)
+    response = food_suggestion_function.handler(post_event({'ids': ids, 'user_id': 'User123'}), None)
+    assert response['statusCode'] == 400
+    assert dynamodb.Table('Users').items['User123']['preferenceVersion'] == 1
+
+
+def test_artifact_loaders_are_imported_only_when_their_files_exist(tmp_path):
+    import subprocess
+
+    # A fresh interpreter in a directory without ann_index.npz or cooccurrence.npz
+    script = (
+        'import sys, food_suggestion_function; '
+        'print(sorted(m for m in ("ann_index", "cooccurrence", "catalog_snapshot") if m in sys.modules))'
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(LAMBDA_DIR), CATALOG_SNAPSHOT_PATHS=str(tmp_path / 'missing.bin'))
+    output = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]'
+
+
+def test_empty_sets_are_not_serialized():
+    import dynamo
+
+    assert dynamo.serialize({'a'}) == {'SS': ['a']}
+    with pytest.raises(ValueError):
+        dynamo.serialize(set())
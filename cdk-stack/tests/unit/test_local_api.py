@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_functions')
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+from benchmarks import load_generator, local_api
+
+
+@pytest.fixture
+def api_url(monkeypatch):
+    monkeypatch.chdir(LAMBDA_DIR)
+    server = local_api.create_server(workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}{local_api.RESOURCE_PATH}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('separate_requests, routes', [
+    (False, {'POST add_user_data', 'GET random_food', 'POST click+food_suggestions'}),
+    (True, {'POST add_user_data', 'GET random_food', 'POST click', 'GET food_suggestions'}),
+])
+def test_frontend_journeys_are_replayed(api_url, separate_requests, routes):
+    generator = load_generator.LoadGenerator(api_url, rps=10 * (6 + separate_requests),
+                                             separate_requests=separate_requests)
+    report = asyncio.run(generator.run(duration=0.45))
+
+    assert report['journeys'] == 5
+    assert set(report['routes']) == routes
+    for route, summary in report['routes'].items():
+        assert summary['errors'] == 0, route
+        assert sum(summary['histogram_ms'].values()) == summary['requests']
+    assert report['routes']['GET random_food']['requests'] == 5 * (1 + load_generator.PICKS_PER_JOURNEY)
+
+
+def test_unknown_paths_and_preflight(api_url):
+    url = load_generator.urlsplit(api_url)
+    status_code, data = asyncio.run(load_generator.http_request(url, 'OPTIONS'))
+    assert status_code == 204 and data is None
+    status_code, data = asyncio.run(load_generator.http_request(url._replace(path='/other'), 'GET'))
+    assert status_code == 404
+    status_code, data = asyncio.run(load_generator.http_request(url, 'GET', {'requested_item': 'random_food', 'count': '2'}))
+    assert status_code == 200 and sorted(data) == ['random_item1', 'random_item2']
+
+
+def test_containers_do_not_share_modules(monkeypatch):
+    monkeypatch.chdir(LAMBDA_DIR)
+    server = local_api.create_server(workers=3)
+    try:
+        containers = list(server.containers.queue)
+        for name in ('metrics', 'dynamo', 'food_catalog', 'user_preferences'):
+            assert len({id(getattr(container, name)) for container in containers}) == 3, name
+            assert all(getattr(container, name) is not sys.modules.get(name) for container in containers), name
+        # Seeding made two requests, so one container still has its cold start ahead
+        assert sorted(container.metrics._cold_start for container in containers) == [False, False, True]
+    finally:
+        server.server_close()
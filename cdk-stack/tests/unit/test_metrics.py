@@ -0,0 +1,68 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_functions')
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import dynamo
+import food_suggestion_function
+import metrics
+from benchmarks.bench_handler import get_event, install, seed, synthetic_foods, synthetic_user
+from benchmarks.fake_dynamodb import FakeDynamoDB
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    output = io.StringIO()
+    monkeypatch.setattr(metrics, 'output', output)
+    monkeypatch.setattr(metrics, 'SAMPLE_RATE', 1.0)
+    return lambda: [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_request_emits_one_emf_line(emitted, monkeypatch):
+    import attributes
+
+    fake = FakeDynamoDB(scan_page_size=10)
+    seed(food_suggestion_function, fake, synthetic_foods(50, attributes.FOOD_ATTRIBUTES, 0.3),
+         [synthetic_user('User123', attributes.USER_ATTRIBUTES)])
+    install(food_suggestion_function, fake)
+    event = get_event({'requested_item': 'food_suggestions', 'user_id': 'User123'})
+    assert food_suggestion_function.handler(event, None)['statusCode'] == 200
+
+    record, = emitted()
+    assert record['Route'] == 'GET food_suggestions' and record['StatusCode'] == 200
+    for name in ('CatalogLoadMs', 'UserFetchMs', 'ScoreMs', 'SerializeMs', 'DurationMs'):
+        assert 0 <= record[name] <= record['DurationMs'], name
+    metric_names = {metric['Name'] for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+    assert {'ColdStart', 'ScoreMs', 'ReadCapacityUnits'} <= metric_names
+
+    monkeypatch.setattr(metrics, 'SAMPLE_RATE', 0.0)
+    food_suggestion_function.handler(event, None)
+    assert len(emitted()) == 1
+
+
+def test_dynamodb_capacity_and_counts_are_recorded(emitted):
+    from botocore.stub import Stubber
+
+    client = dynamo.get_client()
+    with Stubber(client) as stubber:
+        stubber.add_response('scan', {
+            'Items': [{'id': {'S': 'Apple'}}], 'Count': 1, 'ScannedCount': 4,
+            'ConsumedCapacity': {'TableName': 'Foods', 'CapacityUnits': 0.5}
+        }, {'TableName': 'Foods', 'ReturnConsumedCapacity': 'TOTAL'})
+        stubber.add_response('update_item', {'ConsumedCapacity': {'TableName': 'Users', 'CapacityUnits': 1.0}})
+
+        metrics.start_request()
+        assert dynamo.DynamoDB().Table('Foods').scan()['Items'] == [{'id': 'Apple'}]
+        dynamo.DynamoDB().Table('Users').update_item(Key={'id': 'User123'}, UpdateExpression='SET a = :a',
+                                                     ExpressionAttributeValues={':a': 1})
+        record = metrics.finish_request(200)
+
+    assert record['DynamoDBCalls'] == 2
+    assert record['ItemsScanned'] == 4 and record['ItemsReturned'] == 1
+    assert record['ReadCapacityUnits'] == 0.5 and record['WriteCapacityUnits'] == 1.0
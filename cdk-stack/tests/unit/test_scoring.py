@@ -0,0 +1,266 @@
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda_functions'))
+
+import scoring
+
+
+FOOD_ATTRIBUTES = ['isSweet', 'isSalty', 'isSour', 'isSpicy', 'isVegan']
+USER_ATTRIBUTES = ['sweet', 'salty', 'sour', 'spicy', 'vegan']
+
+
+def additive_scores(matrix, weights):
+    """Dense reference for scoring.packed_additive_scores."""
+    return matrix @ weights
+
+
+def cosine_scores(matrix, weights):
+    """Dense reference for scoring.packed_cosine_scores."""
+    denominator = np.sqrt(matrix.sum(axis=1, dtype=np.float64)) * np.linalg.norm(weights)
+    dot_products = matrix @ weights
+    return np.divide(dot_products, denominator, out=np.zeros_like(dot_products), where=denominator > 0)
+
+
+def make_foods(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        dict({'id': f'food{i}'}, **{attribute: rng.random() < 0.4 for attribute in FOOD_ATTRIBUTES})
+        for i in range(count)
+    ]
+
+
+def test_additive_scores_match_loop():
+    foods = make_foods(200)
+    preferences = {'sweet': 3, 'salty': 0, 'sour': 1, 'spicy': 5, 'vegan': 2}
+    food_ids, matrix = scoring.build_attribute_matrix(foods, FOOD_ATTRIBUTES)
+    weights = scoring.build_preference_vector(
+        preferences, {attribute: index for index, attribute in enumerate(USER_ATTRIBUTES)}
+    )
+    scores = additive_scores(matrix, weights)
+
+    for food, score in zip(foods, scores):
+        expected = sum(
+            preferences[user_attribute]
+            for food_attribute, user_attribute in zip(FOOD_ATTRIBUTES, USER_ATTRIBUTES)
+            if food[food_attribute]
+        )
+        assert score == expected
+    assert food_ids == [food['id'] for food in foods]
+
+
+def test_cosine_scores_handle_empty_vectors():
+    masks = scoring.pack_masks(np.array([[1, 0, 1], [0, 0, 0]], dtype=np.uint8))
+    scores = scoring.packed_cosine_scores(masks, np.array([1.0, 0.0, 1.0]))
+    assert np.allclose(scores, [1.0, 0.0])
+    assert np.allclose(scoring.packed_cosine_scores(masks, np.zeros(3)), [0.0, 0.0])
+
+
+def test_top_k_matches_stable_sort():
+    rng = np.random.default_rng(1)
+    scores = rng.integers(0, 5, size=500).astype(float)
+    excluded = rng.random(500) < 0.1
+    expected = sorted(
+        (row for row in range(500) if not excluded[row]),
+        key=lambda row: scores[row],
+        reverse=True,
+    )[:7]
+    assert list(scoring.top_k(scores, 7, excluded)) == expected
+    assert list(scoring.top_k(scores[:3], 7)) == sorted(range(3), key=lambda row: scores[row], reverse=True)
+
+
+def make_catalog(food_ids, matrix):
+    import food_catalog
+
+    food_attributes = [f'attribute{i}' for i in range(matrix.shape[1])]
+    return food_catalog.Catalog.from_ids(food_ids, scoring.pack_masks(matrix), food_attributes, version=1)
+
+
+def test_packed_scores_match_matrix_scores():
+    rng = np.random.default_rng(3)
+    matrix = (rng.random((1000, 39)) < 0.3).astype(np.uint8)
+    weights = rng.integers(0, 20, size=39).astype(float)
+    masks = scoring.pack_masks(matrix)
+
+    assert masks.dtype == np.uint64
+    assert np.array_equal(scoring.unpack_masks(masks, 39), matrix)
+    assert np.array_equal(scoring.popcount(masks), matrix.sum(axis=1))
+    assert np.array_equal(scoring.packed_additive_scores(masks, weights), additive_scores(matrix, weights))
+    assert np.allclose(scoring.packed_cosine_scores(masks, weights), cosine_scores(matrix, weights))
+
+
+def test_catalog_lookups_and_attribute_filters():
+    matrix = np.array([[1, 0, 1], [0, 1, 1], [1, 1, 0]], dtype=np.uint8)
+    catalog = make_catalog(['pizza', 'Apple Pie', 'Crème Brûlée'], matrix)
+
+    assert list(catalog.food_ids) == ['Apple Pie', 'Crème Brûlée', 'pizza']
+    assert list(catalog.find(['pizza', 'Soup', 'Apple Pie'])) == [2, -1, 0]
+    assert 'Crème Brûlée' in catalog.food_ids and 'Soup' not in catalog.food_ids
+    assert list(catalog.attribute_counts(['pizza', 'Crème Brûlée'])) == [2, 1, 1]
+    assert list(catalog.excluded_mask({'pizza', 'Soup'})) == [False, False, True]
+    assert list(catalog.matching_rows(required=['attribute1'], forbidden=['attribute0'])) == [0]
+    assert list(catalog.matching_rows(required=['attribute2'])) == [0, 2]
+    assert list(catalog.rows_with_any([0, 1])) == [0, 1, 2]
+
+
+def test_ann_index_round_trip_and_quality(tmp_path):
+    import ann_index
+
+    rng = np.random.default_rng(2)
+    matrix = (rng.random((20000, 39)) < 0.3).astype(np.uint8)
+    food_ids = [f'food{i}' for i in range(len(matrix))]
+    path = str(tmp_path / 'ann_index.npz')
+    ann_index.AnnIndex.build(matrix, food_ids, catalog_version=7).save(path)
+    index = ann_index.load_index(path)
+    assert index.catalog_version == 7 and index.food_ids == food_ids
+
+    # Catalog rows in a different order than the index was built with
+    permutation = rng.permutation(len(matrix))
+    catalog = make_catalog([food_ids[i] for i in permutation], matrix[permutation])
+    weights = rng.integers(0, 6, size=39).astype(float)
+    excluded = np.zeros(len(catalog), dtype=bool)
+    exact_scores = scoring.packed_cosine_scores(catalog.masks, weights)
+    exact = scoring.top_k(exact_scores, 10, excluded)
+    approximate = index.top_k(catalog, weights, 10, excluded, probe_radius=2)
+
+    assert len(approximate) == 10
+    assert exact_scores[approximate].mean() >= 0.95 * exact_scores[exact].mean()
+
+
+def test_ann_index_falls_back_to_exact_search():
+    import ann_index
+
+    matrix = np.eye(5, dtype=np.uint8)
+    index = ann_index.AnnIndex.build(matrix, list('abcde'), catalog_version=1, bits=4)
+    catalog = make_catalog(list('abcde'), matrix)
+    weights = np.array([0, 0, 5.0, 1.0, 0])
+    excluded = np.array([False, False, True, False, False])
+    assert list(index.top_k(catalog, weights, 3, excluded)) == [3, 0, 1]
+    assert ann_index.load_index('does-not-exist.npz') is None
+
+
+def test_stale_ann_index_still_finds_new_foods():
+    import ann_index
+    import ranking
+
+    rng = np.random.default_rng(4)
+    matrix = (rng.random((5000, 39)) < 0.3).astype(np.uint8)
+    food_ids = [f'food{i}' for i in range(len(matrix))]
+    # Built before the last 500 foods were added; the first 100 were removed since
+    index = ann_index.AnnIndex.build(matrix[:4500], food_ids[:4500], catalog_version=1)
+    # Only a food having exactly the user's attributes scores 1: the last one added
+    weights = (rng.random(39) < 0.3).astype(float)
+    matrix[-1] = weights > 0
+    catalog = make_catalog(food_ids[100:], matrix[100:])
+    catalog.version = 2
+    excluded = np.zeros(len(catalog), dtype=bool)
+
+    approximate = index.top_k(catalog, weights, 10, excluded, probe_radius=2)
+    assert catalog.find([food_ids[-1]])[0] in approximate
+    exact_scores = scoring.packed_cosine_scores(catalog.masks, weights)
+    assert exact_scores[approximate].mean() >= 0.95 * exact_scores[scoring.top_k(exact_scores, 10, excluded)].mean()
+
+    # The strategy keeps using the index after the catalog version moved on
+    strategy = ranking.CosineStrategy(index, ann_probe_radius=2)
+    request = ranking.RankingRequest('u', catalog, weights, excluded, 0, 10)
+    assert list(strategy.rank(request)) == list(approximate)
+
+
+def test_incremental_ranker_matches_full_ranking():
+    import ranking
+
+    rng = np.random.default_rng(4)
+    matrix = (rng.random((3000, 39)) < 0.1).astype(np.uint8)
+    catalog = make_catalog([f'food{i}' for i in range(len(matrix))], matrix)
+    counts = np.zeros(39, dtype=np.int64)
+    cache = ranking.RankerCache(max_size=4, head_size=8)
+    excluded = np.zeros(len(catalog), dtype=bool)
+
+    for click in range(40):
+        row = rng.integers(len(catalog))
+        counts += scoring.unpack_masks(catalog.masks[[row]], 39)[0]
+        excluded[row] = True
+        scores = scoring.packed_additive_scores(catalog.masks, counts.astype(float))
+        expected = scoring.top_k(scores, 5, excluded)
+        assert list(cache.top_k('user', catalog, counts, 5, excluded, click + 1)) == list(expected)
+
+    # Lower counters (e.g. after reseeding) force a rebuild
+    counts[:] = 0
+    assert list(cache.top_k('user', catalog, counts, 5, excluded, 40)) == \
+        list(scoring.top_k(np.zeros(len(catalog)), 5, excluded))
+
+
+def test_tfidf_and_mmr_strategies():
+    import ranking
+
+    rng = np.random.default_rng(5)
+    matrix = (rng.random((400, 39)) < 0.3).astype(np.uint8)
+    catalog = make_catalog([f'food{i:03d}' for i in range(len(matrix))], matrix)
+    counts = rng.integers(0, 5, size=39)
+    excluded = np.zeros(len(catalog), dtype=bool)
+    excluded[:50] = True
+    request = ranking.RankingRequest('user', catalog, counts, excluded, 50, k=5)
+
+    idf = np.log((1 + 400) / (1 + matrix.sum(axis=0))) + 1
+    expected = scoring.top_k(cosine_scores(matrix * idf, counts * idf), 5, excluded)
+    assert list(ranking.TfidfStrategy().rank(request)) == list(expected)
+
+    additive = ranking.AdditiveStrategy(ranking.RankerCache(max_size=1, head_size=8))
+    pool = additive.rank(request, k=30)
+    picked = ranking.MmrStrategy(additive, pool_size=30, relevance_weight=0.7).rank(request)
+    assert len(set(picked)) == 5 and set(picked) <= set(pool) and picked[0] == pool[0]
+    # Pure relevance degenerates to the additive order
+    assert list(ranking.MmrStrategy(additive, relevance_weight=1).rank(request)) == list(pool[:5])
+
+
+def test_cooccurrence_model_build_and_blend(tmp_path, monkeypatch):
+    import cooccurrence
+    import ranking
+
+    food_ids = [f'food{i}' for i in range(12)]
+    rng = random.Random(3)
+    # Foods 0-3 and 4-7 are selected together; 8-11 only ever alone
+    selections = [rng.sample(food_ids[:4], 3) for _ in range(40)] + [rng.sample(food_ids[4:8], 2) for _ in range(40)]
+    selections += [[food_id, 'not in the catalog'] for food_id in food_ids[8:]]
+    sorted_ids = np.array(sorted(food_ids), dtype='S')
+    chunks = [selections[i:i + 25] for i in range(0, len(selections), 25)]
+
+    serial = cooccurrence.build_model(sorted_ids, 4, cooccurrence._map_chunk, chunks, processes=1, neighbours=2)
+    parallel = cooccurrence.build_model(sorted_ids, 4, cooccurrence._map_chunk, chunks, processes=2, neighbours=2)
+    assert np.array_equal(serial.indptr, parallel.indptr) and np.array_equal(serial.indices, parallel.indices)
+    assert np.allclose(serial.weights, parallel.weights)
+
+    # Counting a chunk in batches of a few users' pairs gives the same counts
+    pairs, frequencies = cooccurrence.count_pairs(selections, sorted_ids, 3)
+    monkeypatch.setattr(cooccurrence, 'MAX_PAIRS_PER_BATCH', 10)
+    batched_pairs, batched_frequencies = cooccurrence.count_pairs(selections, sorted_ids, 3)
+    assert np.array_equal(frequencies, batched_frequencies)
+    for (keys, counts), (batched_keys, batched_counts) in zip(pairs, batched_pairs):
+        assert np.array_equal(keys, batched_keys) and np.array_equal(counts, batched_counts)
+
+    path = str(tmp_path / 'cooccurrence.npz')
+    serial.save(path)
+    model = cooccurrence.load_model(path)
+    assert model.catalog_version == 4 and np.diff(model.indptr).max() == 2
+    neighbours = model.food_ids[model.indices[model.indptr[0]:model.indptr[1]]]
+    assert set(neighbours) <= {b'food1', b'food2', b'food3'}
+
+    matrix = np.zeros((len(food_ids), 39), dtype=np.uint8)
+    matrix[8:, 0] = 1
+    catalog = make_catalog(food_ids, matrix)
+    counts = np.zeros(39, dtype=np.uint32)
+    counts[0] = 1
+    rows, scores = model.neighbour_scores(catalog, ['food4'])
+    assert len(rows) == 2 and {catalog.food_ids[row] for row in rows} <= {'food5', 'food6', 'food7'}
+
+    excluded = catalog.excluded_mask({'food4'})
+    request = ranking.RankingRequest('User123', catalog, counts, excluded, 1, 3, selected_foods={'food4'})
+    base = ranking.TfidfStrategy()
+    # The attribute ranking alone only knows foods 8-11
+    assert {catalog.food_ids[row] for row in base.rank(request)} <= {f'food{i}' for i in range(8, 12)}
+    blended = ranking.CooccurrenceBlend(base, model, weight=0.6).rank(request)
+    assert catalog.food_ids[blended[0]] in {'food5', 'food6', 'food7'}
+    assert 'food4' not in {catalog.food_ids[row] for row in blended}